@@ -90,7 +90,8 @@ ASGI_APPLICATION = "E_Platform.asgi.application"
 # Channels configuration
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        # Redis layer with pipelined bulk group add/discard
+        "BACKEND": "chatting.layers.PipelinedRedisChannelLayer",
         "CONFIG": {
             "hosts": [("127.0.0.1", 6379)],
             "capacity": 1500,  # Maximum number of messages in channel layer
@@ -99,6 +100,96 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Chat presence settings
+CHAT_PRESENCE_TTL = 90  # Seconds a user stays online without a heartbeat
+CHAT_PRESENCE_FLUSH_INTERVAL = 5  # Seconds between coalesced UserStatus writes
+# Only join groups of conversations active in the last N days on connect
+# (None joins all); older ones are joined on demand via the user group
+CHAT_LAZY_SUBSCRIBE_DAYS = None
+CHAT_SYNC_CHUNK_SIZE = 100  # Pending messages per batched frame on reconnect
+# Delta sync (REST and the "sync" WebSocket command): new messages returned
+# per conversation per response, and conversations accepted per request
+CHAT_DELTA_SYNC_LIMIT = 100
+CHAT_DELTA_SYNC_MAX_CONVERSATIONS = 200
+# Token bucket shared by WebSocket and REST chat messages: burst of
+# CHAT_MESSAGE_RATE_LIMIT, refilled over CHAT_MESSAGE_RATE_PERIOD seconds
+CHAT_MESSAGE_RATE_LIMIT = 10
+CHAT_MESSAGE_RATE_PERIOD = 60
+# Group commit: buffer chat message inserts for up to MAX_DELAY_MS or
+# MAX_ROWS messages and write them in one transaction
+CHAT_GROUP_COMMIT = False
+CHAT_GROUP_COMMIT_MAX_DELAY_MS = 5
+CHAT_GROUP_COMMIT_MAX_ROWS = 100
+# Outbound WebSocket frames: typing, read receipts and status updates are
+# coalesced and sent as one array frame every FLUSH_MS; at most MAX_PENDING
+# of them are held per socket before the oldest ephemeral ones are dropped
+CHAT_OUTBOUND_FLUSH_MS = 50
+CHAT_OUTBOUND_MAX_PENDING = 100
+CHAT_TYPING_TIMEOUT = 5  # Seconds without a typing event before "stopped typing"
+# Delivery retries for pending messages: due CHAT_DELIVERY_RETRY_BASE seconds
+# after sending, doubling after every attempt up to MAX_ATTEMPTS times.
+# Messages to offline recipients stay pending and are streamed on reconnect.
+# A pass handles at most MAX_BATCHES keyset batches of BATCH_SIZE messages.
+CHAT_DELIVERY_RETRY_BASE = 30
+CHAT_DELIVERY_MAX_ATTEMPTS = 10
+CHAT_DELIVERY_RETRY_BATCH_SIZE = 200
+CHAT_DELIVERY_RETRY_MAX_BATCHES = 10
+# Single-node mode: run a pass every INTERVAL seconds inside the ASGI process.
+# With several processes keep this off and run "manage.py retry_message_delivery --loop"
+CHAT_DELIVERY_RETRY_IN_PROCESS = False
+CHAT_DELIVERY_RETRY_INTERVAL = 30
+# Notification outbox: notifications are queued with the write that created
+# them and pushed to sockets by a dispatcher, in batches of BATCH_SIZE (at
+# most MAX_BATCHES per pass, a pass every INTERVAL seconds). Failed sends are
+# retried after RETRY_BASE seconds, doubling, until MAX_ATTEMPTS.
+# IN_PROCESS runs the dispatcher inside the ASGI process; with several
+# processes turn it off and run "manage.py dispatch_notifications --loop"
+NOTIFICATION_OUTBOX_IN_PROCESS = True
+NOTIFICATION_OUTBOX_INTERVAL = 1
+NOTIFICATION_OUTBOX_BATCH_SIZE = 200
+NOTIFICATION_OUTBOX_MAX_BATCHES = 10
+NOTIFICATION_OUTBOX_RETRY_BASE = 5
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 8
+NOTIFICATION_OUTBOX_CLAIM_TIMEOUT = 60
+
+# Notification coalescing: likes and comments on one post fold into a single
+# unread entry ("alice and 41 others liked your post") for COALESCE_WINDOW
+# seconds from its first activity. The first activity is pushed at once,
+# later ones share one socket update per PUSH_INTERVAL seconds
+NOTIFICATION_COALESCE_WINDOW = 3600
+NOTIFICATION_PUSH_INTERVAL = 30
+
+# Unread notification counters: one row per user, adjusted in the same
+# transaction as every read-state change and mirrored in the cache (Redis
+# when it is the cache backend) for CACHE_TTL seconds. Run
+# "manage.py reconcile_notification_counters" periodically (e.g. hourly
+# from cron) to fix counters that drifted
+NOTIFICATION_COUNTER_CACHE_TTL = 300
+
+# Posts and comments store their content rendered with linked @mentions.
+# Renaming or deleting a user renders the content mentioning them again in
+# a background thread; with IN_PROCESS off, run "manage.py render_mentions"
+# instead (also used once to fill in content saved before this existed)
+MENTION_RERENDER_IN_PROCESS = True
+# Message archive ("manage.py archive_messages"): messages older than
+# AFTER_DAYS move from the message table into gzip segment files of up to
+# SEGMENT_SIZE messages, stored under CHAT_ARCHIVE_PATH in default storage
+CHAT_ARCHIVE_AFTER_DAYS = 365
+CHAT_ARCHIVE_SEGMENT_SIZE = 1000
+CHAT_ARCHIVE_PATH = "chat_archive"
+# Chunked, resumable attachment uploads: largest file, largest chunk per
+# request, and idle hours before "manage.py purge_uploads" discards them
+CHAT_UPLOAD_MAX_SIZE = 100 * 1024 * 1024
+CHAT_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+CHAT_UPLOAD_SESSION_TTL_HOURS = 24
+# Message search: a search ranks its best MAX_RESULTS matches once and pages
+# through them from a cached snapshot kept for SNAPSHOT_TTL seconds. Up to
+# MAX_MATCH_CONVERSATIONS conversations are matched as index tokens; users in
+# more are filtered by joining their memberships
+MESSAGE_SEARCH_MAX_RESULTS = 1000
+MESSAGE_SEARCH_SNAPSHOT_TTL = 600
+MESSAGE_SEARCH_MAX_MATCH_CONVERSATIONS = 50
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -212,6 +303,25 @@ STATICFILES_DIRS = [
 # Media files (User uploads)
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Uploads are stored once per distinct content under MEDIA_ROOT/MEDIA_BLOB_DIR
+# and hard-linked to their names; see home.utils_storage
+MEDIA_BLOB_DIR = ".blobs"
+
+# Resized image variants (home.services.image_variant_service): generated by
+# a pool of IMAGE_VARIANT_WORKERS threads in the web process, or only by
+# "manage.py process_image_variants --loop" when IN_PROCESS is off
+IMAGE_VARIANTS_IN_PROCESS = True
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANT_MAX_ATTEMPTS = 3
+
+STORAGES = {
+    "default": {
+        "BACKEND": "home.utils_storage.DedupFileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
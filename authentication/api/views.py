@@ -138,8 +138,7 @@ class ProfilePictureUploadView(APIView):
 
                 # Delete old profile picture if exists
                 if request.user.profile_picture:
-                    if os.path.isfile(request.user.profile_picture.path):
-                        os.remove(request.user.profile_picture.path)
+                    default_storage.delete(request.user.profile_picture.name)
 
                 # Save the new profile picture
                 request.user.profile_picture.save(filename, processed_image, save=True)
@@ -148,8 +147,7 @@ class ProfilePictureUploadView(APIView):
 
                 # Delete old profile picture if exists
                 if request.user.profile_picture:
-                    if os.path.isfile(request.user.profile_picture.path):
-                        os.remove(request.user.profile_picture.path)
+                    default_storage.delete(request.user.profile_picture.name)
 
                 # Generate a unique filename
                 filename = f"profile_{request.user.id}_{os.path.splitext(profile_picture.name)[1]}"
@@ -13,8 +13,8 @@ class ConversationAdmin(admin.ModelAdmin):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'sender', 'content_preview', 'conversation', 'is_read', 'timestamp')
-    list_filter = ('is_read', 'timestamp')
+    list_display = ('id', 'sender', 'content_preview', 'conversation', 'delivery_status', 'timestamp')
+    list_filter = ('delivery_status', 'timestamp')
     search_fields = ('content', 'sender__username')
     date_hierarchy = 'timestamp'
     
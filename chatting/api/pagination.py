@@ -0,0 +1,190 @@
+import base64
+import binascii
+import json
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from home.api.pagination import KeysetPagination
+
+
+class MessageCursorPagination(KeysetPagination):
+    """
+    Keyset pagination of messages on (timestamp, id), newest first.
+
+    Each page is a range scan of the (conversation, timestamp, id) index
+    bounded by the cursor, so page cost does not grow with the conversation
+    size and no COUNT query is issued. The id tie-breaker keeps messages that
+    share a timestamp from being skipped or repeated across pages.
+
+    The ``cursor`` query parameter is opaque to clients; ``next`` links page
+    towards older messages and ``previous`` links towards newer ones. The
+    older before_id/after_id parameters are still accepted.
+    """
+
+    ordering_field = "timestamp"
+    page_size = 50
+    min_page_size = 10
+
+    def extend_results(self, view, direction, cursor, results):
+        """
+        Continue a page into archived history when the hot rows run out.
+
+        Archived messages are all older than the hot ones, so they follow the
+        hot rows when paging back and precede them when paging forward. The
+        archive is only consulted when the page reaches past
+        ``Conversation.archived_until``.
+        """
+        from chatting.services.archive_service import ArchiveService
+
+        conversation = getattr(view, "conversation", None)
+        if conversation is None or conversation.archived_until is None:
+            return results
+
+        wanted = self.page_size + 1
+        if direction == "before":
+            if len(results) == wanted:
+                return results
+            boundary = results[-1] if results else None
+            if boundary is not None:
+                position = (boundary.timestamp, boundary.id)
+            elif cursor is not None:
+                position = cursor[1:]
+            else:
+                position = (None, None)
+            return results + ArchiveService.read(
+                conversation.id, "before", *position, limit=wanted - len(results)
+            )
+
+        _, timestamp, message_id = cursor
+        if timestamp > conversation.archived_until:
+            return results
+        archived = ArchiveService.read(
+            conversation.id, "after", timestamp, message_id, limit=wanted
+        )
+        return (archived + results)[:wanted]
+
+
+class MessageSearchPagination(pagination.BasePagination):
+    """
+    Pagination of full-text search results, best first.
+
+    BM25 scores change as messages are added, edited and deleted, so they
+    make no stable cursor, and ranking scores the whole match set. The first
+    page therefore ranks the matches once (up to MESSAGE_SEARCH_MAX_RESULTS)
+    and, if there is more than a page, caches the ranked IDs for
+    MESSAGE_SEARCH_SNAPSHOT_TTL seconds. The cursor holds the snapshot's key
+    and an offset, so later pages are slices of it: no result is repeated
+    or skipped, and no page searches again. An expired cursor is a 404;
+    the client starts the search over.
+
+    Only the messages of the current page are loaded from the message table.
+    """
+
+    query_param = "q"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 20
+    max_page_size = 50
+    invalid_cursor_message = "Invalid cursor"
+    expired_cursor_message = "Search results expired, search again"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        from chatting.services.search_service import SearchService
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            terms = SearchService.tokenize(request.query_params.get(self.query_param))
+            ranked = [message_id for message_id, _ in SearchService.search(request.user.id, terms)]
+            token, offset = None, 0
+            if len(ranked) > self.page_size:
+                token = secrets.token_urlsafe(16)
+                cache.set(
+                    self.get_snapshot_key(token),
+                    {"user_id": request.user.id, "ids": ranked},
+                    self.get_snapshot_ttl(),
+                )
+        else:
+            token, offset = cursor
+            snapshot = cache.get(self.get_snapshot_key(token))
+            if snapshot is None or snapshot["user_id"] != request.user.id:
+                raise NotFound(self.expired_cursor_message)
+            ranked = snapshot["ids"]
+
+        page_ids = ranked[offset : offset + self.page_size]
+        self.token = token
+        self.next_offset = offset + self.page_size if len(ranked) > offset + self.page_size else None
+
+        # Messages outside the queryset (e.g. deleted since) are dropped
+        messages = queryset.in_bulk(page_ids)
+        return [messages[message_id] for message_id in page_ids if message_id in messages]
+
+    def get_snapshot_ttl(self):
+        return getattr(settings, "MESSAGE_SEARCH_SNAPSHOT_TTL", 600)
+
+    def get_snapshot_key(self, token):
+        return f"message_search:{token}"
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError, TypeError):
+            return self.page_size
+        return min(max(1, page_size), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """
+        Decode the cursor query parameter.
+
+        Returns:
+            (snapshot token, offset) tuple, or None without a cursor
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            token, offset = str(data["k"]), int(data["o"])
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if offset < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return token, offset
+
+    def encode_cursor(self, token, offset):
+        data = {"k": token, "o": offset}
+        return base64.urlsafe_b64encode(
+            json.dumps(data, separators=(",", ":")).encode("ascii")
+        ).decode("ascii")
+
+    def get_next_link(self):
+        if self.next_offset is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.token, self.next_offset),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -1,7 +1,9 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from chatting.models import Conversation, Message, UserStatus
+from chatting.models import Conversation, InboxEntry, Message, UserStatus
+from chatting.services.read_service import ReadService
+from home.services.image_variant_service import ImageVariantService
 
 User = get_user_model()
 
@@ -20,7 +22,8 @@ class UserSerializer(serializers.ModelSerializer):
             return False
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageContentSerializer(serializers.ModelSerializer):
+    """A message with its sender and attachment, without per-reader state."""
     sender_name = serializers.SerializerMethodField()
     sender_picture = serializers.SerializerMethodField()
     file_url = serializers.SerializerMethodField()
@@ -29,8 +32,7 @@ class MessageSerializer(serializers.ModelSerializer):
         model = Message
         fields = [
             'id', 'conversation', 'sender', 'sender_name', 'sender_picture',
-            'content', 'timestamp', 'is_read', 'delivery_status',
-            'is_edited', 'edited_timestamp', 'is_deleted', 'deleted_timestamp',
+            'content', 'timestamp', 'is_edited', 'edited_timestamp',
             'file_attachment', 'file_url', 'file_type', 'file_name', 'file_size'
         ]
 
@@ -53,6 +55,40 @@ class MessageSerializer(serializers.ModelSerializer):
         return None
 
 
+class MessageSerializer(MessageContentSerializer):
+    is_read = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+
+    class Meta(MessageContentSerializer.Meta):
+        fields = [
+            'id', 'conversation', 'sender', 'sender_name', 'sender_picture',
+            'content', 'timestamp', 'is_read', 'delivery_status',
+            'is_edited', 'edited_timestamp', 'is_deleted', 'deleted_timestamp',
+            'file_attachment', 'file_url', 'file_type', 'file_name', 'file_size',
+            'image_variants'
+        ]
+
+    def get_is_read(self, obj):
+        # Views listing many messages pass the watermarks in once
+        return ReadService.is_read_by_others(obj, self.context.get('read_positions'))
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data['is_read']:
+            data['delivery_status'] = 'read'
+        return data
+
+    def get_image_variants(self, obj):
+        # Resized copies of image attachments; the original until generated
+        return ImageVariantService.for_serializer(self, self._image_name(obj), self._image_name)
+
+    @staticmethod
+    def _image_name(message):
+        if message.file_type == 'image' and message.file_attachment:
+            return message.file_attachment.name
+        return None
+
+
 class ConversationSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
@@ -69,8 +105,41 @@ class ConversationSerializer(serializers.ModelSerializer):
         return None
 
     def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
         user = self.context.get('request').user
-        return Message.objects.filter(conversation=obj, is_read=False).exclude(sender=user).count()
+        return ReadService.unread_messages(user).filter(conversation=obj).count()
+
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """Conversation list item read from the materialized inbox."""
+    id = serializers.IntegerField(source='conversation_id', read_only=True)
+    participants = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField(source='conversation.created_at', read_only=True)
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = InboxEntry
+        fields = ['id', 'participants', 'created_at', 'updated_at', 'last_message', 'unread_count']
+
+    def get_participants(self, obj):
+        participants = [obj.user] + ([obj.other_user] if obj.other_user else [])
+        return UserSerializer(participants, many=True).data
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'conversation': obj.conversation_id,
+            'sender': obj.last_message_sender_id,
+            'content': obj.last_message_content,
+            'timestamp': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
+
+class MessageSearchResultSerializer(MessageContentSerializer):
+    """Search hit; read state is left out as hits span many conversations."""
 
 
 class StartConversationSerializer(serializers.Serializer):
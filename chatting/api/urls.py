@@ -13,6 +13,17 @@ urlpatterns = [
     path('conversations/<int:pk>/add_message/', views.AddMessageView.as_view(), name='add_message'),
     path('conversations/<int:pk>/mark_read/', views.MarkMessagesReadView.as_view(), name='mark_messages_read'),
 
+    # Chunked, resumable attachment uploads
+    path('conversations/<int:pk>/uploads/', views.StartUploadView.as_view(), name='start_upload'),
+    path('uploads/<uuid:upload_id>/', views.UploadChunkView.as_view(), name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/finalize/', views.FinalizeUploadView.as_view(), name='finalize_upload'),
+
+    # Delta sync after a reconnect
+    path('sync/', views.SyncView.as_view(), name='sync'),
+
+    # Full-text message search
+    path('search/', views.MessageSearchView.as_view(), name='message_search'),
+
     # User status APIs
     path('users/', views.UserListView.as_view(), name='user_list'),
     path('users/<int:pk>/status/', views.UserStatusView.as_view(), name='user_status'),
@@ -21,6 +32,9 @@ urlpatterns = [
     # Message count API
     path('unread-count/', views.UnreadMessageCountView.as_view(), name='unread_count'),
 
+    # Rate limiter counters (staff only)
+    path('rate-limits/', views.RateLimitStatsView.as_view(), name='rate_limit_stats'),
+
     # Message editing and deletion APIs
     path('messages/<int:pk>/edit/', views.EditMessageView.as_view(), name='edit_message'),
     path('messages/<int:pk>/delete/', views.DeleteMessageView.as_view(), name='delete_message'),
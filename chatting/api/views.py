@@ -1,13 +1,23 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models import Q, Sum
 from django.utils import timezone
-from rest_framework import generics, status, permissions, pagination, parsers
+from rest_framework import generics, status, permissions, parsers
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from chatting.models import Conversation, Message, UserStatus
+from chatting.models import Conversation, InboxEntry, Message, UploadSession, UserStatus
+from home.utils_ratelimit import RATE_LIMITERS, ChatMessageThrottle
+from chatting.services.inbox_service import InboxService
+from chatting.services.membership_service import MembershipService
+from chatting.services.read_service import ReadService
+from chatting.services.search_service import SearchService
+from chatting.services.sync_service import SyncService
+from chatting.services.upload_service import UploadOffsetMismatch, UploadService
+from .pagination import MessageCursorPagination, MessageSearchPagination
 from .serializers import (
     ConversationSerializer,
+    InboxEntrySerializer,
+    MessageSearchResultSerializer,
     MessageSerializer,
     StartConversationSerializer,
     UserSerializer,
@@ -18,11 +28,18 @@ User = get_user_model()
 
 class ConversationListView(generics.ListAPIView):
     """API view for listing all conversations for the current user."""
-    serializer_class = ConversationSerializer
+    serializer_class = InboxEntrySerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Conversation.objects.filter(participants=self.request.user)
+        # One indexed query on the user's materialized inbox
+        return (
+            InboxEntry.objects.filter(user=self.request.user)
+            .select_related(
+                'conversation', 'user__chat_status', 'other_user__chat_status'
+            )
+            .order_by('-updated_at')
+        )
 
 
 class ConversationDetailView(generics.RetrieveAPIView):
@@ -61,28 +78,21 @@ class StartConversationView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Check if a conversation already exists between these users
-            conversation = Conversation.objects.filter(
-                participants=request.user
-            ).filter(
-                participants=other_user
-            ).first()
-
-            # If no conversation exists, create a new one
-            if conversation is None:
-                conversation = Conversation.objects.create()
-                conversation.participants.add(request.user, other_user)
-                conversation.save()
+            # Reuse the existing conversation between these users or create one
+            conversation, _ = MembershipService.get_or_create_direct_conversation(
+                request.user.id, other_user.id
+            )
 
             # Create an initial message if one was provided
             if initial_message:
-                Message.objects.create(
+                message = Message.objects.create(
                     conversation=conversation,
                     sender=request.user,
                     content=initial_message
                 )
                 # Update the conversation timestamp
                 conversation.update_timestamp()
+                InboxService.messages_created([message])
 
             # Return the conversation details
             return Response(
@@ -94,107 +104,50 @@ class StartConversationView(APIView):
 
 
 class MessageListView(generics.ListAPIView):
-    """API view for listing messages in a conversation with pagination."""
+    """API view for listing messages in a conversation with cursor pagination."""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = pagination.PageNumberPagination
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
         conversation_id = self.kwargs.get('pk')
 
-        # Get pagination parameters
-        page_size = self.request.query_params.get('page_size', 50)
-        try:
-            page_size = int(page_size)
-            # Limit page size to prevent performance issues
-            page_size = min(max(10, page_size), 100)
-            self.pagination_class.page_size = page_size
-        except (ValueError, TypeError):
-            pass
+        # Check if the user is a participant in the conversation
+        conversation = Conversation.objects.filter(
+            id=conversation_id,
+            participants=self.request.user
+        ).first()
 
-        # Get before_id parameter for cursor-based pagination
-        before_id = self.request.query_params.get('before_id')
-        after_id = self.request.query_params.get('after_id')
+        if not conversation:
+            return Message.objects.none()
 
-        try:
-            # Check if the user is a participant in the conversation
-            conversation = Conversation.objects.filter(
-                id=conversation_id,
-                participants=self.request.user
-            ).select_related().first()
-
-            if not conversation:
-                return Message.objects.none()
-
-            # Mark all unread messages as read
-            unread_messages = Message.objects.filter(
-                conversation=conversation,
-                is_read=False
-            ).exclude(sender=self.request.user)
-
-            # Use bulk update for better performance
-            for message in unread_messages:
-                message.is_read = True
-                message.delivery_status = 'read'
-
-            if unread_messages:
-                Message.objects.bulk_update(unread_messages, ['is_read', 'delivery_status'])
-
-            # Base queryset
-            queryset = Message.objects.filter(conversation=conversation)
-
-            # Apply cursor-based pagination if requested
-            if before_id:
-                try:
-                    oldest_message = Message.objects.get(id=before_id)
-                    queryset = queryset.filter(timestamp__lt=oldest_message.timestamp)
-                except Message.DoesNotExist:
-                    pass
+        # Mark the conversation as read (a single watermark write)
+        ReadService.mark_read(conversation.id, self.request.user.id)
 
-            if after_id:
-                try:
-                    newest_message = Message.objects.get(id=after_id)
-                    queryset = queryset.filter(timestamp__gt=newest_message.timestamp)
-                except Message.DoesNotExist:
-                    pass
+        # The paginator continues into archived history from here
+        self.conversation = conversation
 
-            return queryset.order_by('-timestamp')
+        # Ordering and cursor filtering are applied by the paginator
+        return Message.objects.filter(conversation=conversation).select_related('sender')
 
-        except Conversation.DoesNotExist:
-            return Message.objects.none()
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Read state of every message is derived from these watermarks
+        context['read_positions'] = ReadService.get_read_positions(self.kwargs.get('pk'))
+        return context
 
 
 class AddMessageView(APIView):
     """API view for adding a message to a conversation with improved file handling."""
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [parsers.MultiPartParser]  # Simplified parser configuration
+    throttle_classes = [ChatMessageThrottle]  # Same budget as WebSocket messages
     
     def determine_file_type(self, file_attachment):
         """More robust file type detection."""
-        content_type = file_attachment.content_type
-        filename = file_attachment.name.lower()
-        
-        # Default file type
-        file_type = 'document'
-        
-        # Check MIME type first
-        if content_type.startswith('image/'):
-            file_type = 'image'
-        elif content_type.startswith('audio/'):
-            file_type = 'audio'
-        elif content_type.startswith('video/'):
-            file_type = 'video'
-        # Then check extension as fallback
-        elif any(filename.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']):
-            file_type = 'image'
-        elif any(filename.endswith(ext) for ext in ['.mp3', '.wav', '.ogg', '.m4a']):
-            file_type = 'audio'
-        elif any(filename.endswith(ext) for ext in ['.mp4', '.webm', '.avi', '.mov']):
-            file_type = 'video'
-        elif content_type.startswith('application/') or content_type.startswith('text/'):
-            file_type = 'document'
-        
-        return file_type
+        return UploadService.determine_file_type(
+            file_attachment.content_type, file_attachment.name
+        )
 
     def post(self, request, pk, *args, **kwargs):
         try:
@@ -227,8 +180,7 @@ class AddMessageView(APIView):
                 message = Message(
                     conversation=conversation,
                     sender=request.user,
-                    content=content,
-                    is_read=True  # Messages are always read by the sender
+                    content=content
                 )
 
                 # Handle file attachment if present
@@ -258,6 +210,7 @@ class AddMessageView(APIView):
 
                 # Update the conversation timestamp
                 conversation.update_timestamp()
+                InboxService.messages_created([message])
 
                 # Return the serialized message with complete URL info
                 serializer = MessageSerializer(message, context={'request': request})
@@ -281,6 +234,143 @@ class AddMessageView(APIView):
             )
 
 
+class StartUploadView(APIView):
+    """
+    API view for starting a chunked, resumable attachment upload.
+
+    Takes ``{"file_name", "file_size", "content_type"}`` and returns the
+    upload ID and the largest chunk the server accepts.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk, *args, **kwargs):
+        try:
+            conversation = Conversation.objects.get(id=pk, participants=request.user)
+        except Conversation.DoesNotExist:
+            return Response(
+                {"error": "Conversation not found or you don't have permission."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            session = UploadService.start(
+                request.user,
+                conversation,
+                request.data.get('file_name'),
+                int(request.data.get('file_size') or 0),
+                request.data.get('content_type', ''),
+            )
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'upload_id': str(session.id),
+            'received_bytes': 0,
+            'max_chunk_size': UploadService.get_max_chunk_size(),
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadChunkView(APIView):
+    """
+    API view for the chunks of an upload.
+
+    ``PUT`` stores the raw request body as the bytes given by its
+    ``Content-Range: bytes start-end/total`` header, optionally checked
+    against an ``X-Chunk-SHA256`` header. ``GET`` reports how many bytes
+    have arrived, so an interrupted client knows where to resume.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    content_range_prefix = 'bytes '
+
+    def get_session(self, request, upload_id):
+        return UploadSession.objects.filter(id=upload_id, user=request.user).first()
+
+    def get(self, request, upload_id, *args, **kwargs):
+        session = self.get_session(request, upload_id)
+        if session is None:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'upload_id': str(session.id),
+            'file_size': session.file_size,
+            'received_bytes': session.received_bytes,
+        })
+
+    def put(self, request, upload_id, *args, **kwargs):
+        session = self.get_session(request, upload_id)
+        if session is None:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            start = self.parse_content_range(request.headers.get('Content-Range', ''))
+        except ValueError:
+            return Response(
+                {"error": "A Content-Range header of the form 'bytes start-end/total' is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Read at most one byte more than allowed, so oversized chunks are
+        # rejected without buffering them
+        chunk = request.stream.read(UploadService.get_max_chunk_size() + 1) if request.stream else b''
+        try:
+            received = UploadService.append_chunk(
+                session, start, chunk, request.headers.get('X-Chunk-SHA256')
+            )
+        except UploadOffsetMismatch as e:
+            return Response(
+                {"error": str(e), "received_bytes": e.received_bytes},
+                status=status.HTTP_409_CONFLICT
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'upload_id': str(session.id), 'received_bytes': received})
+
+    def parse_content_range(self, header):
+        if not header.startswith(self.content_range_prefix):
+            raise ValueError(header)
+        byte_range, _, _total = header[len(self.content_range_prefix):].partition('/')
+        start, _, _end = byte_range.partition('-')
+        return int(start)
+
+
+class FinalizeUploadView(APIView):
+    """
+    API view for completing an upload.
+
+    Takes ``{"sha256": rolling_hash, "content": optional text}`` and creates
+    the message once every byte has arrived and the hash matches.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [ChatMessageThrottle]  # Same budget as other chat messages
+
+    def post(self, request, upload_id, *args, **kwargs):
+        session = UploadSession.objects.filter(
+            id=upload_id, user=request.user
+        ).select_related('conversation', 'user').first()
+        if session is None:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            message = UploadService.finalize(
+                session,
+                request.data.get('sha256'),
+                (request.data.get('content') or '').strip(),
+            )
+        except UploadSession.DoesNotExist:
+            # Finalized by a concurrent or earlier request
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        except UploadOffsetMismatch as e:
+            return Response(
+                {"error": "Upload is incomplete.", "received_bytes": e.received_bytes},
+                status=status.HTTP_409_CONFLICT
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = MessageSerializer(message, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 class UserListView(generics.ListAPIView):
     """API view for listing all users with their online status."""
     serializer_class = UserSerializer
@@ -343,17 +433,10 @@ class UnreadMessageCountView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        # Get all conversations for the current user
-        conversations = Conversation.objects.filter(participants=request.user)
-
-        # Count unread messages across all conversations
-        unread_count = 0
-        for conversation in conversations:
-            unread_count += Message.objects.filter(
-                conversation=conversation,
-                is_read=False,
-                is_deleted=False  # Don't count deleted messages
-            ).exclude(sender=request.user).count()
+        # Sum the maintained per-conversation counts of the user's inbox
+        unread_count = InboxEntry.objects.filter(user=request.user).aggregate(
+            total=Sum('unread_count')
+        )['total'] or 0
 
         return Response({
             'unread_count': unread_count
@@ -387,6 +470,7 @@ class EditMessageView(APIView):
 
             # Edit the message
             message.edit_message(content)
+            InboxService.message_changed(message)
 
             # Return the updated message
             return Response(
@@ -413,20 +497,12 @@ class MarkMessagesReadView(APIView):
                 participants=request.user
             )
 
-            # Mark all unread messages from other users as read
-            unread_count = Message.objects.filter(
-                conversation=conversation,
-                is_read=False
-            ).exclude(
-                sender=request.user
-            ).update(
-                is_read=True,
-                delivery_status='read'
-            )
+            # Move the user's read watermark to the newest message
+            watermark = ReadService.mark_read(conversation.id, request.user.id)
 
             return Response({
                 'success': True,
-                'marked_read': unread_count
+                'last_read_message_id': watermark[0] if watermark else None
             })
 
         except Conversation.DoesNotExist:
@@ -436,6 +512,50 @@ class MarkMessagesReadView(APIView):
             )
 
 
+class SyncView(APIView):
+    """
+    API view for delta sync after a reconnect.
+
+    Takes ``{"marks": {conversation_id: last_seen_message_id}}`` and returns
+    only the new messages, edits and deletes since those marks.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            marks = SyncService.parse_marks(request.data.get('marks'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'conversations': SyncService.delta(request.user.id, marks)
+        }, status=status.HTTP_200_OK)
+
+
+class MessageSearchView(generics.ListAPIView):
+    """
+    API view for full-text search over the user's message history.
+
+    ``?q=`` must contain at least one word; the last word matches as a
+    prefix. Results are ranked best first and paged with an opaque cursor.
+    """
+    serializer_class = MessageSearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageSearchPagination
+
+    def get_queryset(self):
+        # The search only returns messages of the user's conversations
+        return Message.objects.filter(is_deleted=False).select_related('sender')
+
+    def list(self, request, *args, **kwargs):
+        if not SearchService.tokenize(request.query_params.get('q')):
+            return Response(
+                {"error": "Search query must contain at least one word."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return super().list(request, *args, **kwargs)
+
+
 class DeleteMessageView(APIView):
     """API view for deleting a message."""
     permission_classes = [permissions.IsAuthenticated]
@@ -447,6 +567,7 @@ class DeleteMessageView(APIView):
 
             # Soft delete the message
             message.delete_message()
+            InboxService.message_changed(message)
 
             # Return success response
             return Response(
@@ -459,3 +580,13 @@ class DeleteMessageView(APIView):
                 {"error": "Message not found or you don't have permission to delete it."},
                 status=status.HTTP_404_NOT_FOUND
             )
+
+
+class RateLimitStatsView(APIView):
+    """API view exposing allowed/denied counters of the shared rate limiters."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            name: limiter.stats() for name, limiter in RATE_LIMITERS.items()
+        }, status=status.HTTP_200_OK)
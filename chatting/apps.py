@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    from chatting.services.search_service import SearchService
+
+    SearchService.install(using)
 
 
 class ChattingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatting'
+
+    def ready(self):
+        # The search index is backend specific, so it is created outside the models
+        post_migrate.connect(install_search_index, sender=self)
@@ -1,15 +1,28 @@
-import json
+import asyncio
 import logging
+from datetime import timedelta
 
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.utils import timezone
 from django.utils.html import escape
 from django.urls import reverse
 
-from .models import Conversation, Message, UserStatus
+from home.utils_codec import FrameCodec, FrameDecodeError
+from home.utils_ratelimit import chat_message_limiter
+
+from .layers import group_add_many, group_discard_many
+from .models import Conversation, Message
+from .outbound import OutboundScheduler
+from .services.delivery_service import DeliveryRetryService
+from .services.membership_service import MembershipService
+from .services.message_writer import MessageWriter
+from .services.presence_service import PresenceService
+from .services.read_service import ReadService
+from .services.sync_service import SyncService
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -38,54 +51,75 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         self.user = self.scope["user"]
 
+        # JSON text frames unless the client asked for MessagePack
+        self.codec = FrameCodec.negotiate(self.scope)
+
         # Anonymous users can't use WebSockets
         if self.user.is_anonymous:
             logger.warning("Anonymous user attempted to connect to chat WebSocket")
             await self.close()
             return
 
-        # Set user as online with caching
-        await self.set_user_online_cached(self.user.id, True)
-
         # Create a unique channel group name for the user
         self.user_group_name = f"user_{self.user.id}"
 
+        # Frames to this socket go through the outbound scheduler, which
+        # coalesces low-priority events into one frame per flush interval
+        self.outbound = OutboundScheduler(
+            self.send_frame,
+            getattr(settings, "CHAT_OUTBOUND_FLUSH_MS", 50) / 1000,
+            getattr(settings, "CHAT_OUTBOUND_MAX_PENDING", 100),
+        )
+        # Conversation ID -> timer ending this socket's typing state
+        self.typing = {}
+
         # Join user group
         await self.channel_layer.group_add(self.user_group_name, self.channel_name)
 
-        # Join the global online users group
-        await self.channel_layer.group_add("online_users", self.channel_name)
+        # Load the membership routing table once; authorization and routing on
+        # the message path read it instead of the database.
+        self.routing = await database_sync_to_async(
+            MembershipService.get_routing_table
+        )(self.user.id)
 
-        # Add user to specific conversation groups (optimized with caching)
+        # Add user to conversation groups in one bulk call (optimized with caching).
+        # In lazy mode only recently active conversations are joined up front;
+        # the rest are reached through the user group and joined on demand.
         user_conversations = await self.get_user_conversations_cached(self.user.id)
-        for conversation_id in user_conversations:
-            conversation_group_name = f"conversation_{conversation_id}"
-            await self.channel_layer.group_add(
-                conversation_group_name, self.channel_name
-            )
-
-        # Broadcast user online status to all connected clients
-        await self.channel_layer.group_send(
-            "online_users",
-            {"type": "user_status", "user_id": self.user.id, "status": True},
+        self.conversation_ids = set(user_conversations)
+        await group_add_many(
+            self.channel_layer,
+            [f"conversation_{conversation_id}" for conversation_id in user_conversations],
+            self.channel_name,
         )
 
-        # Accept the connection
-        await self.accept()
+        # Register the socket; only the first socket of a user is a status change
+        came_online, self.presence_epoch = await database_sync_to_async(
+            PresenceService.connect
+        )(self.user.id)
+        if came_online:
+            # Tell only the users who share a conversation with this user
+            contact_ids = await database_sync_to_async(
+                PresenceService.get_contact_ids
+            )(self.user.id)
+            await PresenceService.broadcast_status(
+                self.channel_layer, self.user.id, contact_ids, True
+            )
+
+        # Accept the connection, confirming the subprotocol if one was negotiated
+        await self.accept(self.codec.subprotocol)
 
         # Log successful connection
         user_id = self.user.id if hasattr(self.user, "id") else "anonymous"
         logger.info(f"WebSocket connection established for user {user_id}")
 
-        # Deliver any pending messages to the user who just came online (optimized)
-        if hasattr(self.user, "id") and not self.user.is_anonymous:
-            delivered_count = await self.deliver_pending_messages_optimized(
-                self.user.id
-            )
-            if delivered_count > 0:
-                logger.info(
-                    f"Delivered {delivered_count} pending messages to user {self.user.id} on connect"
-                )
+        # In single-node mode this process also retries pending deliveries
+        DeliveryRetryService.ensure_scheduler()
+
+        # Start streaming pending messages; each chunk waits for a client ack
+        self.sync_cursor = 0
+        self.sync_chunk_ids = []
+        await self.send_pending_chunk()
 
     async def disconnect(self, close_code):
         # Enhanced logging for disconnections
@@ -102,56 +136,62 @@ class ChatConsumer(AsyncWebsocketConsumer):
         logger.info(f"WebSocket disconnection: {client_info}")
 
         if hasattr(self, "user") and not self.user.is_anonymous:
-            # Set user as offline
-            user_status = await self.set_user_online(self.user.id, False)
+            self.outbound.close()
+
+            # Tell the other participants this socket stopped typing
+            for conversation_id in list(self.typing):
+                await self.set_typing(conversation_id, False)
 
             # Leave user group
             await self.channel_layer.group_discard(
                 self.user_group_name, self.channel_name
             )
 
-            # Leave conversation groups
-            user_conversations = await self.get_user_conversations(self.user.id)
-            for conversation_id in user_conversations:
-                conversation_group_name = f"conversation_{conversation_id}"
-                await self.channel_layer.group_discard(
-                    conversation_group_name, self.channel_name
-                )
-
-            # Leave online status group
-            await self.channel_layer.group_discard("online_users", self.channel_name)
+            # Leave every conversation group this socket joined, in one bulk call
+            await group_discard_many(
+                self.channel_layer,
+                [
+                    f"conversation_{conversation_id}"
+                    for conversation_id in getattr(self, "conversation_ids", ())
+                ],
+                self.channel_name,
+            )
 
-            # Broadcast user offline status with last seen time
-            await self.channel_layer.group_send(
-                "online_users",
-                {
-                    "type": "user_status",
-                    "user_id": self.user.id,
-                    "status": False,
-                    "last_seen": (
-                        user_status.last_active.isoformat()
-                        if hasattr(user_status, "last_active")
-                        else timezone.now().isoformat()
-                    ),
-                },
+            # Unregister the socket; the user stays online while other tabs are open
+            went_offline = await database_sync_to_async(PresenceService.disconnect)(
+                self.user.id, getattr(self, "presence_epoch", None)
             )
+            if went_offline:
+                # Broadcast user offline status with last seen time
+                contact_ids = await database_sync_to_async(
+                    PresenceService.get_contact_ids
+                )(self.user.id)
+                await PresenceService.broadcast_status(
+                    self.channel_layer,
+                    self.user.id,
+                    contact_ids,
+                    False,
+                    last_seen=timezone.now().isoformat(),
+                )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Handle incoming WebSocket messages.
 
-        This method parses the incoming JSON message, determines its type,
-        and routes it to the appropriate handler method.
+        This method decodes the incoming message (JSON text or MessagePack
+        binary), determines its type, and routes it to the appropriate
+        handler method.
 
         Args:
             text_data: The raw WebSocket message as a string
+            bytes_data: The raw WebSocket message as bytes
 
         Returns:
             None
         """
         try:
-            # Parse JSON data
-            text_data_json = json.loads(text_data)
+            # Decode the frame
+            text_data_json = self.codec.decode(text_data, bytes_data)
             message_type = text_data_json.get("type", "")
 
             # Log the received message type (but not content for privacy)
@@ -167,6 +207,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
             elif message_type == "typing" or message_type == "typing_indicator":
                 # Handle both 'typing' and 'typing_indicator' for backward compatibility
                 await self.handle_typing(text_data_json)
+            elif message_type == "sync_ack":
+                await self.handle_sync_ack(text_data_json)
+            elif message_type == "sync":
+                await self.handle_sync(text_data_json)
+            elif message_type == "heartbeat":
+                # Keep the presence key alive while the socket is open
+                self.presence_epoch = await database_sync_to_async(
+                    PresenceService.heartbeat
+                )(self.user.id, self.presence_epoch)
             elif message_type == "file_message_sent":
                 # Handle notification that a file message was sent via HTTP
                 await self.handle_file_message_sent(text_data_json)
@@ -175,26 +224,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     f"Unknown message type '{message_type}' received from user {self.user.id}"
                 )
                 # Notify client about the error
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "error",
-                            "message": f"Unknown message type: {message_type}",
-                        }
-                    )
-                )
-        except json.JSONDecodeError:
-            logger.error(
-                f"Invalid JSON received from user {self.user.id}: {text_data[:100]}..."
-            )
-            # Notify client about the error
-            await self.send(
-                text_data=json.dumps(
+                await self.outbound.send_now(
                     {
                         "type": "error",
-                        "message": "Invalid message format. Please send valid JSON.",
+                        "message": f"Unknown message type: {message_type}",
                     }
                 )
+        except FrameDecodeError:
+            logger.error(
+                f"Invalid frame received from user {self.user.id}: {(text_data or bytes_data)[:100]!r}..."
+            )
+            # Notify client about the error
+            await self.outbound.send_now(
+                {
+                    "type": "error",
+                    "message": "Invalid message format. Please send valid JSON or MessagePack.",
+                }
             )
         except Exception as e:
             logger.error(
@@ -202,13 +247,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 exc_info=True,
             )
             # Notify client about the error
-            await self.send(
-                text_data=json.dumps(
-                    {
-                        "type": "error",
-                        "message": "An error occurred while processing your message.",
-                    }
-                )
+            await self.outbound.send_now(
+                {
+                    "type": "error",
+                    "message": "An error occurred while processing your message.",
+                }
             )
 
     async def handle_chat_message(self, data):
@@ -246,26 +289,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 logger.debug(f"Empty message content from user {self.user.id}")
                 return
 
-            # Apply rate limiting
-            rate_limit_key = f"message_rate_{self.user.id}"
-            rate = cache.get(rate_limit_key, 0)
-
-            if rate >= 10:  # Max 10 messages per minute
+            # Apply rate limiting (atomic token bucket shared with the REST API)
+            if not await chat_message_limiter.ahit(self.user.id):
                 logger.warning(f"Rate limit exceeded for user {self.user.id}")
                 # Notify user about rate limiting
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "error",
-                            "message": "You're sending messages too quickly. Please wait a moment.",
-                        }
-                    )
+                await self.outbound.send_now(
+                    {
+                        "type": "error",
+                        "message": "You're sending messages too quickly. Please wait a moment.",
+                    }
                 )
                 return
 
-            # Increment rate counter
-            cache.set(rate_limit_key, rate + 1, 60)  # Reset after 60 seconds
-
             # Check if the user is a participant in this conversation
             is_participant = await self.is_conversation_participant(
                 conversation_id, self.user.id
@@ -276,28 +311,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 )
                 return
 
+            # Make sure this socket sees the broadcast of its own message
+            await self.subscribe_to_conversation(conversation_id)
+
             # Sanitize content to prevent XSS attacks
             sanitized_content = escape(content)
 
+            # Get the other participant in the conversation
+            other_participant = await self.get_other_participant(
+                conversation_id, self.user.id
+            )
+
+            # Check if the recipient is online, so the message can be stored
+            # with its final delivery status in a single insert
+            recipient_online = await self.is_user_online(other_participant)
+
             # Create the message in the database (this also updates the conversation timestamp)
             message = await self.create_message(
-                conversation_id, self.user.id, sanitized_content
+                conversation_id,
+                self.user.id,
+                sanitized_content,
+                "delivered" if recipient_online else "pending",
             )
         except Exception as e:
             logger.error(f"Error handling chat message: {str(e)}", exc_info=True)
             return
 
-        # Get the other participant in the conversation
-        other_participant = await self.get_other_participant(
-            conversation_id, self.user.id
-        )
-
-        # Check if the recipient is online
-        recipient_online = await self.is_user_online(other_participant)
-
-        # Update message delivery status based on recipient's online status
         if recipient_online:
-            await self.update_message_status(message.id, "delivered")
             logger.info(
                 f"Message {message.id} delivered to online user {other_participant}"
             )
@@ -305,7 +345,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.info(
                 f"Message {message.id} queued for offline user {other_participant}"
             )
-            # Message remains in 'pending' status (default)
 
         # Prepare the message data
         message_data = {
@@ -338,6 +377,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 },
             )
 
+    async def send_frame(self, payload):
+        """Send one frame, an event or a list of events, in the negotiated encoding."""
+        await self.send(**self.codec.encode(payload))
+
+    async def subscribe_to_conversation(self, conversation_id):
+        """Join a conversation group that was not joined on connect."""
+        conversation_id = int(conversation_id)
+        if conversation_id in self.conversation_ids:
+            return
+        self.conversation_ids.add(conversation_id)
+        await self.channel_layer.group_add(
+            f"conversation_{conversation_id}", self.channel_name
+        )
+
     async def handle_read_messages(self, data):
         """
         Handle message read status updates.
@@ -351,28 +404,36 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not is_participant:
             return
 
-        # Mark messages as read
-        await self.mark_messages_as_read(conversation_id, self.user.id)
+        # Mark messages as read by moving this user's watermark
+        watermark = await self.mark_messages_as_read(conversation_id, self.user.id)
+        if not watermark:
+            # Already read up to the newest message; nothing changed
+            return
+        last_read_message_id, last_read_at = watermark
 
-        # Get the other participant in the conversation
-        other_participant = await self.get_other_participant(
+        # Notify the other participants; the watermark covers every message
+        # up to it, so no per-message IDs are sent
+        for participant_id in await self.get_other_participants(
             conversation_id, self.user.id
-        )
-
-        # Notify the other participant that messages have been read
-        if other_participant:
+        ):
             await self.channel_layer.group_send(
-                f"user_{other_participant}",
+                f"user_{participant_id}",
                 {
                     "type": "messages_read",
                     "conversation_id": conversation_id,
                     "reader_id": self.user.id,
+                    "last_read_message_id": last_read_message_id,
+                    "last_read_at": last_read_at.isoformat(),
                 },
             )
 
     async def handle_typing(self, data):
         """
         Handle typing indicators.
+
+        Clients send a typing event on every keystroke; only the start and
+        stop edges are broadcast. A user who stops sending typing events for
+        CHAT_TYPING_TIMEOUT seconds is reported as stopped.
         """
         conversation_id = data.get("conversation_id")
         is_typing = data.get("is_typing", False)
@@ -392,6 +453,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
             return
 
+        await self.set_typing(int(conversation_id), bool(is_typing))
+
+    async def set_typing(self, conversation_id, is_typing):
+        """
+        Update this socket's typing state and broadcast it if it changed.
+
+        Args:
+            conversation_id: The ID of the conversation
+            is_typing: Whether the user is typing
+        """
+        was_typing = conversation_id in self.typing
+        if was_typing:
+            self.typing.pop(conversation_id).cancel()
+
+        if is_typing:
+            # (Re)start the timer that ends the typing state
+            self.typing[conversation_id] = asyncio.get_running_loop().call_later(
+                getattr(settings, "CHAT_TYPING_TIMEOUT", 5),
+                lambda: asyncio.ensure_future(self.set_typing(conversation_id, False)),
+            )
+
+        if is_typing == was_typing:
+            # Not an edge; the other participant already knows
+            return
+
         # Get the other participant in the conversation
         other_participant = await self.get_other_participant(
             conversation_id, self.user.id
@@ -417,57 +503,68 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """
         Send the chat message to the WebSocket.
         """
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "chat_message",
-                    "message": event["message"],
-                    "conversation_id": event["conversation_id"],
-                }
-            )
+        await self.outbound.send_now(
+            {
+                "type": "chat_message",
+                "message": event["message"],
+                "conversation_id": event["conversation_id"],
+            }
         )
 
     async def new_message_notification(self, event):
         """
         Send a new message notification to the WebSocket.
+
+        If this socket is not subscribed to the conversation (lazy mode, or a
+        conversation created after connect), it joins the group now and also
+        forwards the chat message it missed from the group broadcast.
         """
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "new_message_notification",
-                    "conversation_id": event["conversation_id"],
-                    "message": event["message"],
-                }
-            )
+        if int(event["conversation_id"]) not in self.conversation_ids:
+            await self.subscribe_to_conversation(event["conversation_id"])
+            await self.chat_message(event)
+
+        await self.outbound.send_now(
+            {
+                "type": "new_message_notification",
+                "conversation_id": event["conversation_id"],
+                "message": event["message"],
+            }
         )
 
     async def messages_read(self, event):
         """
-        Send a messages read notification to the WebSocket.
+        Queue a messages read notification for the WebSocket.
+
+        Only the newest watermark per reader and conversation is sent. Read
+        receipts are not ephemeral, so a full queue drops them last.
         """
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "messages_read",
-                    "conversation_id": event["conversation_id"],
-                    "reader_id": event["reader_id"],
-                }
-            )
+        await self.outbound.queue(
+            ("messages_read", event["conversation_id"], event["reader_id"]),
+            {
+                "type": "messages_read",
+                "conversation_id": event["conversation_id"],
+                "reader_id": event["reader_id"],
+                "last_read_message_id": event["last_read_message_id"],
+                "last_read_at": event["last_read_at"],
+            },
+            ephemeral=False,
         )
 
     async def typing_indicator(self, event):
         """
-        Send a typing indicator to the WebSocket.
+        Queue a typing indicator for the WebSocket.
+
+        A start and a stop from the same user within one flush interval
+        coalesce into the latter.
         """
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "typing_indicator",
-                    "conversation_id": event["conversation_id"],
-                    "user_id": event["user_id"],
-                    "is_typing": event["is_typing"],
-                }
-            )
+        await self.outbound.queue(
+            ("typing_indicator", event["conversation_id"], event["user_id"]),
+            {
+                "type": "typing_indicator",
+                "conversation_id": event["conversation_id"],
+                "user_id": event["user_id"],
+                "is_typing": event["is_typing"],
+            }
         )
 
     async def handle_file_message_sent(self, data):
@@ -526,45 +623,72 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if "last_seen" in event:
             status_data["last_seen"] = event["last_seen"]
 
-        await self.send(text_data=json.dumps(status_data))
+        await self.outbound.queue(
+            ("user_status", event["user_id"]), status_data
+        )
 
-    # Database access methods
+    async def membership_changed(self, event):
+        """
+        Update the routing table after a conversation's membership changed.
 
-    @database_sync_to_async
-    def set_user_online(self, user_id, status):
+        This is a control event; nothing is sent to the client.
         """
-        Set the user's online status in the database.
+        conversation_id = int(event["conversation_id"])
+        participant_ids = set(event["participant_ids"])
+
+        if self.user.id in participant_ids:
+            self.routing[conversation_id] = participant_ids
+            await self.subscribe_to_conversation(conversation_id)
+        else:
+            self.routing.pop(conversation_id, None)
+            if conversation_id in self.conversation_ids:
+                self.conversation_ids.discard(conversation_id)
+                await self.channel_layer.group_discard(
+                    f"conversation_{conversation_id}", self.channel_name
+                )
+
+    async def get_participant_ids(self, conversation_id):
         """
-        user_status, _ = UserStatus.objects.get_or_create(user_id=user_id)
-        user_status.is_online = status
-        if not status:
-            user_status.last_active = timezone.now()
-        user_status.save()
-        return user_status
+        Get the participant IDs of a conversation from the routing table.
 
-    async def set_user_online_cached(self, user_id, status):
-        """Set user online status with caching."""
-        user_status = await self.set_user_online(user_id, status)
+        Conversations missing from the table (created by a request that raced
+        with connect) are looked up once and added to it.
 
-        # Update cache
-        cache_key = f"user_online_{user_id}"
-        if status:
-            cache.set(cache_key, True, 300)  # Cache for 5 minutes
-        else:
-            cache.delete(cache_key)
+        Returns:
+            Set of participant IDs, empty if the conversation does not exist
+        """
+        try:
+            conversation_id = int(conversation_id)
+        except (TypeError, ValueError):
+            return set()
+
+        participant_ids = self.routing.get(conversation_id)
+        if participant_ids is None:
+            participant_ids = await database_sync_to_async(
+                MembershipService.get_participant_ids
+            )(conversation_id)
+            if self.user.id in participant_ids:
+                self.routing[conversation_id] = participant_ids
+        return participant_ids
 
-        return user_status
+    # Database access methods
 
     @database_sync_to_async
     def get_user_conversations(self, user_id):
         """
-        Get all conversation IDs that the user is a participant in.
+        Get the conversation IDs to subscribe to on connect.
+
+        With CHAT_LAZY_SUBSCRIBE_DAYS set, only conversations updated within
+        that many days are returned; otherwise all of the user's conversations.
         """
-        return list(
-            Conversation.objects.filter(participants__id=user_id).values_list(
-                "id", flat=True
-            )
-        )
+        conversations = Conversation.objects.filter(participants__id=user_id)
+
+        lazy_days = getattr(settings, "CHAT_LAZY_SUBSCRIBE_DAYS", None)
+        if lazy_days:
+            cutoff = timezone.now() - timedelta(days=lazy_days)
+            conversations = conversations.filter(updated_at__gte=cutoff)
+
+        return list(conversations.values_list("id", flat=True))
 
     async def get_user_conversations_cached(self, user_id):
         """Get user conversations with caching."""
@@ -582,14 +706,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
         cache.set(cache_key, conversations, 600)
         return conversations
 
-    @database_sync_to_async
-    def is_conversation_participant(self, conversation_id, user_id):
+    async def is_conversation_participant(self, conversation_id, user_id):
         """
         Check if a user is a participant in a conversation.
         """
-        return Conversation.objects.filter(
-            id=conversation_id, participants__id=user_id
-        ).exists()
+        return user_id in await self.get_participant_ids(conversation_id)
 
     @database_sync_to_async
     def get_message(self, message_id):
@@ -609,8 +730,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Message.DoesNotExist:
             return None
 
-    @database_sync_to_async
-    def get_other_participants(self, conversation_id, user_id):
+    async def get_other_participants(self, conversation_id, user_id):
         """
         Get the other participants in a conversation.
 
@@ -621,18 +741,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         Returns:
             List of user IDs for other participants
         """
-        try:
-            # Get the conversation
-            conversation = Conversation.objects.get(id=conversation_id)
-
-            # Get other participants (excluding current user)
-            other_participants = conversation.participants.exclude(
-                id=user_id
-            ).values_list("id", flat=True)
-
-            return list(other_participants)
-        except Conversation.DoesNotExist:
-            return []
+        participant_ids = await self.get_participant_ids(conversation_id)
+        return sorted(participant_ids - {user_id})
 
     @database_sync_to_async
     def format_message_for_ws(self, message):
@@ -655,7 +765,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             },
             "content": message.content,
             "timestamp": message.timestamp.isoformat(),
-            "is_read": message.is_read,
+            "is_read": False,  # Just sent, so nobody else has read it yet
             "delivery_status": message.delivery_status,
         }
 
@@ -671,42 +781,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         return data
 
-    @database_sync_to_async
-    def create_message(self, conversation_id, user_id, content):
+    async def create_message(self, conversation_id, user_id, content, status="pending"):
         """
         Create a new message in the database.
 
-        Uses SELECT FOR UPDATE to prevent race conditions when multiple
-        messages are created simultaneously for the same conversation.
+        Writes only: the message is inserted with its final delivery status
+        and the conversation timestamp is bumped with a single UPDATE, so the
+        send path does not read any rows. With CHAT_GROUP_COMMIT enabled the
+        write is batched with other sockets' messages and this returns once
+        the batch has committed.
 
         Args:
             conversation_id: The ID of the conversation
             user_id: The ID of the message sender
             content: The sanitized message content
+            status: Initial delivery status ('pending' or 'delivered')
 
         Returns:
             The created Message object
         """
-        from django.db import transaction
+        message = MessageWriter.build_message(conversation_id, user_id, content, status)
 
         try:
-            with transaction.atomic():
-                # Get conversation with a SELECT FOR UPDATE to prevent race conditions
-                conversation = Conversation.objects.select_for_update().get(
-                    id=conversation_id
-                )
-
-                # Create message
-                message = Message.objects.create(
-                    conversation=conversation,
-                    sender_id=user_id,
-                    content=content,
-                    is_read=True,  # Messages are always read by the sender
-                )
-
-                # Update conversation timestamp
-                conversation.update_timestamp()
-
+            if MessageWriter.is_group_commit_enabled():
+                return await MessageWriter.submit(message)
+            await database_sync_to_async(MessageWriter.write)([message])
             return message
         except Exception as e:
             logger.error(f"Error creating message: {str(e)}", exc_info=True)
@@ -725,14 +824,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         return conversation
 
-    @database_sync_to_async
-    def get_other_participant(self, conversation_id, user_id):
+    async def get_other_participant(self, conversation_id, user_id):
         """
         Get the ID of the other participant in a conversation.
 
-        Uses a single optimized query instead of loading the entire conversation
-        and then querying its participants.
-
         Args:
             conversation_id: The ID of the conversation
             user_id: The ID of the current user
@@ -740,56 +835,37 @@ class ChatConsumer(AsyncWebsocketConsumer):
         Returns:
             The ID of the other participant, or None if not found
         """
-        try:
-            # Get the other participant in a single query
-            other_participant_id = (
-                Conversation.objects.filter(id=conversation_id)
-                .values_list("participants__id", flat=True)
-                .exclude(participants__id=user_id)
-                .first()
-            )
-
-            return other_participant_id
-        except Exception as e:
-            logger.error(f"Error getting other participant: {str(e)}", exc_info=True)
-            return None
+        other_participants = await self.get_other_participants(conversation_id, user_id)
+        return other_participants[0] if other_participants else None
 
     @database_sync_to_async
     def mark_messages_as_read(self, conversation_id, user_id):
         """
         Mark all messages in a conversation as read for a user.
 
-        Uses bulk_update for better performance instead of individual save calls.
+        Moves the user's read watermark to the newest message, a single-row
+        write regardless of how many messages were unread.
 
         Args:
             conversation_id: The ID of the conversation
             user_id: The ID of the user marking messages as read
 
         Returns:
-            The number of messages marked as read
+            (last_read_message_id, last_read_at), or None if nothing changed
         """
-        from django.db import transaction
-
         try:
-            with transaction.atomic():
-                # Update all unread messages in a single query
-                updated_count = (
-                    Message.objects.filter(
-                        conversation_id=conversation_id, is_read=False
-                    )
-                    .exclude(sender_id=user_id)
-                    .update(is_read=True, delivery_status="read")
-                )
-                return updated_count
+            return ReadService.mark_read(conversation_id, user_id)
         except Exception as e:
             logger.error(f"Error marking messages as read: {str(e)}", exc_info=True)
-            return 0
+            return None
 
-    @database_sync_to_async
-    def is_user_online(self, user_id):
+    async def is_user_online(self, user_id):
         """
         Check if a user is currently online.
 
+        Reads the presence key kept alive by the user's sockets rather than
+        the periodically flushed UserStatus table.
+
         Args:
             user_id: The ID of the user to check
 
@@ -797,10 +873,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             Boolean indicating if the user is online
         """
         try:
-            user_status = UserStatus.objects.filter(
-                user_id=user_id, is_online=True
-            ).exists()
-            return user_status
+            return await database_sync_to_async(PresenceService.is_online)(user_id)
         except Exception as e:
             logger.error(f"Error checking user online status: {str(e)}", exc_info=True)
             return False
@@ -835,30 +908,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return None
 
     @database_sync_to_async
-    def get_pending_messages_for_user(self, user_id):
+    def get_pending_messages_chunk(self, user_id, after_id, limit):
         """
-        Get all pending messages for a user.
+        Get the next chunk of undelivered messages for a user.
+
+        Uses a keyset query on the message ID so each chunk is an index range
+        scan, no matter how large the backlog is.
 
         Args:
             user_id: The ID of the user
+            after_id: Only return messages with a larger ID than this
+            limit: Maximum number of messages to return
 
         Returns:
-            List of pending Message objects
+            List of message dicts ordered by ID
         """
         try:
-            # Get all conversations the user is part of
-            conversations = Conversation.objects.filter(participants__id=user_id)
-
-            # Get all pending messages in those conversations where the user is not the sender
-            pending_messages = (
+            return list(
                 Message.objects.filter(
-                    conversation__in=conversations, delivery_status="pending"
+                    conversation__participants__id=user_id,
+                    # Also those marked failed by earlier retry passes
+                    delivery_status__in=("pending", "failed"),
+                    id__gt=after_id,
                 )
                 .exclude(sender_id=user_id)
-                .order_by("timestamp")
+                .order_by("id")
+                .values(
+                    "id",
+                    "conversation_id",
+                    "content",
+                    "timestamp",
+                    "sender_id",
+                    "sender__username",
+                    "sender__first_name",
+                    "sender__last_name",
+                )[:limit]
             )
-
-            return list(pending_messages)
         except Exception as e:
             logger.error(f"Error getting pending messages: {str(e)}", exc_info=True)
             return []
@@ -887,124 +972,91 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
             return 0
 
-    async def deliver_pending_messages_optimized(self, user_id):
+    async def send_pending_chunk(self):
         """
-        Deliver all pending messages for a user who has just come online.
-        Optimized version with caching, batching, and rate limiting.
+        Send the next chunk of pending messages as a single frame.
 
-        Args:
-            user_id: The ID of the user who has come online
+        The messages are marked as delivered only when the client acknowledges
+        the chunk with a ``sync_ack`` frame carrying its cursor, and the next
+        chunk is sent after that. At most one chunk is held in memory.
 
         Returns:
-            Number of messages delivered
+            Number of messages sent
         """
-        try:
-            # Get all pending messages for the user
-            pending_messages = await self.get_pending_messages_for_user(user_id)
+        chunk_size = getattr(settings, "CHAT_SYNC_CHUNK_SIZE", 100)
+        messages = await self.get_pending_messages_chunk(
+            self.user.id, self.sync_cursor, chunk_size + 1
+        )
+        has_more = len(messages) > chunk_size
+        messages = messages[:chunk_size]
 
-            if not pending_messages:
-                logger.info(f"No pending messages for user {user_id}")
-                return 0
+        if not messages:
+            self.sync_chunk_ids = []
+            return 0
 
-            logger.info(
-                f"Delivering {len(pending_messages)} pending messages to user {user_id}"
-            )
+        self.sync_chunk_ids = [message["id"] for message in messages]
+        self.sync_cursor = self.sync_chunk_ids[-1]
 
-            # Rate limiting: Don't overwhelm the user with too many messages at once
-            max_messages_per_batch = 50
-            if len(pending_messages) > max_messages_per_batch:
-                logger.warning(
-                    f"User {user_id} has {len(pending_messages)} pending messages. "
-                    f"Limiting to {max_messages_per_batch} for performance."
-                )
-                pending_messages = pending_messages[:max_messages_per_batch]
-
-            # Group messages by conversation for more efficient delivery
-            messages_by_conversation = {}
-            message_ids = []
-            for message in pending_messages:
-                conv_id = message.conversation_id
-                if conv_id not in messages_by_conversation:
-                    messages_by_conversation[conv_id] = []
-                messages_by_conversation[conv_id].append(message)
-                message_ids.append(message.id)
-
-            # Batch update all message statuses to 'delivered'
-            await self.batch_update_message_status(message_ids, "delivered")
-
-            # Cache user info lookups to avoid repeated DB queries
-            user_cache = {}
-
-            # Deliver messages for each conversation
-            delivered_count = 0
-            for conv_id, messages in messages_by_conversation.items():
-                for message in messages:
-                    sender_id = message.sender_id
-
-                    # Get sender info from cache or fetch and cache it
-                    if sender_id not in user_cache:
-                        user_cache[sender_id] = await self.get_user_info_cached(
-                            sender_id
-                        )
-
-                    sender = user_cache[sender_id]
-
-                    # Prepare message data
-                    message_data = {
-                        "type": "chat_message",
+        await self.outbound.send_now(
+            {
+                "type": "pending_messages",
+                "messages": [
+                    {
+                        "conversation_id": message["conversation_id"],
                         "message": {
-                            "id": message.id,
-                            "content": message.content,
-                            "timestamp": message.timestamp.isoformat(),
-                            "sender_id": sender_id,
-                            "sender_name": f"{sender.get('first_name', '')} {sender.get('last_name', '')}".strip()
-                            or sender.get("username", "Unknown"),
+                            "id": message["id"],
+                            "content": message["content"],
+                            "timestamp": message["timestamp"].isoformat(),
+                            "sender_id": message["sender_id"],
+                            "sender_name": f"{message['sender__first_name']} {message['sender__last_name']}".strip()
+                            or message["sender__username"],
                             "is_read": False,
                             "delivery_status": "delivered",
                         },
-                        "conversation_id": conv_id,
                     }
+                    for message in messages
+                ],
+                "cursor": self.sync_cursor,
+                "has_more": has_more,
+            }
+        )
 
-                    # Send to the user's personal group
-                    await self.channel_layer.group_send(f"user_{user_id}", message_data)
+        logger.info(
+            f"Sent {len(messages)} pending messages to user {self.user.id} (cursor {self.sync_cursor})"
+        )
+        return len(messages)
 
-                    delivered_count += 1
+    async def handle_sync(self, data):
+        """
+        Handle a delta sync request.
 
-            logger.info(
-                f"Successfully delivered {delivered_count} pending messages to user {user_id}"
-            )
-            return delivered_count
+        The client sends the last message ID it has seen per conversation
+        and gets one ``sync`` frame with only the messages, edits and deletes
+        it missed; conversations with ``has_more`` are synced again from
+        their new mark.
+        """
+        try:
+            marks = SyncService.parse_marks(data.get("marks"))
+        except ValueError as e:
+            await self.outbound.send_now({"type": "error", "message": str(e)})
+            return
 
-        except Exception as e:
-            logger.error(f"Error delivering pending messages: {str(e)}", exc_info=True)
-            return 0
+        conversations = await database_sync_to_async(SyncService.delta)(
+            self.user.id, marks
+        )
+        await self.outbound.send_now({"type": "sync", "conversations": conversations})
 
-    @database_sync_to_async
-    def get_user_info_cached(self, user_id):
+    async def handle_sync_ack(self, data):
         """
-        Get basic user information with caching.
-
-        Args:
-            user_id: The ID of the user
+        Handle the client's acknowledgement of a pending-message chunk.
 
-        Returns:
-            Dictionary with user information
+        Marks the acknowledged chunk as delivered and streams the next one.
         """
-        cache_key = f"user_info_{user_id}"
-        cached_info = cache.get(cache_key)
-        if cached_info:
-            return cached_info
+        if not self.sync_chunk_ids or data.get("cursor") != self.sync_cursor:
+            logger.debug(
+                f"Ignoring stale sync_ack from user {self.user.id}: {data.get('cursor')}"
+            )
+            return
 
-        try:
-            user = User.objects.get(id=user_id)
-            user_info = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-            }
-            cache.set(cache_key, user_info, 300)  # Cache for 5 minutes
-            return user_info
-        except Exception as e:
-            logger.error(f"Error getting user info: {str(e)}", exc_info=True)
-            return {"username": "Unknown"}
+        await self.batch_update_message_status(self.sync_chunk_ids, "delivered")
+        await self.send_pending_chunk()
@@ -0,0 +1,66 @@
+import time
+from collections import defaultdict
+
+from channels_redis.core import RedisChannelLayer
+
+
+class PipelinedRedisChannelLayer(RedisChannelLayer):
+    """
+    Redis channel layer that can join or leave many groups in one round trip.
+
+    ``group_add``/``group_discard`` cost one (or two) Redis calls per group, so
+    a socket subscribing to hundreds of conversation groups pays hundreds of
+    sequential round trips. The bulk variants batch all commands for the same
+    shard into a single pipeline.
+    """
+
+    def _groups_by_shard(self, groups):
+        shards = defaultdict(list)
+        for group in groups:
+            assert self.valid_group_name(group), "Group name not valid"
+            shards[self.consistent_hash(group)].append(self._group_key(group))
+        return shards
+
+    async def group_add_many(self, groups, channel):
+        """Add a channel to several groups with one pipeline per shard."""
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        now = time.time()
+        for index, group_keys in self._groups_by_shard(groups).items():
+            pipe = self.connection(index).pipeline(transaction=False)
+            for group_key in group_keys:
+                pipe.zadd(group_key, {channel: now})
+                pipe.expire(group_key, self.group_expiry)
+            await pipe.execute()
+
+    async def group_discard_many(self, groups, channel):
+        """Remove a channel from several groups with one pipeline per shard."""
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        for index, group_keys in self._groups_by_shard(groups).items():
+            pipe = self.connection(index).pipeline(transaction=False)
+            for group_key in group_keys:
+                pipe.zrem(group_key, channel)
+            await pipe.execute()
+
+
+async def group_add_many(channel_layer, groups, channel):
+    """Join several groups, using the layer's bulk path when it has one."""
+    groups = list(groups)
+    if not groups:
+        return
+    if hasattr(channel_layer, "group_add_many"):
+        await channel_layer.group_add_many(groups, channel)
+        return
+    for group in groups:
+        await channel_layer.group_add(group, channel)
+
+
+async def group_discard_many(channel_layer, groups, channel):
+    """Leave several groups, using the layer's bulk path when it has one."""
+    groups = list(groups)
+    if not groups:
+        return
+    if hasattr(channel_layer, "group_discard_many"):
+        await channel_layer.group_discard_many(groups, channel)
+        return
+    for group in groups:
+        await channel_layer.group_discard(group, channel)
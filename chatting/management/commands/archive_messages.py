@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+
+from chatting.models import Message
+from chatting.services.archive_service import ArchiveService
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than CHAT_ARCHIVE_AFTER_DAYS into compressed "
+        "per-conversation archive segments"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Archive messages older than this many days (default: CHAT_ARCHIVE_AFTER_DAYS)",
+        )
+        parser.add_argument(
+            "--max-segments",
+            type=int,
+            help="Stop after writing this many segments, to spread work over several runs",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Conversations examined per batch",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = ArchiveService.get_cutoff(days=options["days"])
+        remaining = options["max_segments"]
+        cursor = 0
+        segments = messages = raw_bytes = compressed_bytes = 0
+
+        self.stdout.write(f"Archiving messages sent before {cutoff.isoformat()}")
+        while remaining is None or remaining > 0:
+            # Conversations with archivable messages, in ID order
+            conversation_ids = list(
+                Message.objects.filter(timestamp__lt=cutoff, conversation_id__gt=cursor)
+                .order_by("conversation_id")
+                .values_list("conversation_id", flat=True)
+                .distinct()[: options["batch_size"]]
+            )
+            if not conversation_ids:
+                break
+            cursor = conversation_ids[-1]
+
+            for conversation_id in conversation_ids:
+                written = ArchiveService.archive_conversation(
+                    conversation_id, cutoff, max_segments=remaining
+                )
+                for segment in written:
+                    segments += 1
+                    messages += segment.message_count
+                    raw_bytes += segment.raw_bytes
+                    compressed_bytes += segment.compressed_bytes
+                if remaining is not None:
+                    remaining -= len(written)
+                    if remaining <= 0:
+                        break
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {messages} messages into {segments} segments: "
+                f"message data compressed from {raw_bytes} to {compressed_bytes} bytes"
+            )
+        )
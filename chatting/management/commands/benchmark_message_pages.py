@@ -0,0 +1,112 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from chatting.api.pagination import MessageCursorPagination
+from chatting.models import Conversation, Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Benchmark message history pages: page number (COUNT + OFFSET) vs keyset cursor"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=1000000,
+            help="Number of messages in the benchmark conversation",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=50,
+            help="Messages per page",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Timed runs per page (the best one is reported)",
+        )
+
+    def handle(self, *args, **options):
+        total = options["messages"]
+        page_size = options["page_size"]
+
+        self.stdout.write(f"Creating a conversation with {total} messages...")
+        sender, recipient, conversation = self.create_fixtures(total)
+        try:
+            queryset = Message.objects.filter(conversation=conversation)
+            depths = sorted({0, total // 2, max(total - page_size, 0)})
+
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(f"{total} messages, page size {page_size}")
+            )
+            for depth in depths:
+                cursor = self.cursor_at(queryset, depth)
+                offset_seconds = self.best_of(
+                    options["repeat"],
+                    lambda: self.page_number(queryset, depth // page_size + 1, page_size),
+                )
+                keyset_seconds = self.best_of(
+                    options["repeat"],
+                    lambda: self.keyset(queryset, cursor, page_size),
+                )
+                self.stdout.write(
+                    f"  depth {depth:>9}  "
+                    f"page number {offset_seconds * 1000:>9.2f} ms  "
+                    f"keyset cursor {keyset_seconds * 1000:>7.2f} ms"
+                )
+        finally:
+            # Deleting the conversation cascades to its messages
+            conversation.delete()
+            User.objects.filter(id__in=[sender.id, recipient.id]).delete()
+
+    def create_fixtures(self, total, batch_size=10000):
+        sender = User.objects.create_user(username="bench_pages_sender")
+        recipient = User.objects.create_user(username="bench_pages_recipient")
+        conversation = Conversation.objects.create()
+        conversation.participants.add(sender, recipient)
+
+        for start in range(0, total, batch_size):
+            Message.objects.bulk_create(
+                Message(conversation=conversation, sender=sender, content=f"msg {i}")
+                for i in range(start, min(start + batch_size, total))
+            )
+        return sender, recipient, conversation
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def page_number(self, queryset, number, page_size):
+        """The previous PageNumberPagination behaviour: COUNT plus OFFSET."""
+        paginator = Paginator(queryset.order_by("-timestamp"), page_size)
+        return list(paginator.page(number).object_list)
+
+    def cursor_at(self, queryset, depth):
+        """
+        Cursor a client following "next" links would hold at ``depth``,
+        i.e. one pointing below the message just above the page.
+        """
+        if not depth:
+            return None
+        message = queryset.order_by("-timestamp", "-id")[depth - 1]
+        return MessageCursorPagination().encode_cursor("before", message.timestamp, message.id)
+
+    def keyset(self, queryset, cursor, page_size):
+        params = {"page_size": page_size}
+        if cursor:
+            params["cursor"] = cursor
+        request = Request(APIRequestFactory().get("/", params))
+        return MessageCursorPagination().paginate_queryset(queryset, request)
@@ -0,0 +1,117 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from chatting.models import Conversation, Message
+from chatting.services.search_service import SearchService
+
+User = get_user_model()
+
+WORDS = (
+    "exam lecture homework deadline project group library lab report quiz "
+    "grade notes slides campus tutor schedule meeting draft review thesis "
+    "chapter reading seminar midterm final assignment question answer room"
+).split()
+
+
+class Command(BaseCommand):
+    help = "Benchmark message search: LIKE scan vs the full-text index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=1000000,
+            help="Number of messages across all benchmark conversations",
+        )
+        parser.add_argument(
+            "--conversations",
+            type=int,
+            default=1000,
+            help="Number of benchmark conversations",
+        )
+        parser.add_argument(
+            "--member-of",
+            type=int,
+            default=50,
+            help="Conversations the searching user takes part in",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Timed runs per query (the best one is reported)",
+        )
+
+    def handle(self, *args, **options):
+        total = options["messages"]
+
+        self.stdout.write(
+            f"Creating {options['conversations']} conversations with {total} messages..."
+        )
+        searcher, other, conversations = self.create_fixtures(
+            total, options["conversations"], options["member_of"]
+        )
+        try:
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    f"{total} messages, user in {options['member_of']} conversations"
+                )
+            )
+            for query in ("thesis", "project deadline", "lecture sl"):
+                terms = SearchService.tokenize(query)
+                like_seconds = self.best_of(
+                    options["repeat"], lambda: self.like_scan(searcher, terms)
+                )
+                index_seconds = self.best_of(
+                    options["repeat"], lambda: SearchService.search(searcher.id, terms)
+                )
+                self.stdout.write(
+                    f"  {query!r:<20}  "
+                    f"LIKE scan {like_seconds * 1000:>9.2f} ms  "
+                    f"full-text index {index_seconds * 1000:>7.2f} ms"
+                )
+        finally:
+            # Deleting the conversations cascades to their messages
+            Conversation.objects.filter(id__in=[c.id for c in conversations]).delete()
+            User.objects.filter(id__in=[searcher.id, other.id]).delete()
+
+    def create_fixtures(self, total, conversation_count, member_of, batch_size=10000):
+        searcher = User.objects.create_user(username="bench_search_user")
+        other = User.objects.create_user(username="bench_search_other")
+        conversations = Conversation.objects.bulk_create(
+            Conversation() for _ in range(conversation_count)
+        )
+        for conversation in conversations[:member_of]:
+            conversation.participants.add(searcher, other)
+
+        rng = random.Random(0)
+        for start in range(0, total, batch_size):
+            Message.objects.bulk_create(
+                Message(
+                    conversation=rng.choice(conversations),
+                    sender=other,
+                    content=" ".join(rng.choices(WORDS, k=rng.randint(3, 12))),
+                )
+                for _ in range(start, min(start + batch_size, total))
+            )
+        return searcher, other, conversations
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def like_scan(self, user, terms, limit=20):
+        """Search without the index: a LIKE filter per term, newest first."""
+        queryset = Message.objects.filter(
+            conversation__participants=user, is_deleted=False
+        )
+        for term in terms:
+            queryset = queryset.filter(content__icontains=term)
+        return list(queryset.order_by("-id").values_list("id", flat=True)[:limit])
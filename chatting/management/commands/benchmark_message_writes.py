@@ -0,0 +1,119 @@
+import asyncio
+import statistics
+import time
+
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from chatting.models import Conversation
+from chatting.services.message_writer import MessageWriter
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Benchmark chat message inserts: one transaction per message vs group commit"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--senders",
+            type=int,
+            default=50,
+            help="Number of concurrent senders (one conversation each)",
+        )
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=20,
+            help="Messages sent by each sender",
+        )
+        parser.add_argument(
+            "--max-delay-ms",
+            type=float,
+            default=5,
+            help="Group commit window in milliseconds",
+        )
+        parser.add_argument(
+            "--max-rows",
+            type=int,
+            default=100,
+            help="Group commit batch size",
+        )
+
+    def handle(self, *args, **options):
+        senders = options["senders"]
+        users, conversations = self.create_fixtures(senders)
+        try:
+            direct = asyncio.run(
+                self.run(users, conversations, options["messages"], group_commit=False)
+            )
+            with override_settings(
+                CHAT_GROUP_COMMIT_MAX_DELAY_MS=options["max_delay_ms"],
+                CHAT_GROUP_COMMIT_MAX_ROWS=options["max_rows"],
+            ):
+                grouped = asyncio.run(
+                    self.run(users, conversations, options["messages"], group_commit=True)
+                )
+        finally:
+            # Deleting the conversations cascades to their messages
+            Conversation.objects.filter(id__in=[c.id for c in conversations]).delete()
+            User.objects.filter(id__in=[u.id for u in users]).delete()
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"{senders} senders x {options['messages']} messages"
+            )
+        )
+        for name, result in (("per-message commit", direct), ("group commit", grouped)):
+            self.stdout.write(
+                f"  {name:<20} "
+                f"{result['throughput']:>9.0f} msg/s  "
+                f"p50 {result['p50'] * 1000:>7.2f} ms  "
+                f"p99 {result['p99'] * 1000:>7.2f} ms"
+            )
+
+    def create_fixtures(self, senders):
+        users = []
+        conversations = []
+        for i in range(senders):
+            sender = User.objects.create_user(username=f"bench_writer_{i}_a")
+            recipient = User.objects.create_user(username=f"bench_writer_{i}_b")
+            conversation = Conversation.objects.create()
+            conversation.participants.add(sender, recipient)
+            users.extend([sender, recipient])
+            conversations.append(conversation)
+        return users, conversations
+
+    async def run(self, users, conversations, messages, group_commit):
+        """Send from every sender concurrently, timing each acknowledged write."""
+        latencies = []
+
+        async def send(sender_id, conversation_id):
+            for i in range(messages):
+                message = MessageWriter.build_message(
+                    conversation_id, sender_id, f"benchmark message {i}"
+                )
+                started = time.perf_counter()
+                if group_commit:
+                    await MessageWriter.submit(message)
+                else:
+                    await database_sync_to_async(MessageWriter.write)([message])
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                send(users[2 * i].id, conversation.id)
+                for i, conversation in enumerate(conversations)
+            )
+        )
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "throughput": len(latencies) / elapsed,
+            "p50": statistics.median(latencies),
+            "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from chatting.services import presence_service
+from chatting.services.presence_service import PresenceService
+
+
+class CountingChannelLayer:
+    """
+    Minimal in-process channel layer that counts deliveries instead of
+    queueing them, so fan-out cost can be measured without a Redis server.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.group_sends = 0
+        self.deliveries = 0
+
+    async def group_add(self, group, channel):
+        self.groups.setdefault(group, set()).add(channel)
+
+    async def group_discard(self, group, channel):
+        self.groups.get(group, set()).discard(channel)
+
+    async def group_send(self, group, message):
+        self.group_sends += 1
+        for _channel in self.groups.get(group, ()):
+            self.deliveries += 1
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-connect presence cost: global broadcast vs contact fan-out"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sockets",
+            type=int,
+            nargs="+",
+            default=[1000, 10000],
+            help="Numbers of simulated sockets to benchmark",
+        )
+        parser.add_argument(
+            "--contacts",
+            type=int,
+            default=10,
+            help="Conversation partners per simulated user",
+        )
+
+    def handle(self, *args, **options):
+        for sockets in options["sockets"]:
+            contacts = self.build_contact_graph(sockets, options["contacts"])
+            legacy = asyncio.run(self.run_legacy(sockets))
+            targeted = asyncio.run(self.run_targeted(sockets, contacts))
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{sockets} sockets"))
+            for name, result in (("online_users broadcast", legacy), ("contact fan-out", targeted)):
+                self.stdout.write(
+                    f"  {name:<24} "
+                    f"{result['deliveries'] / sockets:>10.1f} frames/connect  "
+                    f"{result['group_sends'] / sockets:>6.1f} group_sends/connect  "
+                    f"{result['seconds'] * 1e6 / sockets:>9.1f} us/connect  "
+                    f"{result['status_writes']:>6} UserStatus writes"
+                )
+
+    def build_contact_graph(self, users, per_user):
+        """Build a symmetric random graph of conversation partners."""
+        rng = random.Random(users)
+        contacts = {user_id: set() for user_id in range(1, users + 1)}
+        for user_id in contacts:
+            while len(contacts[user_id]) < min(per_user, users - 1):
+                other = rng.randint(1, users)
+                if other != user_id:
+                    contacts[user_id].add(other)
+                    contacts[other].add(user_id)
+        return {user_id: list(ids) for user_id, ids in contacts.items()}
+
+    async def run_legacy(self, sockets):
+        """Every socket joins online_users and every connect broadcasts to it."""
+        layer = CountingChannelLayer()
+        started = time.perf_counter()
+        for user_id in range(1, sockets + 1):
+            channel = f"channel_{user_id}"
+            await layer.group_add(f"user_{user_id}", channel)
+            await layer.group_add("online_users", channel)
+            await layer.group_send(
+                "online_users", {"type": "user_status", "user_id": user_id, "status": True}
+            )
+        return {
+            "deliveries": layer.deliveries,
+            "group_sends": layer.group_sends,
+            "seconds": time.perf_counter() - started,
+            "status_writes": sockets,  # one UserStatus save per connect
+        }
+
+    async def run_targeted(self, sockets, contacts):
+        """Connects only notify the personal groups of conversation partners."""
+        layer = CountingChannelLayer()
+        with override_settings(CHAT_PRESENCE_FLUSH_INTERVAL=3600):
+            started = time.perf_counter()
+            for user_id in range(1, sockets + 1):
+                await layer.group_add(f"user_{user_id}", f"channel_{user_id}")
+                if PresenceService.connect(user_id)[0]:
+                    await PresenceService.broadcast_status(
+                        layer, user_id, contacts[user_id], True
+                    )
+            seconds = time.perf_counter() - started
+
+            # Everything queued here would go out in a single batched upsert;
+            # drop it so the benchmark never writes to the database.
+            with presence_service._pending_lock:
+                queued = len(presence_service._pending_status)
+                presence_service._pending_status.clear()
+
+            for user_id in range(1, sockets + 1):
+                PresenceService.disconnect(user_id)
+            with presence_service._pending_lock:
+                presence_service._pending_status.clear()
+
+        return {
+            "deliveries": layer.deliveries,
+            "group_sends": layer.group_sends,
+            "seconds": seconds,
+            "status_writes": f"1x{queued}",
+        }
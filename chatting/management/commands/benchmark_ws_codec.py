@@ -0,0 +1,87 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from home.utils_codec import JSON, MSGPACK, FrameCodec
+
+
+class Command(BaseCommand):
+    help = "Benchmark WebSocket frame encodings: JSON text vs MessagePack binary"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=100000,
+            help="Encode/decode round trips per payload and encoding",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(f"{iterations} round trips per payload")
+        )
+        for name, payload in self.payloads().items():
+            self.stdout.write(f"{name}:")
+            for encoding in (JSON, MSGPACK):
+                codec = FrameCodec(encoding)
+                frame = codec.encode(payload)
+                assert codec.decode(**frame) == payload
+
+                # Bytes on the wire (text frames are sent as UTF-8)
+                size = len(frame.get("bytes_data") or frame["text_data"].encode())
+                encode_us = self.per_call(iterations, lambda: codec.encode(payload))
+                decode_us = self.per_call(iterations, lambda: codec.decode(**frame))
+                self.stdout.write(
+                    f"  {encoding:<8} {size:>5} bytes  "
+                    f"encode {encode_us:>6.2f} us  decode {decode_us:>6.2f} us"
+                )
+
+    def payloads(self):
+        """Typical frames, shaped like the ones the consumers send."""
+        now = timezone.now().isoformat()
+        return {
+            "chat_message": {
+                "type": "chat_message",
+                "message": {
+                    "id": 1048576,
+                    "content": "Are you joining the study group tonight? We start at 7 in room 204.",
+                    "timestamp": now,
+                    "sender_id": 4211,
+                    "sender_name": "Amira Haddad",
+                    "is_read": False,
+                    "delivery_status": "delivered",
+                },
+                "conversation_id": 90210,
+            },
+            "notification_message": {
+                "type": "notification",
+                "notification": {
+                    "id": 734512,
+                    "recipient": "jdoe",
+                    "recipient_id": 4211,
+                    "sender": "ahaddad",
+                    "sender_id": 1337,
+                    "notification_type": "comment",
+                    "text": "ahaddad commented on your post",
+                    "is_read": False,
+                    "created_at": now,
+                    "post_id": 5521,
+                    "comment_id": 99120,
+                    "url": "/home/post/5521/#comment-99120",
+                },
+                "status": "success",
+            },
+        }
+
+    def per_call(self, iterations, func):
+        """Microseconds per call, best of three runs."""
+        best = float("inf")
+        for _ in range(3):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            best = min(best, time.perf_counter() - started)
+        return best / iterations * 1e6
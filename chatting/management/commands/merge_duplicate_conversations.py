@@ -0,0 +1,126 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chatting.models import Conversation, Message, ReadWatermark
+from chatting.services.inbox_service import InboxService
+from chatting.services.membership_service import MembershipService
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill the user pair key of direct conversations, merging duplicate "
+        "conversations between the same two users into the oldest one"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Conversations examined per batch",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        cursor = 0
+        keyed = merged = skipped = 0
+
+        while True:
+            # Walk conversations without a pair key in ID order, so the oldest
+            # conversation of a pair is keyed first and later ones merge into it
+            conversation_ids = list(
+                Conversation.objects.filter(id__gt=cursor, pair_min_user_id__isnull=True)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not conversation_ids:
+                break
+            cursor = conversation_ids[-1]
+
+            participants = defaultdict(set)
+            for conversation_id, user_id in Conversation.participants.through.objects.filter(
+                conversation_id__in=conversation_ids
+            ).values_list("conversation_id", "customuser_id"):
+                participants[conversation_id].add(user_id)
+
+            for conversation_id in conversation_ids:
+                if len(participants[conversation_id]) != 2:
+                    # Not a direct conversation
+                    skipped += 1
+                    continue
+                pair = tuple(sorted(participants[conversation_id]))
+                if self.assign_pair(conversation_id, pair):
+                    keyed += 1
+                else:
+                    merged += 1
+
+            self.stdout.write(f"Processed conversations up to ID {cursor}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Keyed {keyed} conversations, merged {merged} duplicates, "
+                f"skipped {skipped} non-direct conversations"
+            )
+        )
+
+    def assign_pair(self, conversation_id, pair):
+        """
+        Key a conversation by its user pair, or merge it into the conversation
+        that already holds the key.
+
+        Returns:
+            True if the conversation was keyed, False if it was merged
+        """
+        with transaction.atomic():
+            canonical = (
+                Conversation.objects.select_for_update()
+                .filter(pair_min_user_id=pair[0], pair_max_user_id=pair[1])
+                .first()
+            )
+            if canonical is None:
+                Conversation.objects.filter(id=conversation_id).update(
+                    pair_min_user_id=pair[0], pair_max_user_id=pair[1]
+                )
+                return True
+            self.merge(conversation_id, canonical)
+
+        InboxService.rebuild([canonical.id])
+        # Sockets drop the removed conversation from their routing tables
+        MembershipService.conversation_changed(conversation_id, [], removed_ids=pair)
+        return False
+
+    def merge(self, duplicate_id, canonical):
+        """Move a duplicate conversation's messages and read state, then delete it."""
+        Message.objects.filter(conversation_id=duplicate_id).update(
+            conversation_id=canonical.id
+        )
+
+        # Keep the furthest read position of each user
+        for watermark in ReadWatermark.objects.filter(conversation_id=duplicate_id):
+            ReadWatermark.objects.filter(
+                conversation_id=canonical.id,
+                user_id=watermark.user_id,
+                last_read_message_id__lt=watermark.last_read_message_id,
+            ).update(
+                last_read_message_id=watermark.last_read_message_id,
+                last_read_at=watermark.last_read_at,
+            )
+            ReadWatermark.objects.get_or_create(
+                conversation_id=canonical.id,
+                user_id=watermark.user_id,
+                defaults={
+                    "last_read_message_id": watermark.last_read_message_id,
+                    "last_read_at": watermark.last_read_at,
+                },
+            )
+
+        duplicate = Conversation.objects.get(id=duplicate_id)
+        if duplicate.updated_at > canonical.updated_at:
+            Conversation.objects.filter(id=canonical.id).update(
+                updated_at=duplicate.updated_at
+            )
+
+        # Cascades to the duplicate's participants, watermarks and inbox entries
+        duplicate.delete()
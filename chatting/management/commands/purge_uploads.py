@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chatting.services.upload_service import UploadService
+
+
+class Command(BaseCommand):
+    help = "Discard chunked uploads idle for longer than CHAT_UPLOAD_SESSION_TTL_HOURS"
+
+    def handle(self, *args, **options):
+        purged = UploadService.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Discarded {purged} abandoned uploads"))
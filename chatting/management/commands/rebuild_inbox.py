@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from chatting.services.inbox_service import InboxService
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized inbox entries from conversations, messages and read watermarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--conversation",
+            type=int,
+            action="append",
+            dest="conversation_ids",
+            help="Only rebuild this conversation (may be given more than once)",
+        )
+
+    def handle(self, *args, **options):
+        rebuilt = InboxService.rebuild(options["conversation_ids"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt inbox for {rebuilt} conversations"))
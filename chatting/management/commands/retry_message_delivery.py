@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatting.services.delivery_service import DeliveryRetryService
+
+
+class Command(BaseCommand):
+    help = "Retry delivery of pending chat messages in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running a pass every CHAT_DELIVERY_RETRY_INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            stats = DeliveryRetryService.run_pass()
+            self.stdout.write(
+                f"Delivered {stats['delivered']}, retried {stats['retried']}"
+            )
+            if not options["loop"]:
+                return
+            time.sleep(DeliveryRetryService.get_interval())
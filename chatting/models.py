@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 
@@ -10,12 +12,25 @@ class Conversation(models.Model):
     participants = models.ManyToManyField(CustomUser, related_name="conversations")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Canonical (lower, higher) user ID pair of a direct conversation; unique,
+    # so there is at most one direct conversation per pair of users
+    pair_min_user_id = models.IntegerField(null=True, blank=True)
+    pair_max_user_id = models.IntegerField(null=True, blank=True)
+    # Send time of the newest archived message; older history is read from
+    # ArchivedSegment files instead of the message table
+    archived_until = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-updated_at"]
         indexes = [
             models.Index(fields=["updated_at"]),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["pair_min_user_id", "pair_max_user_id"],
+                name="unique_direct_conversation",
+            ),
+        ]
 
     def __str__(self):
         participant_names = ", ".join(
@@ -96,7 +111,6 @@ class Message(models.Model):
     )
     content = models.TextField(blank=True)  # Allow empty content for file-only messages
     timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
-    is_read = models.BooleanField(default=False, db_index=True)
     delivery_status = models.CharField(
         max_length=10, choices=STATUS_CHOICES, default="pending", db_index=True
     )
@@ -106,6 +120,8 @@ class Message(models.Model):
     edited_timestamp = models.DateTimeField(null=True, blank=True)
     is_deleted = models.BooleanField(default=False, db_index=True)
     deleted_timestamp = models.DateTimeField(null=True, blank=True)
+    # Time of the last edit or delete, for delta sync
+    changed_at = models.DateTimeField(null=True, blank=True)
 
     # File attachment fields
     file_attachment = models.FileField(
@@ -120,22 +136,20 @@ class Message(models.Model):
     class Meta:
         ordering = ["timestamp"]
         indexes = [
-            models.Index(fields=["conversation", "timestamp"]),
+            # Keyset pagination scans (conversation, timestamp, id) ranges
+            models.Index(fields=["conversation", "timestamp", "id"]),
             models.Index(fields=["sender", "timestamp"]),
-            models.Index(fields=["conversation", "is_read"]),
             models.Index(fields=["timestamp"]),
-            models.Index(fields=["delivery_status"]),
+            # Delta sync reads messages above a mark and later edits/deletes
+            models.Index(fields=["conversation", "id"]),
+            models.Index(fields=["conversation", "changed_at"]),
+            # Delivery retries walk pending messages in ID order
+            models.Index(fields=["delivery_status", "id"]),
         ]
 
     def __str__(self):
         return f"Message from {self.sender.username} at {self.timestamp}"
 
-    def mark_as_read(self):
-        """Mark the message as read."""
-        self.is_read = True
-        self.delivery_status = "read"
-        self.save()
-
     def mark_as_delivered(self):
         """Mark the message as delivered."""
         self.delivery_status = "delivered"
@@ -164,7 +178,7 @@ class Message(models.Model):
         """
         self.content = new_content
         self.is_edited = True
-        self.edited_timestamp = timezone.now()
+        self.edited_timestamp = self.changed_at = timezone.now()
         self.save()
         return self
 
@@ -176,7 +190,7 @@ class Message(models.Model):
             The updated message
         """
         self.is_deleted = True
-        self.deleted_timestamp = timezone.now()
+        self.deleted_timestamp = self.changed_at = timezone.now()
         # We keep the content but mark it as deleted
         self.save()
         return self
@@ -201,3 +215,142 @@ class UserStatus(models.Model):
         if not status:
             self.last_active = timezone.now()
         self.save()
+
+
+class ReadWatermark(models.Model):
+    """
+    How far a participant has read in a conversation.
+
+    Every message with an ID up to ``last_read_message_id`` counts as read
+    by the user, so marking a conversation read is a single-row write no
+    matter how many messages arrived since.
+    """
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="read_watermarks"
+    )
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="read_watermarks"
+    )
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "user"], name="unique_read_watermark"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} read conversation {self.conversation_id} up to {self.last_read_message_id}"
+
+
+class InboxEntry(models.Model):
+    """
+    Denormalized inbox row for one participant of a conversation.
+
+    Holds everything the conversation list shows, so the inbox is a single
+    indexed query per user. Maintained by ``InboxService`` whenever a message
+    is created, edited or deleted and whenever the user reads the
+    conversation.
+    """
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="inbox_entries"
+    )
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="inbox_entries"
+    )
+    other_user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+
+    # Snapshot of the newest message
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_content = models.TextField(blank=True)
+    last_message_sender_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-updated_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "conversation"], name="unique_inbox_entry"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-updated_at"]),
+        ]
+
+    def __str__(self):
+        return f"Inbox of {self.user.username}: conversation {self.conversation_id}"
+
+
+class ArchivedSegment(models.Model):
+    """
+    Index entry of a compressed file holding archived messages.
+
+    Segments of a conversation are append-only and cover consecutive,
+    non-overlapping ranges of the (timestamp, id) order, all older than the
+    messages still in the message table. The bounds below let a page of
+    history be located without opening any file.
+    """
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="archived_segments"
+    )
+    path = models.CharField(max_length=255)
+    first_message_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    raw_bytes = models.PositiveBigIntegerField()
+    compressed_bytes = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["conversation", "last_timestamp", "last_message_id"]
+        indexes = [
+            models.Index(fields=["conversation", "last_timestamp", "last_message_id"]),
+        ]
+
+    def __str__(self):
+        return (
+            f"Archive of conversation {self.conversation_id}: "
+            f"messages {self.first_message_id}-{self.last_message_id}"
+        )
+
+
+class UploadSession(models.Model):
+    """
+    A chunked, resumable attachment upload in progress.
+
+    Chunks are stored as separate parts as they arrive; the message is only
+    created when the upload is finalized. ``rolling_hash`` chains the SHA-256
+    digests of the chunks received so far (see ``UploadService``).
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    file_size = models.PositiveBigIntegerField()
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    rolling_hash = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Upload of {self.file_name} by {self.user.username}: {self.received_bytes}/{self.file_size} bytes"
+
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundScheduler:
+    """
+    Per-connection scheduler for frames sent to one WebSocket.
+
+    Urgent frames (chat messages, errors) are sent right away. Low-priority
+    events are queued under a coalescing key, so a newer event replaces an
+    older one with the same key (e.g. a user's status), and the queue is sent
+    as a single JSON array frame once per flush interval. The queue holds at
+    most ``max_pending`` events; when a slow socket falls behind, the oldest
+    ephemeral event is dropped instead of letting the queue grow.
+    """
+
+    def __init__(self, send, flush_interval, max_pending):
+        """
+        Args:
+            send: Coroutine function sending one payload (a dict or a list)
+            flush_interval: Seconds low-priority events wait for a flush
+            max_pending: Maximum number of queued low-priority events
+        """
+        self._send = send
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # key -> (payload, ephemeral)
+        self.flush_handle = None
+        self.dropped = 0
+
+    async def send_now(self, payload):
+        """Send an urgent frame, after whatever was queued before it."""
+        await self.flush()
+        await self._send(payload)
+
+    async def queue(self, key, payload, ephemeral=True):
+        """
+        Queue a low-priority event for the next flush.
+
+        Args:
+            key: Coalescing key; replaces a queued event with the same key
+            payload: The event to send
+            ephemeral: Whether the event may be dropped when the queue is full
+        """
+        if key in self.pending:
+            # Newest state wins and moves to the back of the queue
+            del self.pending[key]
+        elif len(self.pending) >= self.max_pending:
+            self._drop_oldest()
+        self.pending[key] = (payload, ephemeral)
+
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                self.flush_interval, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    def _drop_oldest(self):
+        key = next(
+            (key for key, (_payload, ephemeral) in self.pending.items() if ephemeral),
+            next(iter(self.pending)),
+        )
+        del self.pending[key]
+        self.dropped += 1
+        logger.debug(f"Outbound queue full; dropped stale event {key}")
+
+    async def flush(self):
+        """Send every queued event, as one array frame if there are several."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+
+        payloads = [payload for payload, _ephemeral in self.pending.values()]
+        self.pending.clear()
+        await self._send(payloads[0] if len(payloads) == 1 else payloads)
+
+    def close(self):
+        """Discard queued events and stop the flush timer."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending.clear()
@@ -0,0 +1 @@
+# Services package for chat business logic separation
@@ -0,0 +1,324 @@
+import gzip
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chatting.models import ArchivedSegment, Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# Columns kept for archived messages; delivery bookkeeping is dropped
+ARCHIVED_FIELDS = (
+    "id",
+    "sender_id",
+    "content",
+    "timestamp",
+    "delivery_status",
+    "is_edited",
+    "edited_timestamp",
+    "is_deleted",
+    "deleted_timestamp",
+    "changed_at",
+    "file_attachment",
+    "file_type",
+    "file_name",
+    "file_size",
+)
+DATETIME_FIELDS = ("timestamp", "edited_timestamp", "deleted_timestamp", "changed_at")
+
+# Decoded segments kept in memory; segments never change once written
+SEGMENT_CACHE_SIZE = 32
+_segment_cache = OrderedDict()
+
+
+class ArchiveService:
+    """
+    Service class for moving cold chat history out of the message table.
+
+    Messages older than ``CHAT_ARCHIVE_AFTER_DAYS`` are written, oldest
+    first, into gzip-compressed JSON segment files of up to
+    ``CHAT_ARCHIVE_SEGMENT_SIZE`` messages and deleted from the message
+    table, which keeps its indexes sized to recent traffic. Each segment gets
+    an ``ArchivedSegment`` index row, and ``read`` serves pages of archived
+    history so the message list and the conversation page continue
+    seamlessly past the hot rows.
+
+    Archived messages are read-only: they can no longer be edited, deleted,
+    searched or retried for delivery.
+    """
+
+    @staticmethod
+    def get_cutoff(now=None, days=None):
+        """Messages sent before this time are archived."""
+        if days is None:
+            days = getattr(settings, "CHAT_ARCHIVE_AFTER_DAYS", 365)
+        return (now or timezone.now()) - timedelta(days=days)
+
+    @staticmethod
+    def get_segment_size():
+        return getattr(settings, "CHAT_ARCHIVE_SEGMENT_SIZE", 1000)
+
+    @staticmethod
+    def get_storage_prefix():
+        return getattr(settings, "CHAT_ARCHIVE_PATH", "chat_archive")
+
+    @staticmethod
+    def archive_conversation(conversation_id, cutoff, max_segments=None):
+        """
+        Archive a conversation's messages sent before ``cutoff``.
+
+        Args:
+            conversation_id: The ID of the conversation
+            cutoff: Messages with an older timestamp are archived
+            max_segments: Stop after writing this many segments
+
+        Returns:
+            List of the ArchivedSegment rows written
+        """
+        segment_size = ArchiveService.get_segment_size()
+        segments = []
+
+        while max_segments is None or len(segments) < max_segments:
+            rows = list(
+                Message.objects.filter(conversation_id=conversation_id, timestamp__lt=cutoff)
+                .order_by("timestamp", "id")
+                .values(*ARCHIVED_FIELDS)[:segment_size]
+            )
+            if not rows:
+                break
+            segments.append(ArchiveService._write_segment(conversation_id, rows))
+            if len(rows) < segment_size:
+                break
+
+        return segments
+
+    @staticmethod
+    def _write_segment(conversation_id, rows):
+        first, last = rows[0], rows[-1]
+        raw = json.dumps(
+            [ArchiveService._encode_row(row) for row in rows], separators=(",", ":")
+        ).encode("utf-8")
+        data = gzip.compress(raw)
+
+        # The name is derived from the message range, so a run that failed
+        # after writing the file overwrites it on retry
+        name = (
+            f"{ArchiveService.get_storage_prefix()}/conversation_{conversation_id}/"
+            f"{first['id']}-{last['id']}.json.gz"
+        )
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        path = default_storage.save(name, ContentFile(data))
+
+        with transaction.atomic():
+            segment = ArchivedSegment.objects.create(
+                conversation_id=conversation_id,
+                path=path,
+                first_message_id=first["id"],
+                first_timestamp=first["timestamp"],
+                last_message_id=last["id"],
+                last_timestamp=last["timestamp"],
+                message_count=len(rows),
+                raw_bytes=len(raw),
+                compressed_bytes=len(data),
+                checksum=hashlib.sha256(data).hexdigest(),
+            )
+            Message.objects.filter(id__in=[row["id"] for row in rows]).delete()
+            Conversation.objects.filter(id=conversation_id).update(
+                archived_until=last["timestamp"]
+            )
+
+        logger.info(
+            f"Archived {len(rows)} messages of conversation {conversation_id} "
+            f"to {path} ({len(raw)} -> {len(data)} bytes)"
+        )
+        return segment
+
+    @staticmethod
+    def _encode_row(row):
+        row = dict(row)
+        for field in DATETIME_FIELDS:
+            if row[field] is not None:
+                row[field] = row[field].isoformat()
+        return row
+
+    @staticmethod
+    def load_segment(segment):
+        """
+        Read the rows of a segment, oldest first.
+
+        Returns:
+            List of field dicts with datetimes parsed
+        """
+        key = (segment.path, segment.checksum)
+        if key in _segment_cache:
+            _segment_cache.move_to_end(key)
+            return _segment_cache[key]
+
+        with default_storage.open(segment.path, "rb") as f:
+            rows = json.loads(gzip.decompress(f.read()))
+        for row in rows:
+            for field in DATETIME_FIELDS:
+                if row[field] is not None:
+                    row[field] = parse_datetime(row[field])
+
+        _segment_cache[key] = rows
+        if len(_segment_cache) > SEGMENT_CACHE_SIZE:
+            _segment_cache.popitem(last=False)
+        return rows
+
+    @staticmethod
+    def read(conversation_id, direction, timestamp=None, message_id=None, limit=50):
+        """
+        Read a page of archived messages next to a (timestamp, id) position.
+
+        Args:
+            conversation_id: The ID of the conversation
+            direction: "before" for older messages, newest first, or
+                "after" for newer messages, oldest first
+            timestamp, message_id: The position; None for the newest end
+            limit: Maximum number of messages
+
+        Returns:
+            List of unsaved Message instances with the sender attached
+        """
+        segments = ArchivedSegment.objects.filter(conversation_id=conversation_id)
+        if direction == "before":
+            if timestamp is not None:
+                segments = segments.filter(
+                    Q(first_timestamp__lt=timestamp)
+                    | Q(first_timestamp=timestamp, first_message_id__lt=message_id)
+                )
+            segments = segments.order_by("-last_timestamp", "-last_message_id")
+        else:
+            segments = segments.filter(
+                Q(last_timestamp__gt=timestamp)
+                | Q(last_timestamp=timestamp, last_message_id__gt=message_id)
+            ).order_by("last_timestamp", "last_message_id")
+
+        rows = []
+        for segment in segments.iterator():
+            candidates = ArchiveService.load_segment(segment)
+            if direction == "before":
+                candidates = reversed(candidates)
+            for row in candidates:
+                if timestamp is not None:
+                    position = (row["timestamp"], row["id"])
+                    if direction == "before" and position >= (timestamp, message_id):
+                        continue
+                    if direction == "after" and position <= (timestamp, message_id):
+                        continue
+                rows.append(row)
+                if len(rows) == limit:
+                    break
+            if len(rows) == limit:
+                break
+
+        return ArchiveService._to_messages(conversation_id, rows)
+
+    @staticmethod
+    def history(conversation_id, queryset):
+        """
+        A conversation's whole history, oldest first, for ``Paginator``.
+
+        Args:
+            conversation_id: The ID of the conversation
+            queryset: The conversation's hot messages, oldest first
+
+        Returns:
+            A ConversationHistory over the archived then the hot messages
+        """
+        return ConversationHistory(conversation_id, queryset)
+
+    @staticmethod
+    def read_range(conversation_id, offset, limit):
+        """
+        Read archived messages by position, oldest first.
+
+        Only the segments overlapping ``offset`` to ``offset + limit`` are
+        loaded, found from their message counts.
+
+        Returns:
+            List of unsaved Message instances with the sender attached
+        """
+        rows = []
+        start = 0
+        segments = ArchivedSegment.objects.filter(conversation_id=conversation_id).order_by(
+            "first_timestamp", "first_message_id"
+        )
+        for segment in segments.iterator():
+            end = start + segment.message_count
+            if end > offset:
+                skip = max(offset - start, 0)
+                rows.extend(ArchiveService.load_segment(segment)[skip : skip + limit - len(rows)])
+                if len(rows) >= limit:
+                    break
+            start = end
+        return ArchiveService._to_messages(conversation_id, rows)
+
+    @staticmethod
+    def _to_messages(conversation_id, rows):
+        senders = get_user_model().objects.in_bulk({row["sender_id"] for row in rows})
+        messages = []
+        for row in rows:
+            message = Message(conversation_id=conversation_id, **row)
+            message.sender = senders.get(row["sender_id"])
+            messages.append(message)
+        return messages
+
+
+class ConversationHistory:
+    """
+    Archived messages followed by the hot message queryset, oldest first.
+
+    Supports ``count()`` and slicing, which is all ``Paginator`` needs, so
+    page numbers run through archived history without loading it whole.
+    """
+
+    def __init__(self, conversation_id, queryset):
+        self.conversation_id = conversation_id
+        self.queryset = queryset
+        self._archived_count = None
+
+    def archived_count(self):
+        if self._archived_count is None:
+            self._archived_count = (
+                ArchivedSegment.objects.filter(conversation_id=self.conversation_id).aggregate(
+                    total=Sum("message_count")
+                )["total"]
+                or 0
+            )
+        return self._archived_count
+
+    def count(self):
+        return self.archived_count() + self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index : index + 1][0]
+        start, stop = index.start or 0, index.stop
+        archived = self.archived_count()
+
+        messages = []
+        if start < archived:
+            limit = (min(stop, archived) if stop is not None else archived) - start
+            messages.extend(ArchiveService.read_range(self.conversation_id, start, limit))
+        hot_start = max(start - archived, 0)
+        hot_stop = stop - archived if stop is not None else None
+        if hot_stop is None or hot_stop > hot_start:
+            messages.extend(self.queryset[hot_start:hot_stop])
+        return messages
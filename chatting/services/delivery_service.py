@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import weakref
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from chatting.models import Conversation, Message
+from chatting.services.presence_service import PresenceService
+
+logger = logging.getLogger(__name__)
+
+# Cache key holding the message ID the next retry pass starts after
+CURSOR_KEY = "chat_delivery_retry_cursor"
+
+# One in-process scheduler task per event loop
+_schedulers = weakref.WeakKeyDictionary()
+
+
+class DeliveryRetryService:
+    """
+    Service class retrying delivery of pending messages.
+
+    A pass walks the pending messages in keyset batches of
+    CHAT_DELIVERY_RETRY_BATCH_SIZE, at most CHAT_DELIVERY_RETRY_MAX_BATCHES
+    per pass, and continues where the previous pass stopped. A message is
+    due CHAT_DELIVERY_RETRY_BASE seconds after it was sent, then after
+    twice as long following each attempt. Due messages with an online
+    recipient are pushed to the recipient's sockets and marked delivered.
+    The others stay pending, as there is no socket to retry on, and are
+    streamed to the recipient on reconnect; their attempts only space out
+    the checks, up to CHAT_DELIVERY_MAX_ATTEMPTS doublings.
+    """
+
+    @staticmethod
+    def get_batch_size():
+        return getattr(settings, "CHAT_DELIVERY_RETRY_BATCH_SIZE", 200)
+
+    @staticmethod
+    def get_max_batches():
+        return getattr(settings, "CHAT_DELIVERY_RETRY_MAX_BATCHES", 10)
+
+    @staticmethod
+    def get_max_attempts():
+        return getattr(settings, "CHAT_DELIVERY_MAX_ATTEMPTS", 10)
+
+    @staticmethod
+    def get_interval():
+        """Seconds between passes of the in-process scheduler."""
+        return getattr(settings, "CHAT_DELIVERY_RETRY_INTERVAL", 30)
+
+    @staticmethod
+    def get_backoff(attempts):
+        """Delay before the next attempt after ``attempts`` attempts."""
+        base = getattr(settings, "CHAT_DELIVERY_RETRY_BASE", 30)
+        attempts = min(attempts, DeliveryRetryService.get_max_attempts())
+        return timedelta(seconds=base * 2**attempts)
+
+    @staticmethod
+    def is_due(message, now):
+        """Check whether a pending message (a values() dict) should be retried."""
+        last_attempt = message["last_delivery_attempt"] or message["timestamp"]
+        backoff = DeliveryRetryService.get_backoff(message["delivery_attempts"])
+        return last_attempt + backoff <= now
+
+    @staticmethod
+    def run_pass(now=None):
+        """
+        Retry the due messages among the next bounded range of pending ones.
+
+        Returns:
+            Counter of messages 'delivered' and 'retried'
+        """
+        now = now or timezone.now()
+        batch_size = DeliveryRetryService.get_batch_size()
+        cursor = cache.get(CURSOR_KEY, 0)
+
+        stats = Counter()
+        for _ in range(DeliveryRetryService.get_max_batches()):
+            batch = list(
+                Message.objects.filter(delivery_status="pending", id__gt=cursor)
+                .order_by("id")
+                .values(
+                    "id",
+                    "conversation_id",
+                    "content",
+                    "timestamp",
+                    "sender_id",
+                    "sender__username",
+                    "sender__first_name",
+                    "sender__last_name",
+                    "delivery_attempts",
+                    "last_delivery_attempt",
+                )[:batch_size]
+            )
+            if batch:
+                stats += DeliveryRetryService.retry_batch(batch, now)
+                cursor = batch[-1]["id"]
+            if len(batch) < batch_size:
+                # Reached the end of the backlog; start over next pass
+                cursor = 0
+                break
+
+        cache.set(CURSOR_KEY, cursor, None)
+        if stats:
+            logger.info(f"Delivery retry pass: {dict(stats)}")
+        return stats
+
+    @staticmethod
+    def retry_batch(batch, now):
+        """
+        Retry one batch of pending messages.
+
+        Args:
+            batch: Message values() dicts, as selected by ``run_pass``
+            now: The time of the attempt
+
+        Returns:
+            Counter of messages 'delivered' and 'retried'
+        """
+        due = [message for message in batch if DeliveryRetryService.is_due(message, now)]
+        if not due:
+            return Counter()
+
+        participants = defaultdict(set)
+        for conversation_id, user_id in Conversation.participants.through.objects.filter(
+            conversation_id__in={message["conversation_id"] for message in due}
+        ).values_list("conversation_id", "customuser_id"):
+            participants[conversation_id].add(user_id)
+
+        online = {}
+        deliveries = []  # (message, online recipient IDs)
+        retried_ids = []
+        for message in due:
+            recipients = participants[message["conversation_id"]] - {message["sender_id"]}
+            for user_id in recipients - online.keys():
+                online[user_id] = PresenceService.is_online(user_id)
+            online_recipients = [user_id for user_id in recipients if online[user_id]]
+
+            if online_recipients:
+                deliveries.append((message, online_recipients))
+            else:
+                # Nothing to send to; the reconnect stream delivers it
+                retried_ids.append(message["id"])
+
+        # Only rows still pending are touched, so a concurrent sync_ack wins
+        pending = Message.objects.filter(delivery_status="pending")
+        attempt = {
+            "delivery_attempts": F("delivery_attempts") + 1,
+            "last_delivery_attempt": now,
+        }
+        delivered_ids = [message["id"] for message, _recipients in deliveries]
+        pending.filter(id__in=delivered_ids).update(delivery_status="delivered", **attempt)
+        pending.filter(id__in=retried_ids).update(**attempt)
+
+        channel_layer = get_channel_layer()
+        for message, recipients in deliveries:
+            event = DeliveryRetryService.chat_message_event(message)
+            for user_id in recipients:
+                async_to_sync(channel_layer.group_send)(f"user_{user_id}", event)
+
+        return Counter(delivered=len(delivered_ids), retried=len(retried_ids))
+
+    @staticmethod
+    def chat_message_event(message):
+        """Build the ``chat_message`` channel event for a message values() dict."""
+        return {
+            "type": "chat_message",
+            "message": {
+                "id": message["id"],
+                "content": message["content"],
+                "timestamp": message["timestamp"].isoformat(),
+                "sender_id": message["sender_id"],
+                "sender_name": f"{message['sender__first_name']} {message['sender__last_name']}".strip()
+                or message["sender__username"],
+                "is_read": False,
+                "delivery_status": "delivered",
+            },
+            "conversation_id": message["conversation_id"],
+        }
+
+    @staticmethod
+    def ensure_scheduler():
+        """
+        Start the in-process retry scheduler on the running event loop.
+
+        Only used in single-node mode (CHAT_DELIVERY_RETRY_IN_PROCESS); with
+        several server processes run the ``retry_message_delivery`` command
+        instead.
+        """
+        if not getattr(settings, "CHAT_DELIVERY_RETRY_IN_PROCESS", False):
+            return
+        loop = asyncio.get_running_loop()
+        task = _schedulers.get(loop)
+        if task is None or task.done():
+            _schedulers[loop] = loop.create_task(DeliveryRetryService._run_forever())
+
+    @staticmethod
+    async def _run_forever():
+        while True:
+            await asyncio.sleep(DeliveryRetryService.get_interval())
+            try:
+                await database_sync_to_async(DeliveryRetryService.run_pass)()
+            except Exception as e:
+                logger.error(f"Error in delivery retry pass: {str(e)}", exc_info=True)
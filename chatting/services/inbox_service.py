@@ -0,0 +1,180 @@
+from collections import Counter
+
+from django.db.models import Case, Count, F, IntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from chatting.models import Conversation, InboxEntry, Message, ReadWatermark
+
+
+class InboxService:
+    """
+    Service class maintaining the denormalized ``InboxEntry`` rows.
+
+    Every write touches only the entries of the conversation involved, so
+    keeping the inbox current costs a constant number of statements per
+    message or read, independent of the message history.
+    """
+
+    @staticmethod
+    def ensure_entries(conversation_id):
+        """
+        Create missing inbox entries for every participant of a conversation.
+
+        Returns:
+            The number of participants
+        """
+        participant_ids = list(
+            Conversation.participants.through.objects.filter(
+                conversation_id=conversation_id
+            ).values_list("customuser_id", flat=True)
+        )
+        updated_at = (
+            Conversation.objects.filter(id=conversation_id)
+            .values_list("updated_at", flat=True)
+            .first()
+        )
+        if updated_at is None:
+            return 0
+
+        entries = []
+        for user_id in participant_ids:
+            others = [uid for uid in participant_ids if uid != user_id]
+            entries.append(
+                InboxEntry(
+                    user_id=user_id,
+                    conversation_id=conversation_id,
+                    other_user_id=others[0] if others else None,
+                    updated_at=updated_at,
+                )
+            )
+        InboxEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        return len(participant_ids)
+
+    @staticmethod
+    def messages_created(messages):
+        """
+        Record newly saved messages in their conversations' inbox entries.
+
+        Issues one UPDATE per conversation: every entry gets the newest
+        message as its snapshot, and each participant's unread count grows
+        by the number of new messages they did not send themselves.
+        """
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+
+        for conversation_id, batch in by_conversation.items():
+            last = max(batch, key=lambda message: message.id)
+            sent_by = Counter(message.sender_id for message in batch)
+
+            own_messages = Case(
+                *[
+                    When(user_id=sender_id, then=Value(count))
+                    for sender_id, count in sent_by.items()
+                ],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            InboxEntry.objects.filter(conversation_id=conversation_id).update(
+                last_message_id=last.id,
+                last_message_content=last.content,
+                last_message_sender_id=last.sender_id,
+                last_message_at=last.timestamp,
+                updated_at=last.timestamp,
+                unread_count=F("unread_count") + Value(len(batch)) - own_messages,
+            )
+
+    @staticmethod
+    def conversation_read(conversation_id, user_id, last_read_message_id):
+        """Recount a user's unread messages after their watermark moved."""
+        entries = InboxEntry.objects.filter(
+            conversation_id=conversation_id, user_id=user_id
+        )
+        # Common case: the user caught up with the newest message
+        if entries.filter(last_message_id__lte=last_read_message_id).update(
+            unread_count=0
+        ):
+            return
+
+        unread = (
+            Message.objects.filter(
+                conversation_id=conversation_id,
+                id__gt=last_read_message_id,
+                is_deleted=False,
+            )
+            .exclude(sender_id=user_id)
+            .values("conversation_id")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        entries.update(unread_count=Coalesce(Subquery(unread), 0))
+
+    @staticmethod
+    def message_changed(message):
+        """
+        Refresh the inbox after a message was edited or deleted.
+
+        The snapshot is updated if the message is the newest one, and unread
+        counts are recomputed when a message is deleted.
+        """
+        InboxEntry.objects.filter(
+            conversation_id=message.conversation_id, last_message_id=message.id
+        ).update(last_message_content=message.content)
+
+        if message.is_deleted:
+            InboxService.recount_unread(message.conversation_id)
+
+    @staticmethod
+    def recount_unread(conversation_id):
+        """Recompute the unread count of every entry of a conversation."""
+        read_positions = dict(
+            ReadWatermark.objects.filter(conversation_id=conversation_id).values_list(
+                "user_id", "last_read_message_id"
+            )
+        )
+        for user_id in InboxEntry.objects.filter(
+            conversation_id=conversation_id
+        ).values_list("user_id", flat=True):
+            InboxService.conversation_read(
+                conversation_id, user_id, read_positions.get(user_id, 0)
+            )
+
+    @staticmethod
+    def rebuild(conversation_ids=None):
+        """
+        Recompute inbox entries from scratch.
+
+        Used to backfill existing conversations and to repair drift.
+
+        Args:
+            conversation_ids: Conversations to rebuild, or None for all
+
+        Returns:
+            The number of conversations rebuilt
+        """
+        conversations = Conversation.objects.all()
+        if conversation_ids is not None:
+            conversations = conversations.filter(id__in=conversation_ids)
+
+        rebuilt = 0
+        for conversation_id in conversations.values_list("id", flat=True).iterator():
+            InboxService.ensure_entries(conversation_id)
+
+            last = (
+                Message.objects.filter(conversation_id=conversation_id)
+                .order_by("-id")
+                .first()
+            )
+            if last is not None:
+                InboxEntry.objects.filter(conversation_id=conversation_id).update(
+                    last_message_id=last.id,
+                    last_message_content=last.content,
+                    last_message_sender_id=last.sender_id,
+                    last_message_at=last.timestamp,
+                    updated_at=last.timestamp,
+                )
+
+            InboxService.recount_unread(conversation_id)
+            rebuilt += 1
+
+        return rebuilt
@@ -0,0 +1,106 @@
+import logging
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+
+from chatting.models import Conversation
+from chatting.services.inbox_service import InboxService
+from chatting.services.presence_service import PresenceService
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipService:
+    """Service class for conversation membership lookups and change events."""
+
+    @staticmethod
+    def get_routing_table(user_id):
+        """
+        Map every conversation of a user to its participant IDs.
+
+        Loaded once per WebSocket connection so that authorization and routing
+        on the message path need no database reads.
+
+        Returns:
+            Dict of conversation ID -> set of participant IDs
+        """
+        through = Conversation.participants.through
+        user_conversations = through.objects.filter(customuser_id=user_id).values(
+            "conversation_id"
+        )
+
+        routing_table = defaultdict(set)
+        for conversation_id, participant_id in through.objects.filter(
+            conversation_id__in=user_conversations
+        ).values_list("conversation_id", "customuser_id"):
+            routing_table[conversation_id].add(participant_id)
+        return dict(routing_table)
+
+    @staticmethod
+    def get_participant_ids(conversation_id):
+        """Get the participant IDs of a single conversation."""
+        return set(
+            Conversation.participants.through.objects.filter(
+                conversation_id=conversation_id
+            ).values_list("customuser_id", flat=True)
+        )
+
+    @staticmethod
+    def get_or_create_direct_conversation(user_id, other_user_id):
+        """
+        Get the direct conversation of two users, creating it if needed.
+
+        The lookup is a single probe of the unique (min, max) user pair index,
+        and concurrent creates of the same pair end up with one conversation.
+
+        Returns:
+            (conversation, created)
+        """
+        pair_min, pair_max = sorted((user_id, other_user_id))
+        with transaction.atomic():
+            conversation, created = Conversation.objects.get_or_create(
+                pair_min_user_id=pair_min, pair_max_user_id=pair_max
+            )
+            if created:
+                conversation.participants.add(pair_min, pair_max)
+
+        if created:
+            MembershipService.conversation_changed(conversation.id, [pair_min, pair_max])
+        return conversation, created
+
+    @staticmethod
+    def conversation_changed(conversation_id, participant_ids, removed_ids=()):
+        """
+        Propagate a membership change of a conversation.
+
+        Creates inbox entries for new participants, drops the cached
+        conversation and contact lists of everyone involved and sends a
+        ``membership_changed`` control event to their sockets so they update
+        their routing tables.
+        """
+        InboxService.ensure_entries(conversation_id)
+
+        affected_ids = set(participant_ids) | set(removed_ids)
+        cache.delete_many([f"user_conversations_{uid}" for uid in affected_ids])
+        PresenceService.invalidate_contacts(*affected_ids)
+
+        channel_layer = get_channel_layer()
+        if not channel_layer:
+            return
+
+        event = {
+            "type": "membership_changed",
+            "conversation_id": conversation_id,
+            "participant_ids": sorted(participant_ids),
+        }
+        try:
+            for user_id in affected_ids:
+                async_to_sync(channel_layer.group_send)(f"user_{user_id}", event)
+        except Exception as e:
+            # Sockets fall back to a database lookup for unknown conversations
+            logger.error(
+                f"Error sending membership change for conversation {conversation_id}: {str(e)}"
+            )
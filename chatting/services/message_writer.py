@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from chatting.models import Conversation, Message
+from chatting.services.inbox_service import InboxService
+
+logger = logging.getLogger(__name__)
+
+
+class _WriteBuffer:
+    """Messages waiting for the next group commit on one event loop."""
+
+    def __init__(self):
+        self.pending = []  # (Message, Future) pairs
+        self.flush_handle = None
+
+
+# One buffer per event loop, since the sender futures belong to a loop
+_buffers = weakref.WeakKeyDictionary()
+
+
+class MessageWriter:
+    """
+    Service class for writing chat messages.
+
+    With CHAT_GROUP_COMMIT enabled, messages from all sockets of the process
+    are buffered for up to CHAT_GROUP_COMMIT_MAX_DELAY_MS milliseconds (or
+    CHAT_GROUP_COMMIT_MAX_ROWS messages) and written in one transaction: a
+    single bulk INSERT plus a single Conversation.updated_at UPDATE. Each
+    caller resumes only once that transaction has committed.
+    """
+
+    @staticmethod
+    def is_group_commit_enabled():
+        return getattr(settings, "CHAT_GROUP_COMMIT", False)
+
+    @staticmethod
+    def get_max_delay():
+        """Seconds a message may wait for the rest of its batch."""
+        return getattr(settings, "CHAT_GROUP_COMMIT_MAX_DELAY_MS", 5) / 1000
+
+    @staticmethod
+    def get_max_rows():
+        return getattr(settings, "CHAT_GROUP_COMMIT_MAX_ROWS", 100)
+
+    @staticmethod
+    def build_message(conversation_id, sender_id, content, status="pending"):
+        """
+        Build an unsaved message with its final delivery status.
+
+        Args:
+            conversation_id: The ID of the conversation
+            sender_id: The ID of the message sender
+            content: The sanitized message content
+            status: Initial delivery status ('pending' or 'delivered')
+
+        Returns:
+            The unsaved Message object
+        """
+        delivered = status == "delivered"
+        return Message(
+            conversation_id=conversation_id,
+            sender_id=sender_id,
+            content=content,
+            delivery_status=status,
+            delivery_attempts=1 if delivered else 0,
+            last_delivery_attempt=timezone.now() if delivered else None,
+        )
+
+    @staticmethod
+    def write(messages):
+        """
+        Insert messages and bump their conversations and inbox entries in
+        one transaction.
+
+        Returns:
+            The saved messages, with primary keys set
+        """
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            Conversation.objects.filter(
+                id__in={message.conversation_id for message in messages}
+            ).update(updated_at=timezone.now())
+            InboxService.messages_created(messages)
+        return messages
+
+    @staticmethod
+    async def submit(message):
+        """
+        Queue a message for the next group commit and wait for it.
+
+        Returns:
+            The saved Message object
+
+        Raises:
+            Whatever the batched write raised, for every message in the batch
+        """
+        loop = asyncio.get_running_loop()
+        buffer = _buffers.get(loop)
+        if buffer is None:
+            buffer = _buffers[loop] = _WriteBuffer()
+
+        future = loop.create_future()
+        buffer.pending.append((message, future))
+
+        if len(buffer.pending) >= MessageWriter.get_max_rows():
+            # Batch is full; write it now instead of waiting for the timer
+            if buffer.flush_handle is not None:
+                buffer.flush_handle.cancel()
+            MessageWriter._start_flush(buffer)
+        elif buffer.flush_handle is None:
+            buffer.flush_handle = loop.call_later(
+                MessageWriter.get_max_delay(), MessageWriter._start_flush, buffer
+            )
+
+        return await future
+
+    @staticmethod
+    def _start_flush(buffer):
+        batch = buffer.pending
+        buffer.pending = []
+        buffer.flush_handle = None
+        asyncio.ensure_future(MessageWriter._flush(batch))
+
+    @staticmethod
+    async def _flush(batch):
+        try:
+            await database_sync_to_async(MessageWriter.write)(
+                [message for message, _future in batch]
+            )
+        except Exception as e:
+            logger.error(
+                f"Error writing batch of {len(batch)} messages: {str(e)}", exc_info=True
+            )
+            for _message, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug(f"Group-committed {len(batch)} messages")
+        for message, future in batch:
+            if not future.done():
+                future.set_result(message)
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import threading
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from authentication.models import CustomUser
+from chatting.models import UserStatus
+
+logger = logging.getLogger(__name__)
+
+# Status changes waiting to be written to UserStatus, keyed by user ID.
+# Repeated connects/disconnects of the same user between two flushes
+# collapse into a single row write.
+_pending_status = {}
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+
+
+class PresenceService:
+    """
+    Service class for tracking which users are online.
+
+    The source of truth is a per-user connection counter in the cache whose TTL
+    is refreshed by client heartbeats. ``UserStatus`` rows are a durable mirror
+    that is updated in coalesced batches instead of on every connect.
+
+    Each counter gets a new epoch when it is created, and every socket keeps
+    the epoch it was counted in. If the counter expires while sockets are
+    still open, each of them finds a different epoch on its next heartbeat
+    and registers again, so the count is rebuilt from the live sockets.
+    """
+
+    @staticmethod
+    def get_ttl():
+        """Seconds a presence key survives without a heartbeat."""
+        return getattr(settings, "CHAT_PRESENCE_TTL", 90)
+
+    @staticmethod
+    def get_flush_interval():
+        """Seconds between UserStatus flushes (0 flushes immediately)."""
+        return getattr(settings, "CHAT_PRESENCE_FLUSH_INTERVAL", 5)
+
+    @staticmethod
+    def presence_key(user_id):
+        return f"presence_{user_id}"
+
+    @staticmethod
+    def epoch_key(user_id):
+        return f"presence_epoch_{user_id}"
+
+    @staticmethod
+    def contacts_key(user_id):
+        return f"presence_contacts_{user_id}"
+
+    @staticmethod
+    def connect(user_id):
+        """
+        Register a new socket for a user.
+
+        Returns:
+            (came_online, epoch): True if this is the user's first live socket
+            (offline -> online), and the epoch the socket was counted in
+        """
+        key = PresenceService.presence_key(user_id)
+        epoch_key = PresenceService.epoch_key(user_id)
+        ttl = PresenceService.get_ttl()
+
+        # add() is a no-op if the key exists, so concurrent sockets share it
+        created = cache.add(key, 0, ttl)
+        try:
+            connections = cache.incr(key)
+        except ValueError:
+            # Key expired between add() and incr()
+            cache.set(key, 1, ttl)
+            created, connections = True, 1
+        cache.touch(key, ttl)
+
+        if created:
+            # A new counter: sockets counted in the old one register again
+            epoch = uuid.uuid4().hex
+            cache.set(epoch_key, epoch, ttl)
+        else:
+            cache.add(epoch_key, uuid.uuid4().hex, ttl)
+            epoch = cache.get(epoch_key)
+            cache.touch(epoch_key, ttl)
+
+        if connections == 1:
+            PresenceService.record_status(user_id, True)
+            return True, epoch
+        return False, epoch
+
+    @staticmethod
+    def disconnect(user_id, epoch=None):
+        """
+        Unregister a socket for a user.
+
+        Args:
+            user_id: The ID of the user
+            epoch: The epoch the socket was counted in; a socket counted in
+                an expired counter is not in the current one
+
+        Returns:
+            True if this was the user's last live socket (online -> offline)
+        """
+        key = PresenceService.presence_key(user_id)
+        current = cache.get(PresenceService.epoch_key(user_id))
+        if epoch is not None and current is not None and current != epoch:
+            return False
+        try:
+            connections = cache.decr(key)
+        except ValueError:
+            # Key already expired, the user is offline either way
+            connections = 0
+
+        if connections <= 0:
+            cache.delete_many([key, PresenceService.epoch_key(user_id)])
+            PresenceService.record_status(user_id, False)
+            return True
+        return False
+
+    @staticmethod
+    def heartbeat(user_id, epoch):
+        """
+        Refresh the TTL of a user's presence key.
+
+        Returns:
+            The epoch the socket is counted in from now on
+        """
+        key = PresenceService.presence_key(user_id)
+        epoch_key = PresenceService.epoch_key(user_id)
+        ttl = PresenceService.get_ttl()
+        if cache.get(epoch_key) == epoch and cache.touch(key, ttl):
+            cache.touch(epoch_key, ttl)
+            return epoch
+        # The counter expired (e.g. a long GC pause), and may have been
+        # recreated by another socket since; count this socket again
+        return PresenceService.connect(user_id)[1]
+
+    @staticmethod
+    def is_online(user_id):
+        """Check whether a user has at least one live socket."""
+        if not user_id:
+            return False
+        return bool(cache.get(PresenceService.presence_key(user_id)))
+
+    @staticmethod
+    def get_contact_ids(user_id):
+        """
+        Get the IDs of users who share at least one conversation with a user.
+
+        Only these users are told about the user's status changes.
+        """
+        key = PresenceService.contacts_key(user_id)
+        contact_ids = cache.get(key)
+        if contact_ids is not None:
+            return contact_ids
+
+        contact_ids = list(
+            CustomUser.objects.filter(conversations__participants__id=user_id)
+            .exclude(id=user_id)
+            .values_list("id", flat=True)
+            .distinct()
+        )
+        cache.set(key, contact_ids, 600)
+        return contact_ids
+
+    @staticmethod
+    def invalidate_contacts(*user_ids):
+        """Drop cached contact lists after conversation membership changes."""
+        cache.delete_many([PresenceService.contacts_key(uid) for uid in user_ids])
+
+    @staticmethod
+    async def broadcast_status(channel_layer, user_id, contact_ids, status, last_seen=None):
+        """
+        Send a user_status event to the personal groups of a user's contacts.
+
+        Returns:
+            The number of group sends performed
+        """
+        event = {"type": "user_status", "user_id": user_id, "status": status}
+        if last_seen is not None:
+            event["last_seen"] = last_seen
+
+        for contact_id in contact_ids:
+            await channel_layer.group_send(f"user_{contact_id}", event)
+        return len(contact_ids)
+
+    @staticmethod
+    def record_status(user_id, is_online):
+        """Queue a status change for the next UserStatus flush."""
+        with _pending_lock:
+            _pending_status[user_id] = (is_online, timezone.now())
+
+        if PresenceService.get_flush_interval() <= 0:
+            PresenceService.flush()
+        else:
+            PresenceService._schedule_flush()
+
+    @staticmethod
+    def _schedule_flush():
+        """Arrange for a flush after the configured interval, once per window."""
+        global _flush_scheduled
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from a sync thread (e.g. database_sync_to_async); use a timer
+            loop = None
+
+        with _pending_lock:
+            if _flush_scheduled:
+                return
+            _flush_scheduled = True
+
+        interval = PresenceService.get_flush_interval()
+        if loop is not None:
+            loop.call_later(
+                interval,
+                lambda: asyncio.ensure_future(
+                    database_sync_to_async(PresenceService.flush)()
+                ),
+            )
+        else:
+            timer = threading.Timer(interval, PresenceService._flush_in_thread)
+            timer.daemon = True
+            timer.start()
+
+    @staticmethod
+    def _flush_in_thread():
+        """Flush from a timer thread and release its DB connection."""
+        try:
+            PresenceService.flush()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def flush():
+        """
+        Write all queued status changes to UserStatus in a single upsert.
+
+        Returns:
+            The number of users flushed
+        """
+        global _flush_scheduled
+
+        with _pending_lock:
+            pending = dict(_pending_status)
+            _pending_status.clear()
+            _flush_scheduled = False
+
+        if not pending:
+            return 0
+
+        rows = []
+        for user_id, (is_online, changed_at) in pending.items():
+            row = UserStatus(user_id=user_id, is_online=is_online)
+            row.last_active = changed_at
+            rows.append(row)
+
+        try:
+            UserStatus.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["user"],
+                update_fields=["is_online", "last_active"],
+            )
+            logger.debug(f"Flushed presence for {len(rows)} users")
+        except Exception as e:
+            logger.error(f"Error flushing presence: {str(e)}", exc_info=True)
+            # Put the changes back unless a newer change arrived meanwhile
+            with _pending_lock:
+                for user_id, value in pending.items():
+                    _pending_status.setdefault(user_id, value)
+            PresenceService._schedule_flush()
+            return 0
+
+        return len(rows)
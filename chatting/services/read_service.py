@@ -0,0 +1,118 @@
+import logging
+
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from chatting.models import Message, ReadWatermark
+from chatting.services.inbox_service import InboxService
+
+logger = logging.getLogger(__name__)
+
+
+class ReadService:
+    """
+    Service class for read state, derived from per-participant watermarks.
+
+    A message is read by a user when its ID is at or below the user's
+    ``ReadWatermark.last_read_message_id`` for the conversation.
+    """
+
+    @staticmethod
+    def mark_read(conversation_id, user_id, message_id=None):
+        """
+        Move a user's watermark forward to ``message_id``.
+
+        Args:
+            conversation_id: The ID of the conversation
+            user_id: The ID of the reader
+            message_id: Last message read; defaults to the newest message
+
+        Returns:
+            (last_read_message_id, last_read_at) if the watermark moved,
+            otherwise None
+        """
+        if message_id is None:
+            message_id = Message.objects.filter(
+                conversation_id=conversation_id
+            ).aggregate(last_id=Max("id"))["last_id"]
+            if message_id is None:
+                return None
+
+        now = timezone.now()
+
+        # Watermarks only move forward, so an older read never undoes a newer one
+        updated = ReadWatermark.objects.filter(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            last_read_message_id__lt=message_id,
+        ).update(last_read_message_id=message_id, last_read_at=now)
+
+        if not updated:
+            _, created = ReadWatermark.objects.get_or_create(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                defaults={"last_read_message_id": message_id, "last_read_at": now},
+            )
+            if not created:
+                return None
+
+        InboxService.conversation_read(conversation_id, user_id, message_id)
+        return message_id, now
+
+    @staticmethod
+    def get_read_positions(conversation_id):
+        """
+        Get the watermark of every participant who has read the conversation.
+
+        Returns:
+            Dict of user ID -> last read message ID
+        """
+        return dict(
+            ReadWatermark.objects.filter(conversation_id=conversation_id).values_list(
+                "user_id", "last_read_message_id"
+            )
+        )
+
+    @staticmethod
+    def is_read_by_others(message, read_positions=None):
+        """Check whether anyone other than the sender has read a message."""
+        if read_positions is None:
+            read_positions = ReadService.get_read_positions(message.conversation_id)
+        return any(
+            last_read_id >= message.id
+            for user_id, last_read_id in read_positions.items()
+            if user_id != message.sender_id
+        )
+
+    @staticmethod
+    def _watermark_subquery(user, conversation_ref):
+        return Coalesce(
+            Subquery(
+                ReadWatermark.objects.filter(
+                    conversation_id=OuterRef(conversation_ref), user=user
+                ).values("last_read_message_id")[:1]
+            ),
+            0,
+        )
+
+    @staticmethod
+    def annotate_unread_count(conversations, user):
+        """Annotate conversations with ``unread_count`` for a user."""
+        return conversations.annotate(
+            unread_count=Count(
+                "messages",
+                filter=Q(messages__id__gt=ReadService._watermark_subquery(user, "pk"))
+                & ~Q(messages__sender=user)
+                & Q(messages__is_deleted=False),
+            )
+        )
+
+    @staticmethod
+    def unread_messages(user):
+        """Queryset of messages the user has not read, across conversations."""
+        return (
+            Message.objects.filter(conversation__participants=user, is_deleted=False)
+            .exclude(sender=user)
+            .filter(id__gt=ReadService._watermark_subquery(user, "conversation_id"))
+        )
@@ -0,0 +1,219 @@
+import logging
+import re
+
+from django.conf import settings
+from django.db import connections
+
+from chatting.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "chatting_message_fts"
+PG_INDEX_NAME = "chatting_message_search"
+
+# Terms beyond this are ignored; they only make the query slower
+MAX_TERMS = 8
+
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _sqlite_setup_statements(message_table):
+    """
+    FTS5 index of undeleted messages, maintained by triggers.
+
+    The index is contentless: it stores the tokens only and results are
+    joined back to the message table by rowid. Each document also gets a
+    ``c<conversation_id>`` token, so a search scoped to the caller's
+    conversations is an intersection of posting lists; members of many
+    conversations are filtered by a join instead.
+    """
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            content, conversation, content='',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+        AFTER INSERT ON {message_table} WHEN new.is_deleted = 0
+        BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, content, conversation)
+            VALUES (new.id, new.content, 'c' || new.conversation_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+        AFTER DELETE ON {message_table} WHEN old.is_deleted = 0
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content, conversation)
+            VALUES ('delete', old.id, old.content, 'c' || old.conversation_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+        AFTER UPDATE OF content, is_deleted, conversation_id ON {message_table}
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content, conversation)
+            SELECT 'delete', old.id, old.content, 'c' || old.conversation_id
+            WHERE old.is_deleted = 0;
+            INSERT INTO {FTS_TABLE}(rowid, content, conversation)
+            SELECT new.id, new.content, 'c' || new.conversation_id
+            WHERE new.is_deleted = 0;
+        END
+        """,
+    ]
+
+
+class SearchService:
+    """
+    Service class for full-text search over message history.
+
+    SQLite uses an FTS5 table kept in sync by triggers, PostgreSQL a GIN
+    index on ``to_tsvector('simple', content)``; either way creates, edits
+    (``Message.edit_message``), deletes (``Message.delete_message``) and bulk
+    writes are reflected without application code. Results are ranked
+    (BM25 / ts_rank) and returned as ``(message_id, score)`` pairs, best
+    first, where a lower score is better on both backends.
+
+    Ranking has to score every match, so a search returns the best
+    MESSAGE_SEARCH_MAX_RESULTS at once and ``MessageSearchPagination``
+    pages through that snapshot instead of searching again per page.
+    """
+
+    @staticmethod
+    def get_max_results():
+        return getattr(settings, "MESSAGE_SEARCH_MAX_RESULTS", 1000)
+
+    @staticmethod
+    def get_max_match_conversations():
+        return getattr(settings, "MESSAGE_SEARCH_MAX_MATCH_CONVERSATIONS", 50)
+
+    @staticmethod
+    def install(using="default"):
+        """
+        Create the search index for the database's backend if it is missing.
+
+        Called after migrate; existing messages are indexed on creation.
+        """
+        connection = connections[using]
+        message_table = Message._meta.db_table
+
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                    [FTS_TABLE],
+                )
+                exists = cursor.fetchone() is not None
+                for statement in _sqlite_setup_statements(message_table):
+                    cursor.execute(statement)
+                if not exists:
+                    cursor.execute(
+                        f"INSERT INTO {FTS_TABLE}(rowid, content, conversation) "
+                        f"SELECT id, content, 'c' || conversation_id FROM {message_table} "
+                        f"WHERE is_deleted = 0"
+                    )
+                    logger.info(f"Created {FTS_TABLE} and indexed existing messages")
+
+        elif connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(
+                    cursor, message_table
+                )
+            if PG_INDEX_NAME not in constraints:
+                with connection.schema_editor() as schema_editor:
+                    schema_editor.add_index(Message, SearchService._pg_index())
+                logger.info(f"Created GIN index {PG_INDEX_NAME}")
+
+    @staticmethod
+    def _pg_index():
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        return GinIndex(SearchVector("content", config="simple"), name=PG_INDEX_NAME)
+
+    @staticmethod
+    def tokenize(text):
+        """Split a search string into lowercase word terms."""
+        return [term.lower() for term in TERM_RE.findall(text or "")][:MAX_TERMS]
+
+    @staticmethod
+    def search(user_id, terms, limit=None, using="default"):
+        """
+        Rank the messages in a user's conversations that contain all terms.
+
+        The last term matches as a prefix, so results follow as-you-type input.
+
+        Args:
+            user_id: The ID of the searching user
+            terms: Terms from ``tokenize``
+            limit: Maximum number of results (default: MESSAGE_SEARCH_MAX_RESULTS)
+
+        Returns:
+            List of (message_id, score), best first
+        """
+        conversation_ids = list(
+            Conversation.participants.through.objects.filter(
+                customuser_id=user_id
+            ).values_list("conversation_id", flat=True)
+        )
+        if not terms or not conversation_ids:
+            return []
+
+        if limit is None:
+            limit = SearchService.get_max_results()
+        if connections[using].vendor == "postgresql":
+            return SearchService._search_postgresql(conversation_ids, terms, limit)
+        return SearchService._search_sqlite(user_id, conversation_ids, terms, limit, using)
+
+    @staticmethod
+    def _search_sqlite(user_id, conversation_ids, terms, limit, using):
+        words = [f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*']
+        match = f"content:({' '.join(words)})"
+
+        # Only the content column counts towards the BM25 score
+        score = f"bm25({FTS_TABLE}, 1.0, 0.0)"
+        if len(conversation_ids) <= SearchService.get_max_match_conversations():
+            # Few conversations: intersect with their c<id> posting lists
+            conversations = " OR ".join(f"c{conversation_id}" for conversation_id in conversation_ids)
+            match = f"{match} AND conversation:({conversations})"
+            sql = (
+                f"SELECT rowid, {score} AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY score, rowid DESC LIMIT %s"
+            )
+            params = [match, limit]
+        else:
+            # A long OR of tokens costs more than it saves, so filter the
+            # content matches through the user's memberships instead
+            message_table = Message._meta.db_table
+            participant_table = Conversation.participants.through._meta.db_table
+            sql = (
+                f"SELECT {FTS_TABLE}.rowid, {score} AS score FROM {FTS_TABLE} "
+                f"JOIN {message_table} m ON m.id = {FTS_TABLE}.rowid "
+                f"JOIN {participant_table} p ON p.conversation_id = m.conversation_id "
+                f"AND p.customuser_id = %s "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY score, {FTS_TABLE}.rowid DESC LIMIT %s"
+            )
+            params = [user_id, match, limit]
+
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(message_id, score) for message_id, score in cursor.fetchall()]
+
+    @staticmethod
+    def _search_postgresql(conversation_ids, terms, limit):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector("content", config="simple")
+        query = SearchQuery(
+            " & ".join(terms[:-1] + [f"{terms[-1]}:*"]),
+            search_type="raw",
+            config="simple",
+        )
+        hits = (
+            Message.objects.annotate(document=vector)
+            .filter(document=query, conversation_id__in=conversation_ids, is_deleted=False)
+            .annotate(score=-SearchRank(vector, query))
+        )
+        return list(hits.order_by("score", "-id").values_list("id", "score")[:limit])
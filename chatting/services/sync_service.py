@@ -0,0 +1,195 @@
+import logging
+
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from chatting.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = (
+    "id",
+    "conversation_id",
+    "sender_id",
+    "content",
+    "timestamp",
+    "is_edited",
+    "is_deleted",
+    "file_attachment",
+    "file_type",
+    "file_name",
+    "file_size",
+)
+
+
+class SyncService:
+    """
+    Service class for delta sync after a reconnect.
+
+    The client sends the ID of the last message it has seen in each
+    conversation (its high-water mark) and gets back only what it missed:
+    messages above the mark, plus edits and deletes of messages at or below
+    it made after the mark message was sent. The whole response costs four
+    queries, however many conversations are synced.
+    """
+
+    @staticmethod
+    def get_limit():
+        """Maximum number of new messages per conversation in one response."""
+        return getattr(settings, "CHAT_DELTA_SYNC_LIMIT", 100)
+
+    @staticmethod
+    def get_max_conversations():
+        return getattr(settings, "CHAT_DELTA_SYNC_MAX_CONVERSATIONS", 200)
+
+    @staticmethod
+    def parse_marks(raw_marks):
+        """
+        Validate a ``{conversation_id: last_seen_message_id}`` mapping.
+
+        Returns:
+            Dict of int conversation ID -> int message ID
+
+        Raises:
+            ValueError: If the mapping is malformed or too large
+        """
+        if not isinstance(raw_marks, dict):
+            raise ValueError("marks must map conversation IDs to message IDs")
+        if len(raw_marks) > SyncService.get_max_conversations():
+            raise ValueError(
+                f"At most {SyncService.get_max_conversations()} conversations per sync"
+            )
+        try:
+            return {
+                int(conversation_id): max(int(message_id or 0), 0)
+                for conversation_id, message_id in raw_marks.items()
+            }
+        except (TypeError, ValueError):
+            raise ValueError("marks must map conversation IDs to message IDs")
+
+    @staticmethod
+    def delta(user_id, marks):
+        """
+        Collect what a user missed in the given conversations.
+
+        Conversations the user is not part of are ignored, and conversations
+        without news are left out of the result.
+
+        Args:
+            user_id: The ID of the syncing user
+            marks: Dict of conversation ID -> last seen message ID
+
+        Returns:
+            Dict of conversation ID -> {"messages", "changes", "mark", "has_more"}
+            where "mark" is the new high-water mark and "has_more" tells the
+            client to sync again from it
+        """
+        member_of = set(
+            Conversation.participants.through.objects.filter(
+                customuser_id=user_id, conversation_id__in=list(marks)
+            ).values_list("conversation_id", flat=True)
+        )
+        marks = {
+            conversation_id: mark
+            for conversation_id, mark in marks.items()
+            if conversation_id in member_of
+        }
+        if not marks:
+            return {}
+
+        # Send times of the mark messages; later edits are news to the client
+        mark_times = {
+            (conversation_id, message_id): timestamp
+            for message_id, conversation_id, timestamp in Message.objects.filter(
+                id__in=[mark for mark in marks.values() if mark]
+            ).values_list("id", "conversation_id", "timestamp")
+        }
+
+        new_messages = Q()
+        changes = Q()
+        for conversation_id, mark in marks.items():
+            new_messages |= Q(conversation_id=conversation_id, id__gt=mark)
+            if mark:
+                changed = Q(conversation_id=conversation_id, id__lte=mark)
+                sent_at = mark_times.get((conversation_id, mark))
+                if sent_at is not None:
+                    changed &= Q(changed_at__gt=sent_at)
+                else:
+                    changed &= Q(changed_at__isnull=False)
+                changes |= changed
+
+        limit = SyncService.get_limit()
+        result = {}
+
+        # One query for all conversations, at most limit + 1 rows each
+        rows = (
+            Message.objects.filter(new_messages)
+            .annotate(
+                row=Window(
+                    RowNumber(),
+                    partition_by=[F("conversation_id")],
+                    order_by=F("id").asc(),
+                )
+            )
+            .filter(row__lte=limit + 1)
+            .order_by("conversation_id", "id")
+            .values(*MESSAGE_FIELDS)
+        )
+        for message in rows:
+            entry = SyncService._entry(result, message["conversation_id"], marks)
+            if len(entry["messages"]) == limit:
+                entry["has_more"] = True
+                continue
+            entry["messages"].append(SyncService.format_message(message))
+            entry["mark"] = message["id"]
+
+        if changes:
+            for message in (
+                Message.objects.filter(changes)
+                .order_by("id")
+                .values("id", "conversation_id", "content", "is_edited", "is_deleted", "changed_at")
+            ):
+                entry = SyncService._entry(result, message["conversation_id"], marks)
+                entry["changes"].append(
+                    {
+                        "id": message["id"],
+                        "content": "" if message["is_deleted"] else message["content"],
+                        "is_edited": message["is_edited"],
+                        "is_deleted": message["is_deleted"],
+                        "changed_at": message["changed_at"].isoformat(),
+                    }
+                )
+
+        return result
+
+    @staticmethod
+    def _entry(result, conversation_id, marks):
+        if conversation_id not in result:
+            result[conversation_id] = {
+                "messages": [],
+                "changes": [],
+                "mark": marks[conversation_id],
+                "has_more": False,
+            }
+        return result[conversation_id]
+
+    @staticmethod
+    def format_message(message):
+        """Compact form of a message values() dict."""
+        data = {
+            "id": message["id"],
+            "sender_id": message["sender_id"],
+            "content": "" if message["is_deleted"] else message["content"],
+            "timestamp": message["timestamp"].isoformat(),
+        }
+        if message["is_edited"]:
+            data["is_edited"] = True
+        if message["is_deleted"]:
+            data["is_deleted"] = True
+        if message["file_attachment"]:
+            data["file_attachment"] = message["file_attachment"]
+            data["file_type"] = message["file_type"]
+            data["file_name"] = message["file_name"]
+            data["file_size"] = message["file_size"]
+        return data
@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from chatting.models import Conversation, Message, UploadSession
+from chatting.services.inbox_service import InboxService
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".m4a")
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".avi", ".mov")
+
+
+class UploadOffsetMismatch(ValueError):
+    """A chunk does not start where the upload left off."""
+
+    def __init__(self, received_bytes):
+        super().__init__(f"Upload continues at byte {received_bytes}")
+        self.received_bytes = received_bytes
+
+
+class _PartsReader:
+    """Read-only file object over the stored parts of an upload, in order."""
+
+    def __init__(self, names, size):
+        self.names = list(names)
+        self.size = size
+        self.current = None
+
+    def read(self, size=-1):
+        data = b""
+        while size < 0 or len(data) < size:
+            if self.current is None:
+                if not self.names:
+                    break
+                self.current = default_storage.open(self.names.pop(0), "rb")
+            chunk = self.current.read(-1 if size < 0 else size - len(data))
+            if not chunk:
+                self.current.close()
+                self.current = None
+                continue
+            data += chunk
+        return data
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+
+class UploadService:
+    """
+    Service class for chunked, resumable attachment uploads.
+
+    An upload is started with its name, type and size, then sent as
+    consecutive chunks, each stored straight to the storage backend as its
+    own part, so no request holds a transaction or the whole file. A
+    client that lost its connection asks for ``received_bytes`` and resumes
+    from there. Finalizing streams the parts into a single file under
+    ``message_file_path`` and creates the message.
+
+    Integrity is checked with a rolling hash: starting from an empty string,
+    ``hash = sha256(hash_bytes + sha256(chunk))`` after every chunk. The
+    client sends its value at finalize and each chunk may carry its own
+    SHA-256 as well.
+    """
+
+    @staticmethod
+    def get_max_size():
+        """Largest attachment accepted through chunked uploads, in bytes."""
+        return getattr(settings, "CHAT_UPLOAD_MAX_SIZE", 100 * 1024 * 1024)
+
+    @staticmethod
+    def get_max_chunk_size():
+        return getattr(settings, "CHAT_UPLOAD_CHUNK_SIZE", 5 * 1024 * 1024)
+
+    @staticmethod
+    def get_session_ttl():
+        """Idle time after which an unfinished upload is purged."""
+        return timedelta(hours=getattr(settings, "CHAT_UPLOAD_SESSION_TTL_HOURS", 24))
+
+    @staticmethod
+    def determine_file_type(content_type, file_name):
+        """Classify an attachment by MIME type, falling back to its extension."""
+        content_type = content_type or ""
+        file_name = file_name.lower()
+
+        if content_type.startswith("image/"):
+            return "image"
+        if content_type.startswith("audio/"):
+            return "audio"
+        if content_type.startswith("video/"):
+            return "video"
+        if file_name.endswith(IMAGE_EXTENSIONS):
+            return "image"
+        if file_name.endswith(AUDIO_EXTENSIONS):
+            return "audio"
+        if file_name.endswith(VIDEO_EXTENSIONS):
+            return "video"
+        return "document"
+
+    @staticmethod
+    def roll_hash(rolling_hash, chunk):
+        """Fold a chunk into the rolling hash of the chunks before it."""
+        return hashlib.sha256(
+            bytes.fromhex(rolling_hash) + hashlib.sha256(chunk).digest()
+        ).hexdigest()
+
+    @staticmethod
+    def _part_prefix(session_id):
+        return f"chat_uploads/{session_id}"
+
+    @staticmethod
+    def _part_name(session_id, start):
+        return f"{UploadService._part_prefix(session_id)}/{start:012d}.part"
+
+    @staticmethod
+    def _part_names(session):
+        """
+        Names of the parts making up the file, following on from byte 0.
+
+        Other files under the prefix (e.g. a copy stored under another name
+        by a concurrent retry) are not part of the file.
+
+        Raises:
+            ValueError: If a part is missing or the parts overrun the file size
+        """
+        names = []
+        offset = 0
+        while offset < session.file_size:
+            name = UploadService._part_name(session.id, offset)
+            try:
+                size = default_storage.size(name)
+            except OSError:
+                size = 0
+            if not size:
+                raise ValueError(f"Upload part at byte {offset} is missing.")
+            names.append(name)
+            offset += size
+        if offset != session.file_size:
+            raise ValueError("Upload parts do not match the file size.")
+        return names
+
+    @staticmethod
+    def start(user, conversation, file_name, file_size, content_type=""):
+        """
+        Open an upload session.
+
+        Raises:
+            ValueError: If the name or size is not acceptable
+        """
+        file_name = os.path.basename(file_name or "")
+        if not file_name:
+            raise ValueError("A file name is required.")
+        if file_size <= 0:
+            raise ValueError("File size must be positive.")
+        max_size = UploadService.get_max_size()
+        if file_size > max_size:
+            raise ValueError(f"File exceeds maximum size of {max_size // (1024 * 1024)}MB.")
+
+        return UploadSession.objects.create(
+            user=user,
+            conversation=conversation,
+            file_name=file_name,
+            content_type=content_type or "",
+            file_size=file_size,
+        )
+
+    @staticmethod
+    def append_chunk(session, start, chunk, chunk_sha256=None):
+        """
+        Store a chunk that starts at byte ``start`` of the file.
+
+        A chunk that was already received is accepted again without effect,
+        so clients can safely retry.
+
+        Returns:
+            The number of bytes received so far
+
+        Raises:
+            UploadOffsetMismatch: If the chunk starts past the received bytes
+            ValueError: If the chunk is empty, too large or corrupted
+        """
+        if not chunk:
+            raise ValueError("Empty chunk.")
+        if len(chunk) > UploadService.get_max_chunk_size():
+            raise ValueError("Chunk exceeds the maximum chunk size.")
+        if start + len(chunk) > session.file_size:
+            raise ValueError("Chunk extends past the declared file size.")
+        if start < session.received_bytes:
+            return session.received_bytes
+        if start > session.received_bytes:
+            raise UploadOffsetMismatch(session.received_bytes)
+        if chunk_sha256 and hashlib.sha256(chunk).hexdigest() != chunk_sha256.lower():
+            raise ValueError("Chunk checksum mismatch.")
+
+        name = UploadService._part_name(session.id, start)
+        if default_storage.exists(name):
+            # Left over from an attempt that failed before it was recorded
+            default_storage.delete(name)
+        stored = default_storage.save(name, ContentFile(chunk))
+        if stored != name:
+            # A concurrent retry of this chunk stored it first
+            default_storage.delete(stored)
+
+        # Only the request that continues from the recorded offset advances it
+        rolling_hash = UploadService.roll_hash(session.rolling_hash, chunk)
+        advanced = UploadSession.objects.filter(
+            id=session.id, received_bytes=start
+        ).update(
+            received_bytes=F("received_bytes") + len(chunk),
+            rolling_hash=rolling_hash,
+            updated_at=timezone.now(),
+        )
+        session.refresh_from_db(fields=["received_bytes", "rolling_hash"])
+        if not advanced:
+            logger.info(f"Concurrent chunk at byte {start} of upload {session.id}")
+        return session.received_bytes
+
+    @staticmethod
+    def finalize(session, rolling_hash, content=""):
+        """
+        Assemble the uploaded file and create its message.
+
+        The file is assembled first; then the session row is locked and
+        deleted in the same transaction as the message is saved, so a
+        retried or concurrent call for the same upload finds it gone instead
+        of creating a second message.
+
+        Returns:
+            The saved Message object
+
+        Raises:
+            UploadSession.DoesNotExist: If the upload was already finalized
+            UploadOffsetMismatch: If bytes are still missing
+            ValueError: If the rolling hash or the assembled size does not match
+        """
+        if not UploadSession.objects.filter(id=session.id).exists():
+            raise UploadSession.DoesNotExist("Upload was already finalized.")
+        if session.received_bytes != session.file_size:
+            raise UploadOffsetMismatch(session.received_bytes)
+        if (rolling_hash or "").lower() != session.rolling_hash:
+            raise ValueError("Upload checksum mismatch.")
+
+        reader = _PartsReader(UploadService._part_names(session), session.file_size)
+        message = Message(
+            conversation=session.conversation,
+            sender=session.user,
+            content=content,
+            file_type=UploadService.determine_file_type(
+                session.content_type, session.file_name
+            ),
+            file_name=session.file_name,
+            file_size=session.file_size,
+        )
+        try:
+            # Streams part by part into a file named by message_file_path
+            message.file_attachment.save(session.file_name, File(reader), save=False)
+        finally:
+            reader.close()
+
+        try:
+            if message.file_attachment.size != session.file_size:
+                raise ValueError("Assembled file does not match the declared size.")
+            with transaction.atomic():
+                # Locked, and deleted below, for backends where the lock is a no-op
+                if not UploadSession.objects.select_for_update().filter(id=session.id).exists():
+                    raise UploadSession.DoesNotExist("Upload was already finalized.")
+                message.save()
+                Conversation.objects.filter(id=session.conversation_id).update(
+                    updated_at=timezone.now()
+                )
+                InboxService.messages_created([message])
+                deleted, _ = UploadSession.objects.filter(id=session.id).delete()
+                if not deleted:
+                    raise UploadSession.DoesNotExist("Upload was already finalized.")
+        except Exception:
+            message.file_attachment.delete(save=False)
+            raise
+
+        UploadService._delete_parts(session.id)
+        logger.info(f"Upload {session.id} finalized as message {message.id}")
+        return message
+
+    @staticmethod
+    def discard(session):
+        """Delete an upload session and its stored parts."""
+        UploadService._delete_parts(session.id)
+        session.delete()
+
+    @staticmethod
+    def _delete_parts(upload_id):
+        prefix = UploadService._part_prefix(upload_id)
+        try:
+            _, parts = default_storage.listdir(prefix)
+        except FileNotFoundError:
+            parts = []
+        for part in parts:
+            default_storage.delete(f"{prefix}/{part}")
+
+    @staticmethod
+    def purge_expired(now=None):
+        """
+        Discard uploads idle for longer than the session TTL.
+
+        Returns:
+            Number of sessions discarded
+        """
+        cutoff = (now or timezone.now()) - UploadService.get_session_ttl()
+        expired = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+        for session in expired:
+            UploadService.discard(session)
+        return len(expired)
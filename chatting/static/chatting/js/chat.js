@@ -14,6 +14,7 @@ const CONFIG = {
         MAX_RECONNECT_ATTEMPTS: 10,
         BASE_RECONNECT_DELAY: 1000, // 1 second
         MAX_RECONNECT_DELAY: 30000, // 30 seconds
+        HEARTBEAT_INTERVAL: 30000, // 30 seconds, keeps the presence key alive
     },
     // Message settings
     MESSAGE: {
@@ -48,6 +49,7 @@ const ChatState = {
     currentUserId: null,
     otherUserId: null,
     typingTimeout: null,
+    heartbeatTimer: null,
 
     // UI state
     isEmojiPickerOpen: false,
@@ -66,6 +68,7 @@ const ChatState = {
         this.currentUserId = null;
         this.otherUserId = null;
         this.typingTimeout = null;
+        this.heartbeatTimer = null;
         this.isEmojiPickerOpen = false;
         this.isSidebarOpen = false;
         this.eventListeners = {};
@@ -172,6 +175,9 @@ function setupWebSocketEventHandlers(socket, wsUrl) {
         // Send any pending messages
         sendPendingMessages();
 
+        // Keep our online status alive while the socket is open
+        startHeartbeat(socket);
+
         // Add manual reconnect button if it exists
         const reconnectButton = document.getElementById('manual-reconnect');
         if (reconnectButton) {
@@ -183,7 +189,13 @@ function setupWebSocketEventHandlers(socket, wsUrl) {
     socket.onmessage = function(event) {
         try {
             const data = JSON.parse(event.data);
-            handleWebSocketMessage(data);
+            // Low-priority events (typing, read receipts, status) arrive
+            // coalesced into one array frame
+            if (Array.isArray(data)) {
+                data.forEach(handleWebSocketMessage);
+            } else {
+                handleWebSocketMessage(data);
+            }
         } catch (error) {
             console.error('Error parsing WebSocket message:', error);
         }
@@ -199,6 +211,9 @@ function setupWebSocketEventHandlers(socket, wsUrl) {
         // Show disconnected status
         showConnectionStatus('disconnected');
 
+        // Stop heartbeats for the closed socket
+        stopHeartbeat();
+
         // Only attempt to reconnect if it wasn't a clean close and we haven't exceeded max attempts
         if (!wasClean && ChatState.reconnectAttempts < CONFIG.WS.MAX_RECONNECT_ATTEMPTS) {
             handleWebSocketReconnection(event);
@@ -221,6 +236,29 @@ function setupWebSocketEventHandlers(socket, wsUrl) {
     };
 }
 
+/**
+ * Periodically send a heartbeat so the server keeps us marked as online
+ * @param {WebSocket} socket - The WebSocket connection
+ */
+function startHeartbeat(socket) {
+    stopHeartbeat();
+    ChatState.heartbeatTimer = setInterval(function() {
+        if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'heartbeat' }));
+        }
+    }, CONFIG.WS.HEARTBEAT_INTERVAL);
+}
+
+/**
+ * Stop sending heartbeats
+ */
+function stopHeartbeat() {
+    if (ChatState.heartbeatTimer) {
+        clearInterval(ChatState.heartbeatTimer);
+        ChatState.heartbeatTimer = null;
+    }
+}
+
 /**
  * Handle WebSocket connection error
  */
@@ -672,6 +710,9 @@ function handleWebSocketMessage(data) {
             case 'user_status':
                 handleUserStatusUpdate(data);
                 break;
+            case 'pending_messages':
+                handlePendingMessages(data);
+                break;
             default:
                 console.log('Unknown message type:', messageType);
         }
@@ -708,6 +749,30 @@ function handleChatMessage(data) {
     }
 }
 
+/**
+ * Handle a chunk of messages that arrived while we were offline
+ * @param {Object} data - The chunk with messages, cursor and has_more
+ */
+function handlePendingMessages(data) {
+    (data.messages || []).forEach(function(item) {
+        const messageData = {
+            type: 'chat_message',
+            message: item.message,
+            conversation_id: item.conversation_id
+        };
+        handleChatMessage(messageData);
+        handleNewMessageNotification(messageData);
+    });
+
+    // Acknowledge the chunk so the server marks it delivered and sends the next one
+    if (ChatState.socket && ChatState.socket.readyState === WebSocket.OPEN) {
+        ChatState.socket.send(JSON.stringify({
+            type: 'sync_ack',
+            cursor: data.cursor
+        }));
+    }
+}
+
 /**
  * Play a notification sound for new messages
  */
@@ -920,14 +985,15 @@ function showTypingIndicator(typingIndicator) {
     // Set ARIA attributes for accessibility
     typingIndicator.setAttribute('aria-hidden', 'false');
 
-    // Auto-hide after 10 seconds in case we don't get the "stopped typing" event
+    // The server only sends start/stop edges and always follows a start with
+    // a stop, so this is just a safety net for a lost connection
     if (ChatState.typingIndicatorTimeout) {
         clearTimeout(ChatState.typingIndicatorTimeout);
     }
 
     ChatState.typingIndicatorTimeout = setTimeout(() => {
         hideTypingIndicator(typingIndicator);
-    }, 10000);
+    }, 30000);
 }
 
 /**
@@ -952,21 +1018,28 @@ function hideTypingIndicator(typingIndicator) {
 
 /**
  * Handle messages read updates
- * @param {Object} data - The read status data
+ * @param {Object} data - The read status data with the reader's watermark
  */
 function handleMessagesRead(data) {
     if (ChatState.currentConversationId && data.conversation_id === ChatState.currentConversationId) {
-        updateMessageReadStatus();
+        updateMessageReadStatus(data.last_read_message_id);
     }
 }
 
 /**
- * Update read status indicators for all outgoing messages
+ * Update read status indicators for outgoing messages up to a watermark
+ * @param {number} lastReadMessageId - Every message up to this ID has been read
  */
-function updateMessageReadStatus() {
+function updateMessageReadStatus(lastReadMessageId) {
     const messages = document.querySelectorAll('.message-item.outgoing');
 
     messages.forEach(function(messageElement) {
+        // Messages not yet confirmed by the server have no numeric ID
+        const messageId = parseInt(messageElement.dataset.messageId, 10);
+        if (isNaN(messageId) || messageId > lastReadMessageId) {
+            return;
+        }
+
         const statusElement = messageElement.querySelector('.message-status');
         if (statusElement) {
             // Update with read indicator icon
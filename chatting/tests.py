@@ -1,11 +1,42 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Conversation, Message
+from home.utils_codec import FrameCodec, MSGPACK
+from home.utils_ratelimit import chat_message_limiter
+
+from .consumers import ChatConsumer
+from .outbound import OutboundScheduler
+from .services.archive_service import ArchiveService
+from .services.delivery_service import DeliveryRetryService
+from .services.inbox_service import InboxService
+from .services.membership_service import MembershipService
+from .services.message_writer import MessageWriter
+from .services.presence_service import PresenceService
+from .services.read_service import ReadService
+from .services.search_service import SearchService
+from .services.sync_service import SyncService
+from .services.upload_service import UploadService
+from .models import ArchivedSegment, Conversation, InboxEntry, Message, ReadWatermark, UploadSession, UserStatus
 import os
+import shutil
+import tempfile
 
 User = get_user_model()
 
@@ -16,6 +47,7 @@ class ChatAPITests(TestCase):
         self.conversation = Conversation.objects.create()
         self.conversation.participants.add(self.user1, self.user2)
         self.client = APIClient()
+        chat_message_limiter.reset()
 
     def test_add_message_with_file_upload(self):
         """Ensure a user can send a message with a file attachment."""
@@ -95,6 +127,51 @@ class ChatAPITests(TestCase):
         self.assertEqual(Message.objects.count(), 0)
         self.assertIn('must have either content or a file attachment', response.data.get('error', ''))
 
+    @override_settings(CHAT_MESSAGE_RATE_LIMIT=2)
+    def test_add_message_is_rate_limited(self):
+        """The REST path draws from the same token bucket as the WebSocket."""
+        self.client.login(username='user1', password='password123')
+        url = reverse('chat_api:add_message', kwargs={'pk': self.conversation.id})
+
+        statuses = [
+            self.client.post(url, {'content': f'msg {i}'}, format='multipart').status_code
+            for i in range(3)
+        ]
+
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(chat_message_limiter.stats(), {'allowed': 2, 'denied': 1})
+
+    def test_message_list_cursor_pages_through_equal_timestamps(self):
+        """Every message is listed exactly once, newest first, without a COUNT."""
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.user2, content=f'msg {i}')
+            for i in range(25)
+        ])
+        Message.objects.update(timestamp=timezone.now())
+        InboxService.rebuild([self.conversation.id])
+        self.client.login(username='user1', password='password123')
+
+        url = reverse('chat_api:message_list', kwargs={'pk': self.conversation.id})
+        url += '?page_size=10'
+        pages = []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotIn('count', response.data)
+                pages.append([message['id'] for message in response.data['results']])
+                url = response.data['next']
+
+        ids = [message_id for page in pages for message_id in page]
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(ids, sorted(Message.objects.values_list('id', flat=True), reverse=True))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+        # The previous link of the last page returns the page before it
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual([message['id'] for message in previous.data['results']], pages[1])
+
     def tearDown(self):
         # Clean up created files from media directory
         # This is a simplified cleanup. For more robust cleanup, you might need to
@@ -110,3 +187,931 @@ class ChatAPITests(TestCase):
                          os.remove(message.file_attachment.path)
                 except Exception as e:
                     pass  # Silently ignore file deletion errors in tests
+
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_PRESENCE_FLUSH_INTERVAL=0)
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.stranger = User.objects.create_user(username='stranger', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+
+    async def connect_as(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_status_only_reaches_conversation_partners(self):
+        """Only users sharing a conversation are told about status changes."""
+        partner = await self.connect_as(self.user2)
+        stranger = await self.connect_as(self.stranger)
+
+        user1 = await self.connect_as(self.user1)
+        event = await partner.receive_json_from()
+        self.assertEqual(event["type"], "user_status")
+        self.assertEqual(event["user_id"], self.user1.id)
+        self.assertTrue(event["status"])
+        self.assertTrue(await stranger.receive_nothing())
+
+        await user1.disconnect()
+        event = await partner.receive_json_from()
+        self.assertFalse(event["status"])
+        self.assertIn("last_seen", event)
+        self.assertTrue(await stranger.receive_nothing())
+
+        status_row = await UserStatus.objects.aget(user=self.user1)
+        self.assertFalse(status_row.is_online)
+
+        await partner.disconnect()
+        await stranger.disconnect()
+
+    async def test_second_tab_is_not_a_status_change(self):
+        """A user with two open sockets stays online until both close."""
+        partner = await self.connect_as(self.user2)
+        first_tab = await self.connect_as(self.user1)
+        await partner.receive_json_from()
+
+        second_tab = await self.connect_as(self.user1)
+        self.assertTrue(await partner.receive_nothing())
+
+        await first_tab.disconnect()
+        self.assertTrue(await partner.receive_nothing())
+
+        await second_tab.disconnect()
+        event = await partner.receive_json_from()
+        self.assertFalse(event["status"])
+
+        await partner.disconnect()
+
+    def test_expired_presence_is_rebuilt_from_open_sockets(self):
+        """Every open socket is counted again after the presence key expired."""
+        first_online, first_epoch = PresenceService.connect(self.user1.id)
+        second_online, second_epoch = PresenceService.connect(self.user1.id)
+        self.assertEqual((first_online, second_online), (True, False))
+
+        # Both keys expire, e.g. during a long pause without heartbeats
+        cache.delete_many([PresenceService.presence_key(self.user1.id), PresenceService.epoch_key(self.user1.id)])
+        first_epoch = PresenceService.heartbeat(self.user1.id, first_epoch)
+        second_epoch = PresenceService.heartbeat(self.user1.id, second_epoch)
+        self.assertEqual(first_epoch, second_epoch)
+        self.assertEqual(cache.get(PresenceService.presence_key(self.user1.id)), 2)
+
+        self.assertFalse(PresenceService.disconnect(self.user1.id, first_epoch))
+        self.assertTrue(PresenceService.is_online(self.user1.id))
+        self.assertTrue(PresenceService.disconnect(self.user1.id, second_epoch))
+        self.assertFalse(PresenceService.is_online(self.user1.id))
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_PRESENCE_FLUSH_INTERVAL=0,
+    CHAT_LAZY_SUBSCRIBE_DAYS=7,
+)
+class LazySubscriptionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        Conversation.objects.filter(id=self.conversation.id).update(
+            updated_at=timezone.now() - timedelta(days=30)
+        )
+
+    async def test_inactive_conversation_is_joined_on_first_message(self):
+        """Messages in conversations skipped on connect still reach the socket."""
+        recipient = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        recipient.scope["user"] = self.user1
+        await recipient.connect()
+
+        sender = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        sender.scope["user"] = self.user2
+        await sender.connect()
+        await recipient.receive_json_from()  # user_status for user2
+
+        await sender.send_json_to({
+            "type": "chat_message",
+            "conversation_id": self.conversation.id,
+            "content": "Hello again",
+        })
+
+        received = [await recipient.receive_json_from() for _ in range(2)]
+        self.assertEqual(
+            [frame["type"] for frame in received],
+            ["chat_message", "new_message_notification"],
+        )
+        self.assertEqual(received[0]["message"]["content"], "Hello again")
+
+        await recipient.disconnect()
+        await sender.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_PRESENCE_FLUSH_INTERVAL=0,
+    CHAT_SYNC_CHUNK_SIZE=2,
+)
+class PendingMessageSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        for i in range(5):
+            Message.objects.create(
+                conversation=self.conversation, sender=self.user2, content=f"msg {i}"
+            )
+
+    async def test_pending_messages_stream_in_acked_chunks(self):
+        """The whole backlog is delivered chunk by chunk, each after an ack."""
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = self.user1
+        await communicator.connect()
+
+        received = []
+        has_more = True
+        while has_more:
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["type"], "pending_messages")
+            self.assertLessEqual(len(frame["messages"]), 2)
+            # Nothing more is sent until the chunk is acknowledged
+            self.assertTrue(await communicator.receive_nothing())
+            received.extend(item["message"]["content"] for item in frame["messages"])
+            has_more = frame["has_more"]
+            await communicator.send_json_to({"type": "sync_ack", "cursor": frame["cursor"]})
+
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(received, [f"msg {i}" for i in range(5)])
+        self.assertEqual(
+            await Message.objects.filter(delivery_status="pending").acount(), 0
+        )
+
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_PRESENCE_FLUSH_INTERVAL=0)
+class MembershipRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        chat_message_limiter.reset()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+
+    def test_send_path_makes_no_database_reads(self):
+        """Sending to a known conversation only writes the message."""
+        sent_queries = {}
+
+        async def scenario():
+            recipient = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+            recipient.scope["user"] = self.user2
+            await recipient.connect()
+
+            sender = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+            sender.scope["user"] = self.user1
+            await sender.connect()
+            await recipient.receive_json_from()  # user_status for user1
+
+            # The connection is thread-local; count on the thread running the queries
+            sent_queries["start"] = await sync_to_async(len)(queries)
+            await sender.send_json_to({
+                "type": "chat_message",
+                "conversation_id": self.conversation.id,
+                "content": "Hello",
+            })
+            frame = await recipient.receive_json_from()
+            sent_queries["end"] = await sync_to_async(len)(queries)
+
+            self.assertEqual(frame["message"]["delivery_status"], "delivered")
+            await recipient.disconnect()
+            await sender.disconnect()
+
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(scenario)()
+
+        statements = [
+            query["sql"].split()[0].upper()
+            for query in queries.captured_queries[sent_queries["start"]:sent_queries["end"]]
+        ]
+        self.assertNotIn("SELECT", statements)
+        self.assertEqual(statements.count("INSERT"), 1)
+        # Conversation.updated_at and the participants' inbox entries
+        self.assertEqual(statements.count("UPDATE"), 2)
+        self.assertEqual(
+            Message.objects.get(conversation=self.conversation).delivery_status,
+            "delivered",
+        )
+
+
+class MessageWriterTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+
+    @override_settings(CHAT_GROUP_COMMIT_MAX_DELAY_MS=60000, CHAT_GROUP_COMMIT_MAX_ROWS=3)
+    async def test_full_batch_is_committed_without_waiting(self):
+        """A batch reaching MAX_ROWS is written at once and acks every sender."""
+        messages = await asyncio.wait_for(
+            asyncio.gather(*(
+                MessageWriter.submit(
+                    MessageWriter.build_message(self.conversation.id, self.user1.id, f"msg {i}")
+                )
+                for i in range(3)
+            )),
+            timeout=5,
+        )
+
+        self.assertTrue(all(message.pk for message in messages))
+        self.assertEqual(
+            await Message.objects.filter(conversation=self.conversation).acount(), 3
+        )
+
+
+class ReadWatermarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.client = APIClient()
+
+    def test_marking_backlog_read_is_single_row_write(self):
+        """Reading 10k messages moves one watermark instead of updating each row."""
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.user2, content=f'msg {i}')
+            for i in range(10000)
+        ])
+        InboxService.rebuild([self.conversation.id])
+        first_id = Message.objects.order_by('id').values_list('id', flat=True).first()
+        ReadService.mark_read(self.conversation.id, self.user1.id, first_id)
+        self.assertEqual(ReadService.unread_messages(self.user1).count(), 9999)
+
+        # Newest message lookup, one conditional UPDATE of the watermark and
+        # one UPDATE of the reader's inbox entry
+        with self.assertNumQueries(3):
+            last_read_id, _ = ReadService.mark_read(self.conversation.id, self.user1.id)
+
+        self.assertEqual(last_read_id, Message.objects.latest('id').id)
+        self.assertEqual(ReadService.unread_messages(self.user1).count(), 0)
+        self.assertEqual(ReadWatermark.objects.count(), 1)
+        # Reading again changes nothing
+        self.assertIsNone(ReadService.mark_read(self.conversation.id, self.user1.id))
+
+    def test_read_state_is_derived_from_watermark(self):
+        """The sender sees messages as read once the recipient's watermark passes them."""
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'msg {i}')
+        InboxService.rebuild([self.conversation.id])
+        list_url = reverse('chat_api:message_list', kwargs={'pk': self.conversation.id})
+
+        self.client.login(username='user1', password='password123')
+        self.assertEqual(self.client.get(reverse('chat_api:unread_count')).data['unread_count'], 3)
+        self.client.get(list_url)
+        cache.clear()  # GET responses go through the site-wide cache middleware
+        self.assertEqual(self.client.get(reverse('chat_api:unread_count')).data['unread_count'], 0)
+
+        self.client.login(username='user2', password='password123')
+        results = self.client.get(list_url).data['results']
+        self.assertTrue(all(message['is_read'] for message in results))
+        self.assertEqual({message['delivery_status'] for message in results}, {'read'})
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        MembershipService.conversation_changed(self.conversation.id, [self.user1.id, self.user2.id])
+        self.client = APIClient()
+
+    def test_inbox_follows_sends_and_reads(self):
+        """Inbox entries carry the last message and unread count without scanning messages."""
+        MessageWriter.write([
+            MessageWriter.build_message(self.conversation.id, self.user2.id, f'msg {i}')
+            for i in range(3)
+        ])
+        MessageWriter.write([MessageWriter.build_message(self.conversation.id, self.user1.id, 'reply')])
+
+        entry = InboxEntry.objects.get(user=self.user1)
+        self.assertEqual(entry.other_user, self.user2)
+        self.assertEqual(entry.last_message_content, 'reply')
+        self.assertEqual(entry.unread_count, 3)
+        self.assertEqual(InboxEntry.objects.get(user=self.user2).unread_count, 1)
+
+        self.client.login(username='user1', password='password123')
+        with self.assertNumQueries(4):  # session, user, page count, inbox page
+            response = self.client.get(reverse('chat_api:conversation_list'))
+        data = response.data['results'] if 'results' in response.data else response.data
+        self.assertEqual(data[0]['id'], self.conversation.id)
+        self.assertEqual(data[0]['unread_count'], 3)
+        self.assertEqual(data[0]['last_message']['content'], 'reply')
+
+        ReadService.mark_read(self.conversation.id, self.user1.id)
+        self.assertEqual(InboxEntry.objects.get(user=self.user1).unread_count, 0)
+
+        # A rebuild from the source tables agrees with the incremental updates
+        InboxEntry.objects.update(unread_count=99, last_message_content='')
+        InboxService.rebuild()
+        self.assertEqual(InboxEntry.objects.get(user=self.user1).unread_count, 0)
+        self.assertEqual(InboxEntry.objects.get(user=self.user2).unread_count, 1)
+        self.assertEqual(InboxEntry.objects.get(user=self.user2).last_message_content, 'reply')
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_PRESENCE_FLUSH_INTERVAL=0,
+    CHAT_OUTBOUND_FLUSH_MS=100,
+    CHAT_TYPING_TIMEOUT=0.3,
+)
+class OutboundBatchingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+
+    async def connect_as(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_typing_is_debounced_to_edges(self):
+        """A burst of keystrokes is one start event, followed by a stop on timeout."""
+        partner = await self.connect_as(self.user2)
+        typist = await self.connect_as(self.user1)
+        await partner.receive_json_from()  # user_status for user1
+
+        for _ in range(20):
+            await typist.send_json_to({
+                "type": "typing", "conversation_id": self.conversation.id, "is_typing": True,
+            })
+        event = await partner.receive_json_from()
+        self.assertEqual(event["type"], "typing_indicator")
+        self.assertTrue(event["is_typing"])
+        self.assertTrue(await partner.receive_nothing(timeout=0.2))
+
+        # No further keystrokes: the server ends the typing state itself
+        event = await partner.receive_json_from()
+        self.assertFalse(event["is_typing"])
+        self.assertTrue(await partner.receive_nothing())
+
+        await typist.disconnect()
+        await partner.disconnect()
+
+    async def test_low_priority_events_share_one_frame(self):
+        """Events within a flush interval arrive as one array; urgent frames keep their order."""
+        partner = await self.connect_as(self.user2)
+        typist = await self.connect_as(self.user1)
+
+        await typist.send_json_to({
+            "type": "typing", "conversation_id": self.conversation.id, "is_typing": True,
+        })
+        frame = await partner.receive_json_from()
+        self.assertEqual([event["type"] for event in frame], ["user_status", "typing_indicator"])
+
+        await typist.send_json_to({
+            "type": "typing", "conversation_id": self.conversation.id, "is_typing": False,
+        })
+        await typist.send_json_to({
+            "type": "chat_message", "conversation_id": self.conversation.id, "content": "Hi",
+        })
+        # The queued stop edge is flushed ahead of the chat message
+        self.assertFalse((await partner.receive_json_from())["is_typing"])
+        self.assertEqual((await partner.receive_json_from())["type"], "chat_message")
+
+        await typist.disconnect()
+        await partner.disconnect()
+
+    async def test_full_queue_drops_stale_ephemeral_events(self):
+        """A slow socket keeps a bounded queue and loses typing events before read receipts."""
+        sent = []
+
+        async def send(payload):
+            sent.append(payload)
+
+        scheduler = OutboundScheduler(send, flush_interval=60, max_pending=2)
+        await scheduler.queue(("messages_read", 1, 2), {"type": "messages_read"}, ephemeral=False)
+        for user_id in range(10):
+            await scheduler.queue(("typing_indicator", 1, user_id), {"user_id": user_id})
+
+        self.assertEqual(len(scheduler.pending), 2)
+        self.assertEqual(scheduler.dropped, 9)
+        await scheduler.flush()
+        self.assertEqual(sent, [[{"type": "messages_read"}, {"user_id": 9}]])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_PRESENCE_FLUSH_INTERVAL=0)
+class FrameEncodingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+
+    async def connect_as(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_msgpack_is_negotiated_per_socket(self):
+        """A socket offering the msgpack subprotocol gets binary frames; JSON stays the default."""
+        codec = FrameCodec(MSGPACK)
+        binary = WebsocketCommunicator(
+            ChatConsumer.as_asgi(), "/ws/chat/", subprotocols=["msgpack"]
+        )
+        binary.scope["user"] = self.user2
+        connected, subprotocol = await binary.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "msgpack")
+        sender = await self.connect_as(self.user1)
+        self.assertEqual(codec.decode(bytes_data=await binary.receive_from())["type"], "user_status")
+
+        # Binary frames in, binary frames out; the JSON socket is unaffected
+        await binary.send_to(bytes_data=codec.encode({
+            "type": "chat_message", "conversation_id": self.conversation.id, "content": "Hi",
+        })["bytes_data"])
+        frame = codec.decode(bytes_data=await binary.receive_from())
+        self.assertEqual(frame["message"]["content"], "Hi")
+        self.assertEqual((await sender.receive_json_from())["message"]["content"], "Hi")
+
+        await binary.send_to(bytes_data=b"\xc1")
+        self.assertEqual(codec.decode(bytes_data=await binary.receive_from())["type"], "error")
+
+        await sender.disconnect()
+        await binary.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_PRESENCE_FLUSH_INTERVAL=0,
+    CHAT_DELIVERY_RETRY_BASE=30,
+    CHAT_DELIVERY_MAX_ATTEMPTS=3,
+    CHAT_DELIVERY_RETRY_BATCH_SIZE=2,
+    CHAT_DELIVERY_RETRY_MAX_BATCHES=2,
+)
+class DeliveryRetryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.sent_at = timezone.now()
+        self.message = Message.objects.create(
+            conversation=self.conversation, sender=self.user1, content='Hello'
+        )
+        Message.objects.filter(id=self.message.id).update(timestamp=self.sent_at)
+
+    def test_backoff_for_offline_recipient_keeps_message_pending(self):
+        """Checks are spaced out exponentially, up to MAX_ATTEMPTS doublings."""
+        # Not due before the first backoff has passed
+        self.assertEqual(DeliveryRetryService.run_pass(self.sent_at + timedelta(seconds=10)), {})
+
+        attempt_at = self.sent_at + timedelta(seconds=30)
+        self.assertEqual(DeliveryRetryService.run_pass(attempt_at)['retried'], 1)
+        # The second attempt waits twice as long
+        self.assertFalse(DeliveryRetryService.run_pass(attempt_at + timedelta(seconds=59)))
+        for delay in (60, 120, 240, 240):
+            attempt_at += timedelta(seconds=delay)
+            self.assertEqual(DeliveryRetryService.run_pass(attempt_at), {'retried': 1})
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.delivery_status, 'pending')
+        self.assertEqual(self.message.delivery_attempts, 5)
+
+    async def test_reconnect_after_retries_streams_message(self):
+        """A recipient offline through every retry still gets the message on reconnect."""
+        attempt_at = self.sent_at
+        for _ in range(5):
+            attempt_at += timedelta(hours=1)
+            await database_sync_to_async(DeliveryRetryService.run_pass)(attempt_at)
+
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = self.user2
+        await communicator.connect()
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "pending_messages")
+        self.assertEqual([item["message"]["id"] for item in frame["messages"]], [self.message.id])
+        await communicator.send_json_to({"type": "sync_ack", "cursor": frame["cursor"]})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        await self.message.arefresh_from_db()
+        self.assertEqual(self.message.delivery_status, 'delivered')
+
+    def test_online_recipient_is_delivered_in_bounded_batches(self):
+        """A pass handles at most MAX_BATCHES * BATCH_SIZE messages and resumes after them."""
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.user1, content=f'msg {i}')
+            for i in range(5)
+        ])
+        Message.objects.update(timestamp=self.sent_at)
+        PresenceService.connect(self.user2.id)
+        due_at = self.sent_at + timedelta(seconds=30)
+
+        self.assertEqual(DeliveryRetryService.run_pass(due_at)['delivered'], 4)
+        self.assertEqual(Message.objects.filter(delivery_status='pending').count(), 2)
+        self.assertEqual(DeliveryRetryService.run_pass(due_at)['delivered'], 2)
+        self.assertFalse(Message.objects.filter(delivery_status='pending').exists())
+
+
+@override_settings(CHAT_DELTA_SYNC_LIMIT=3)
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.stranger = User.objects.create_user(username='stranger', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.other = Conversation.objects.create()
+        self.other.participants.add(self.user2, self.stranger)
+        self.seen = [
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'seen {i}')
+            for i in range(3)
+        ]
+        self.client = APIClient()
+
+    def test_only_missed_messages_edits_and_deletes_are_returned(self):
+        """A reconnecting client gets what happened after its mark, in a fixed number of queries."""
+        mark = self.seen[-1].id
+        self.seen[0].edit_message('edited')
+        self.seen[1].delete_message()
+        new = [
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'new {i}')
+            for i in range(4)
+        ]
+        Message.objects.create(conversation=self.other, sender=self.stranger, content='not yours')
+
+        with self.assertNumQueries(4):
+            delta = SyncService.delta(self.user1.id, {self.conversation.id: mark, self.other.id: 0})
+
+        self.assertEqual(list(delta), [self.conversation.id])
+        entry = delta[self.conversation.id]
+        self.assertEqual([message['id'] for message in entry['messages']], [m.id for m in new[:3]])
+        self.assertTrue(entry['has_more'])
+        self.assertEqual(entry['mark'], new[2].id)
+        self.assertEqual(
+            [(change['id'], change['content'], change['is_deleted']) for change in entry['changes']],
+            [(self.seen[0].id, 'edited', False), (self.seen[1].id, '', True)],
+        )
+
+        # Syncing again from the new mark returns the rest and nothing twice
+        self.client.login(username='user1', password='password123')
+        response = self.client.post(
+            reverse('chat_api:sync'), {'marks': {str(self.conversation.id): entry['mark']}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = response.data['conversations'][self.conversation.id]
+        self.assertEqual([message['id'] for message in entry['messages']], [new[3].id])
+        self.assertFalse(entry['has_more'])
+
+        response = self.client.post(reverse('chat_api:sync'), {'marks': ['bad']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DirectConversationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.client = APIClient()
+
+    def test_start_conversation_reuses_the_pair(self):
+        """Both directions of a pair resolve to one conversation via the unique key."""
+        self.client.login(username='user1', password='password123')
+        url = reverse('chat_api:start_conversation')
+        first = self.client.post(url, {'user_id': self.user2.id}, format='json').data['id']
+
+        self.client.login(username='user2', password='password123')
+        second = self.client.post(url, {'user_id': self.user1.id}, format='json').data['id']
+
+        self.assertEqual(first, second)
+        conversation = Conversation.objects.get()
+        self.assertEqual(
+            (conversation.pair_min_user_id, conversation.pair_max_user_id),
+            (self.user1.id, self.user2.id),
+        )
+
+    def test_merge_command_collapses_duplicates(self):
+        """Duplicates of a pair are merged into the oldest conversation."""
+        conversations = []
+        for i in range(3):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user1, self.user2)
+            Message.objects.create(conversation=conversation, sender=self.user2, content=f'msg {i}')
+            conversations.append(conversation)
+        last_id = Message.objects.latest('id').id
+        ReadService.mark_read(conversations[2].id, self.user1.id, last_id)
+
+        call_command('merge_duplicate_conversations', batch_size=2, stdout=open(os.devnull, 'w'))
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.id, conversations[0].id)
+        self.assertEqual(conversation.pair_min_user_id, self.user1.id)
+        self.assertEqual(conversation.messages.count(), 3)
+        self.assertEqual(ReadService.get_read_positions(conversation.id), {self.user1.id: last_id})
+        self.assertEqual(InboxEntry.objects.get(user=self.user1).unread_count, 0)
+        self.assertEqual(InboxEntry.objects.get(user=self.user2).unread_count, 0)
+        self.assertEqual(
+            MembershipService.get_or_create_direct_conversation(self.user2.id, self.user1.id),
+            (conversation, False),
+        )
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.stranger = User.objects.create_user(username='stranger', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.other = Conversation.objects.create()
+        self.other.participants.add(self.user2, self.stranger)
+        self.client = APIClient()
+        self.client.login(username='user1', password='password123')
+
+    def search(self, **params):
+        cache.clear()
+        return self.client.get(reverse('chat_api:message_search'), params)
+
+    def test_search_is_scoped_to_the_users_conversations(self):
+        mine = Message.objects.create(conversation=self.conversation, sender=self.user2, content='Thesis draft is ready')
+        Message.objects.create(conversation=self.other, sender=self.user2, content='Thesis draft for someone else')
+
+        response = self.search(q='thesis dra')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([hit['id'] for hit in response.data['results']], [mine.id])
+        self.assertEqual(self.search(q='  !!').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_member_of_many_conversations_searches_through_a_join(self):
+        expected = []
+        for i in range(60):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user1, self.user2)
+            expected.append(Message.objects.create(conversation=conversation, sender=self.user2, content=f'budget review {i}').id)
+        Message.objects.create(conversation=self.other, sender=self.user2, content='budget review elsewhere')
+
+        hits = SearchService.search(self.user1.id, ['budget', 'rev'])
+        self.assertEqual(sorted(hit[0] for hit in hits), expected)
+        with override_settings(MESSAGE_SEARCH_MAX_MATCH_CONVERSATIONS=1000):
+            self.assertEqual(SearchService.search(self.user1.id, ['budget', 'rev']), hits)
+
+    def test_edits_and_deletes_update_the_index(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.user1, content='meet at the library')
+        message.edit_message('meet at the cafeteria')
+        self.assertEqual(SearchService.search(self.user1.id, ['library']), [])
+        self.assertEqual([hit[0] for hit in SearchService.search(self.user1.id, ['cafeteria'])], [message.id])
+
+        message.delete_message()
+        self.assertEqual(SearchService.search(self.user1.id, ['cafeteria']), [])
+
+    def test_results_are_ranked_and_paged_by_cursor(self):
+        best = Message.objects.create(conversation=self.conversation, sender=self.user2, content='exam exam exam')
+        rest = [
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'exam on day {i} of the long exam week schedule')
+            for i in range(4)
+        ]
+
+        seen = []
+        url, params = reverse('chat_api:message_search'), {'q': 'exam', 'page_size': 2}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(hit['id'] for hit in response.data['results'])
+            url, params = response.data['next'], None
+            # Later pages come from the first page's ranking, whatever changed since
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content='exam exam exam exam')
+
+        self.assertEqual(seen[0], best.id)
+        self.assertEqual(seen, list(dict.fromkeys(seen)))
+        self.assertEqual(sorted(seen), sorted([best.id] + [m.id for m in rest]))
+        self.assertEqual(self.search(q='exam', cursor='garbage').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_cursor_is_not_found(self):
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'exam {i}')
+        next_url = self.search(q='exam', page_size=2).data['next']
+        self.assertIsNotNone(next_url)
+
+        cache.clear()
+        self.assertEqual(self.client.get(next_url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root, CHAT_ARCHIVE_SEGMENT_SIZE=4)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.user2, content=f'msg {i}')
+            for i in range(12)
+        ]
+        # The first ten are a year and a half old
+        old = timezone.now() - timedelta(days=540)
+        for i, message in enumerate(self.messages[:10]):
+            Message.objects.filter(id=message.id).update(timestamp=old + timedelta(minutes=i))
+
+    def test_command_archives_old_messages_into_segments(self):
+        out = StringIO()
+        call_command('archive_messages', '--max-segments', '2', stdout=out)
+        self.assertIn('Archived 8 messages into 2 segments', out.getvalue())
+        self.assertIn('message data compressed from', out.getvalue())
+        self.assertEqual(Message.objects.count(), 4)
+
+        call_command('archive_messages', stdout=StringIO())
+        segments = list(ArchivedSegment.objects.filter(conversation=self.conversation))
+        self.assertEqual([segment.message_count for segment in segments], [4, 4, 2])
+        self.assertTrue(all(segment.compressed_bytes < segment.raw_bytes for segment in segments[:2]))
+        self.assertEqual(
+            list(Message.objects.values_list('id', flat=True)), [m.id for m in self.messages[10:]]
+        )
+
+        rows = ArchiveService.load_segment(segments[0])
+        self.assertEqual([row['content'] for row in rows], ['msg 0', 'msg 1', 'msg 2', 'msg 3'])
+
+    def test_message_list_pages_from_hot_into_archived_history(self):
+        call_command('archive_messages', stdout=StringIO())
+        self.client.login(username='user1', password='password123')
+
+        url = reverse('chat_api:message_list', kwargs={'pk': self.conversation.id}) + '?page_size=10'
+        pages = []
+        while url:
+            cache.clear()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            url = response.data['next']
+
+        ids = [message['id'] for page in pages for message in page['results']]
+        self.assertEqual(ids, [m.id for m in reversed(self.messages)])
+        self.assertEqual(pages[0]['results'][-1]['sender_name'], 'user2')
+
+        # Paging forward from the oldest page crosses back into hot rows
+        cache.clear()
+        previous = self.client.get(pages[-1]['previous'])
+        self.assertEqual(
+            [message['id'] for message in previous.data['results']],
+            [m.id for m in reversed(self.messages[2:12])],
+        )
+
+    def test_conversation_page_includes_archived_history(self):
+        call_command('archive_messages', stdout=StringIO())
+        self.client.login(username='user1', password='password123')
+
+        cache.clear()
+        response = self.client.get(
+            reverse('chatting:conversation_detail', kwargs={'conversation_id': self.conversation.id})
+        )
+        self.assertEqual(response.status_code, 200)
+        page = response.context['messages']
+        self.assertEqual(page.paginator.count, 12)
+        self.assertEqual([m.id for m in page], [m.id for m in self.messages])
+        self.assertContains(response, 'msg 0')
+
+        history = ArchiveService.history(self.conversation.id, self.conversation.messages.order_by('timestamp'))
+        self.assertEqual([m.id for m in history[3:11]], [m.id for m in self.messages[3:11]])
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root, CHAT_UPLOAD_CHUNK_SIZE=1024)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user1 = User.objects.create_user(username='user1', password='password123')
+        self.user2 = User.objects.create_user(username='user2', password='password123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.client = APIClient()
+        InboxService.rebuild([self.conversation.id])
+        self.client.login(username='user1', password='password123')
+        self.data = bytes(range(256)) * 10  # 2560 bytes, three chunks
+
+    def put_chunk(self, upload_id, start, end):
+        return self.client.put(
+            reverse('chat_api:upload_chunk', kwargs={'upload_id': upload_id}),
+            self.data[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.data)}',
+        )
+
+    def test_resumable_upload_creates_message_at_finalize(self):
+        response = self.client.post(
+            reverse('chat_api:start_upload', kwargs={'pk': self.conversation.id}),
+            {'file_name': 'notes.pdf', 'file_size': len(self.data), 'content_type': 'application/pdf'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data['upload_id']
+
+        # Chunks must follow on from what was received
+        self.assertEqual(self.put_chunk(upload_id, 1024, 2048).status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.put_chunk(upload_id, 0, 1024).data['received_bytes'], 1024)
+        # A retried chunk is accepted without effect
+        self.assertEqual(self.put_chunk(upload_id, 0, 1024).data['received_bytes'], 1024)
+
+        # A reconnecting client asks where to resume
+        cache.clear()
+        status_response = self.client.get(reverse('chat_api:upload_chunk', kwargs={'upload_id': upload_id}))
+        self.assertEqual(status_response.data['received_bytes'], 1024)
+        self.put_chunk(upload_id, 1024, 2048)
+        self.assertFalse(Message.objects.exists())
+
+        finalize_url = reverse('chat_api:finalize_upload', kwargs={'upload_id': upload_id})
+        self.assertEqual(self.client.post(finalize_url, {}, format='json').status_code, status.HTTP_409_CONFLICT)
+        self.put_chunk(upload_id, 2048, len(self.data))
+
+        rolling_hash = ''
+        for start in range(0, len(self.data), 1024):
+            rolling_hash = UploadService.roll_hash(rolling_hash, self.data[start:start + 1024])
+        bad = self.client.post(finalize_url, {'sha256': '0' * 64}, format='json')
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(finalize_url, {'sha256': rolling_hash, 'content': 'my notes'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        message = Message.objects.get()
+        self.assertEqual((message.content, message.file_type, message.file_size), ('my notes', 'document', len(self.data)))
+        self.assertTrue(message.file_attachment.name.startswith(f'chat_files/conversation_{self.conversation.id}/'))
+        with message.file_attachment.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(InboxEntry.objects.get(user=self.user2).unread_count, 1)
+
+    def test_only_expected_parts_are_assembled(self):
+        session = UploadService.start(self.user1, self.conversation, 'a.bin', len(self.data))
+        rolling_hash = ''
+        for start in range(0, len(self.data), 1024):
+            self.put_chunk(session.id, start, min(start + 1024, len(self.data)))
+            rolling_hash = UploadService.roll_hash(rolling_hash, self.data[start:start + 1024])
+        # A second copy of the first chunk, as a concurrent retry could leave
+        default_storage.save(UploadService._part_name(session.id, 0), ContentFile(self.data[:1024]))
+        session.refresh_from_db()
+
+        message = UploadService.finalize(session, rolling_hash)
+        with message.file_attachment.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_finalize_creates_one_message_when_repeated(self):
+        session = UploadService.start(self.user1, self.conversation, 'a.bin', len(self.data))
+        rolling_hash = ''
+        for start in range(0, len(self.data), 1024):
+            self.put_chunk(session.id, start, min(start + 1024, len(self.data)))
+            rolling_hash = UploadService.roll_hash(rolling_hash, self.data[start:start + 1024])
+        session.refresh_from_db()
+
+        UploadService.finalize(session, rolling_hash)
+        # A retry holding the same session, e.g. after a lost response
+        with self.assertRaises(UploadSession.DoesNotExist):
+            UploadService.finalize(session, rolling_hash)
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'chat_files', f'conversation_{self.conversation.id}'))), 1)
+
+    def test_oversized_and_corrupted_chunks_are_rejected(self):
+        session = UploadService.start(self.user1, self.conversation, 'a.bin', len(self.data))
+        self.assertEqual(self.put_chunk(session.id, 0, 1025).status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.put(
+            reverse('chat_api:upload_chunk', kwargs={'upload_id': session.id}),
+            self.data[:1024],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-1023/{len(self.data)}',
+            HTTP_X_CHUNK_SHA256='0' * 64,
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        session.refresh_from_db()
+        self.assertEqual(session.received_bytes, 0)
+
@@ -1,11 +1,13 @@
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import render, redirect, get_object_or_404
 
-from .models import Conversation
+from .models import Conversation, InboxEntry
+from .services.archive_service import ArchiveService
+from .services.membership_service import MembershipService
+from .services.read_service import ReadService
 
 User = get_user_model()
 
@@ -15,56 +17,15 @@ def chat_home(request):
     """
     Main chat page showing a list of all conversations.
 
-    Uses annotations to efficiently get unread message counts in a single query
-    instead of querying the database for each conversation.
+    Reads the user's materialized inbox (other participant, last message
+    snapshot and unread count per conversation) with a single indexed query,
+    so the cost does not grow with the message history.
     """
-    from django.db.models import Q, Count, OuterRef, Subquery
-    from django.core.cache import cache
-    from .models import Message
-
-    # Try to get from cache first
-    # cache_key = f"chat_home_{request.user.id}"
-    cached_data = cache.get(f"chat_home_{request.user.id}")
-
-    if cached_data is None:
-        # Get latest messages as a subquery instead of using Window function
-        latest_messages = (
-            Message.objects.filter(conversation=OuterRef("pk"))
-            .order_by("-timestamp")
-            .values("content")[:1]
-        )
-
-        # Get all conversations with unread counts in a single query
-        conversations = (
-            Conversation.objects.filter(participants=request.user)
-            .annotate(
-                unread_count=Count(
-                    "messages",
-                    filter=Q(messages__is_read=False)
-                    & ~Q(messages__sender=request.user)
-                    & Q(messages__sender__isnull=False),
-                ),
-                # Add the latest message using a subquery instead of Window function
-                latest_message_content=Subquery(latest_messages),
-            )
-            .prefetch_related("participants", "participants__chat_status")
-            .select_related(
-                # Select anything else needed for rendering
-            )
-            .order_by("-updated_at")
-        )
-
-        # Get the other participant for each conversation
-        for conversation in conversations:
-            conversation.other_user = conversation.get_other_participant(request.user)
-
-        # Don't cache the queryset directly, it causes serialization issues
-        # We won't cache for now
-    else:
-        conversations = cached_data
-        # Get the other participant for each conversation
-        for conversation in conversations:
-            conversation.other_user = conversation.get_other_participant(request.user)
+    inbox = (
+        InboxEntry.objects.filter(user=request.user)
+        .select_related("other_user__chat_status")
+        .order_by("-updated_at")
+    )
 
     # Get users who are online
     online_users = User.objects.filter(chat_status__is_online=True).exclude(
@@ -72,7 +33,7 @@ def chat_home(request):
     )
 
     context = {
-        "conversations": conversations,
+        "inbox": inbox,
         "online_users": online_users,
         "active_page": "chat",
     }
@@ -86,9 +47,11 @@ def conversation_detail(request, conversation_id):
     View for displaying a specific conversation.
 
     Implements pagination for messages and optimized queries for better
-    performance with long conversation histories.
+    performance with long conversation histories. Pages run through the
+    archived history before the messages still in the message table.
     """
     from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+    from django.core.cache import cache
 
     # Create a cache key based on conversation ID and last message timestamp
     cache_key = f"conversation_detail_{conversation_id}_{request.user.id}"
@@ -115,23 +78,13 @@ def conversation_detail(request, conversation_id):
         .order_by("timestamp")
     )
 
-    # Mark all unread messages as read in a single bulk update for better performance
-    with transaction.atomic():
-        unread_messages = messages_query.filter(is_read=False).exclude(
-            sender=request.user
-        )
-        unread_count = unread_messages.count()
-
-        # Use bulk update for better performance
-        if unread_count > 0:
-            # Update all messages in one query
-            unread_messages.update(is_read=True, delivery_status="read")
+    # Mark the conversation as read by moving the user's watermark
+    if ReadService.mark_read(conversation.id, request.user.id):
+        # Clear any cached message counts
+        cache.delete(f"unread_messages_{request.user.id}")
 
-            # Clear any cached message counts
-            cache.delete(f"unread_messages_{request.user.id}")
-
-    # Paginate results - 50 messages per page
-    paginator = Paginator(messages_query, 50)
+    # Paginate results - 50 messages per page; archived history comes first
+    paginator = Paginator(ArchiveService.history(conversation.id, messages_query), 50)
 
     try:
         messages_page = paginator.page(page)
@@ -145,12 +98,16 @@ def conversation_detail(request, conversation_id):
     # Get the other participant in the conversation
     other_user = conversation.get_other_participant(request.user)
 
+    # Own messages up to this ID have been read by the other participant
+    read_positions = ReadService.get_read_positions(conversation.id)
+    read_watermark = read_positions.get(other_user.id, 0) if other_user else 0
+
     context = {
         "conversation": conversation,
         "messages": messages_page,
         "other_user": other_user,
         "active_page": "chat",
-        "unread_count": unread_count,  # Could be useful for notifications
+        "read_watermark": read_watermark,
     }
 
     return render(request, "chatting/conversation_detail.html", context)
@@ -169,19 +126,11 @@ def start_conversation(request, user_id):
         messages.error(request, "You cannot start a conversation with yourself.")
         return redirect("chatting:chat_home")
 
-    # Check if a conversation already exists between these users
-    conversation = (
-        Conversation.objects.filter(participants=request.user)
-        .filter(participants=other_user)
-        .first()
+    # Reuse the existing conversation between these users or create one
+    conversation, _ = MembershipService.get_or_create_direct_conversation(
+        request.user.id, other_user.id
     )
 
-    # If no conversation exists, create a new one
-    if conversation is None:
-        conversation = Conversation.objects.create()
-        conversation.participants.add(request.user, other_user)
-        conversation.save()
-
     # Redirect to the conversation detail page
     return redirect("chatting:conversation_detail", conversation_id=conversation.id)
 
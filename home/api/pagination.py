@@ -0,0 +1,239 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Base of keyset pagination on (``ordering_field``, id), newest first.
+
+    Each page is a range scan of an index ending in (ordering_field, id),
+    bounded by the cursor, so page cost does not grow with the table and no
+    COUNT query is issued. The id tie-breaker keeps rows that share a value
+    from being skipped or repeated across pages.
+
+    ``next`` links page back to older rows (``backward_direction``) and
+    ``previous`` links forward to newer ones (``forward_direction``), which
+    come oldest first when there is more than a page of them. The opaque
+    ``cursor`` query parameter holds the direction and position; the
+    ``<direction>_id`` parameters start from a row's position instead.
+    """
+
+    ordering_field = None
+    backward_direction = "before"
+    forward_direction = "after"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 20
+    min_page_size = 1
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+    # 404 message for an unknown <direction>_id; None ignores the parameter
+    not_found_message = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            cursor = self.get_id_cursor(request, queryset)
+        direction, page = self.get_page_queryset(queryset, cursor)
+
+        # Fetch one extra row to find out if there is another page
+        results = list(page[: self.page_size + 1])
+        results = self.extend_results(view, direction, cursor, results)
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        if direction == self.backward_direction:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        else:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        self.has_more = has_more
+        self.cursor = cursor
+        self.results = results
+        return results
+
+    def get_page_queryset(self, queryset, cursor):
+        """
+        Order and bound the queryset by the cursor.
+
+        Returns:
+            (direction, queryset) tuple
+        """
+        field = self.ordering_field
+        if cursor is None:
+            return self.backward_direction, queryset.order_by(f"-{field}", "-id")
+
+        direction, value, object_id = cursor
+        if direction == self.backward_direction:
+            # The redundant bound on the field alone lets the database seek
+            # the index; the OR only breaks ties on the boundary
+            page = queryset.filter(
+                Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": object_id}),
+                **{f"{field}__lte": value},
+            ).order_by(f"-{field}", "-id")
+        else:
+            page = queryset.filter(
+                Q(**{f"{field}__gt": value}) | Q(**{field: value, "id__gt": object_id}),
+                **{f"{field}__gte": value},
+            ).order_by(field, "id")
+        return direction, page
+
+    def extend_results(self, view, direction, cursor, results):
+        """Hook to add rows from outside the queryset to a page."""
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError, TypeError):
+            return self.page_size
+        # Limit page size to prevent performance issues
+        return min(max(self.min_page_size, page_size), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """
+        Decode the cursor query parameter.
+
+        Returns:
+            (direction, value, id) tuple, or None without a cursor
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            direction = data["d"]
+            value = parse_datetime(data["t"])
+            object_id = int(data["i"])
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if direction not in (self.backward_direction, self.forward_direction) or value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return direction, value, object_id
+
+    def encode_cursor(self, direction, value, object_id):
+        data = {"d": direction, "t": value.isoformat(), "i": object_id}
+        return base64.urlsafe_b64encode(
+            json.dumps(data, separators=(",", ":")).encode("ascii")
+        ).decode("ascii")
+
+    def get_id_query_params(self):
+        return [f"{direction}_id" for direction in (self.forward_direction, self.backward_direction)]
+
+    def get_id_cursor(self, request, queryset):
+        """Turn a <direction>_id parameter into a cursor at that row's position."""
+        for direction in (self.forward_direction, self.backward_direction):
+            object_id = request.query_params.get(f"{direction}_id")
+            if not object_id:
+                continue
+            try:
+                value = (
+                    queryset.filter(id=object_id)
+                    .values_list(self.ordering_field, flat=True)
+                    .first()
+                )
+            except (ValueError, TypeError):
+                value = None
+            if value is None:
+                if self.not_found_message is None:
+                    return None
+                raise NotFound(self.not_found_message)
+            return direction, value, int(object_id)
+        return None
+
+    def get_position(self, obj):
+        return getattr(obj, self.ordering_field), obj.id
+
+    def get_link(self, direction, value, object_id):
+        url = self.request.build_absolute_uri()
+        for param in self.get_id_query_params():
+            url = remove_query_param(url, param)
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            self.encode_cursor(direction, value, object_id),
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.results:
+            return None
+        return self.get_link(self.backward_direction, *self.get_position(self.results[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.results:
+            return None
+        return self.get_link(self.forward_direction, *self.get_position(self.results[0]))
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class NotificationCursorPagination(KeysetPagination):
+    """
+    Keyset pagination of notifications on (created_at, id), newest first.
+
+    Pages are range scans of the (recipient, created_at, id) index, with no
+    COUNT query. ``until_id`` (or a ``next`` link) pages back for infinite
+    scroll; ``since_id`` (or a ``previous`` link) returns what is newer,
+    oldest first when there is more than a page of it, for incremental
+    polling. Coalesced notifications move forward when they absorb new
+    activity, so they show up again in the next poll.
+
+    ``previous`` stays set once there is a position, even when nothing is
+    newer, so a client can keep polling from it; it is more precise than
+    ``since_id``, whose notification may itself have moved since.
+    """
+
+    ordering_field = "created_at"
+    backward_direction = "until"
+    forward_direction = "since"
+    not_found_message = "Notification not found"
+
+    def get_previous_link(self):
+        if self.results:
+            return self.get_link(self.forward_direction, *self.get_position(self.results[0]))
+        if self.cursor is not None and self.cursor[0] == self.forward_direction:
+            # Nothing newer yet: poll again from the same position
+            return self.get_link(*self.cursor)
+        return None
+
+    def get_etag(self):
+        """Validator of the page, changing whenever an entry on it changes."""
+        state = [
+            (n.id, n.created_at.isoformat(), n.is_read, n.actor_count) for n in self.results
+        ]
+        digest = hashlib.sha1(json.dumps([state, self.has_more]).encode("ascii"))
+        return f'W/"{digest.hexdigest()[:20]}"'
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from home.models import Post, Comment, Like, Notification
+from home.services.image_variant_service import ImageVariantService
 from authentication.models import CustomUser
-from home.utils import extract_mentions, format_content_with_mentions
 
 
 class UserMiniSerializer(serializers.ModelSerializer):
@@ -16,17 +16,12 @@ class CommentSerializer(serializers.ModelSerializer):
     """Serializer for the Comment model."""
     
     user = UserMiniSerializer(read_only=True)
-    formatted_content = serializers.SerializerMethodField()
     
     class Meta:
         model = Comment
         fields = ('id', 'user', 'post', 'content', 'formatted_content', 'created_at')
         read_only_fields = ('id', 'user', 'created_at', 'formatted_content')
     
-    def get_formatted_content(self, obj):
-        """Return content with formatted mentions."""
-        return format_content_with_mentions(obj.content)
-    
     def create(self, validated_data):
         """Create a new comment and process mentions."""
         # Get the user from the context
@@ -57,16 +52,23 @@ class PostSerializer(serializers.ModelSerializer):
     comments_count = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
-    formatted_content = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Post
-        fields = ('id', 'user', 'content', 'formatted_content', 'image', 'video', 
-                  'document', 'created_at', 'updated_at', 'comments_count', 
+        fields = ('id', 'user', 'content', 'formatted_content', 'image', 'image_variants',
+                  'video', 'document', 'created_at', 'updated_at', 'comments_count',
                   'likes_count', 'is_liked')
         read_only_fields = ('id', 'user', 'created_at', 'updated_at', 
                            'comments_count', 'likes_count', 'is_liked', 
-                           'formatted_content')
+                           'formatted_content', 'image_variants')
+    
+    def get_image_variants(self, obj):
+        """Return resized image URLs; the original until they are generated."""
+        return ImageVariantService.for_serializer(
+            self, obj.image.name if obj.image else None,
+            lambda post: post.image.name if post.image else None
+        )
     
     def get_comments_count(self, obj):
         """Return the number of comments for the post."""
@@ -83,10 +85,6 @@ class PostSerializer(serializers.ModelSerializer):
             return obj.likes.filter(user=user).exists()
         return False
     
-    def get_formatted_content(self, obj):
-        """Return content with formatted mentions."""
-        return format_content_with_mentions(obj.content)
-    
     def create(self, validated_data):
         """Create a new post and process mentions."""
         # Get the user from the context
@@ -117,9 +115,23 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ('id', 'recipient', 'sender', 'notification_type', 
-                  'text', 'is_read', 'created_at', 'post', 'comment')
+                  'text', 'is_read', 'created_at', 'post', 'comment',
+                  'actor_count', 'sample_actors')
         read_only_fields = ('id', 'recipient', 'sender', 'notification_type', 
-                           'text', 'created_at', 'post', 'comment')
+                           'text', 'created_at', 'post', 'comment',
+                           'actor_count', 'sample_actors')
+
+
+class NotificationFeedSerializer(serializers.ModelSerializer):
+    """Flat notification data for the feed, shaped like the socket payload."""
+
+    sender = serializers.CharField(source='sender.username', read_only=True, allow_null=True)
+
+    class Meta:
+        model = Notification
+        fields = ('id', 'sender', 'sender_id', 'notification_type', 'text', 'is_read',
+                  'created_at', 'post_id', 'comment_id', 'actor_count', 'sample_actors')
+        read_only_fields = fields
 
 
 class UserSearchSerializer(serializers.ModelSerializer):
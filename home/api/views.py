@@ -2,15 +2,19 @@ from rest_framework import viewsets, generics, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db.models import Q, Count
+from django.utils.http import parse_etags
 from home.models import Post, Comment, Like, Notification
 from .serializers import (
     PostSerializer,
     PostDetailSerializer,
     CommentSerializer,
     NotificationSerializer,
+    NotificationFeedSerializer,
     UserSearchSerializer,
 )
+from .pagination import NotificationCursorPagination
 from home.utils import search_users
+from home.services.notification_counter_service import NotificationCounterService
 
 
 class PostViewSet(viewsets.ModelViewSet):
@@ -197,24 +201,41 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     def mark_read(self, request, pk=None):
         """Mark a notification as read."""
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        notification.mark_read()
         return Response({"status": "success"})
 
     @action(detail=False, methods=["post"])
     def mark_all_read(self, request):
         """Mark all notifications as read."""
-        Notification.objects.filter(recipient=request.user, is_read=False).update(
-            is_read=True
-        )
+        Notification.mark_all_read(request.user.id)
         return Response({"status": "success"})
 
+    @action(detail=False, methods=["get"])
+    def feed(self, request):
+        """
+        Keyset-paginated notifications, with since_id/until_id and cursors.
+
+        Answers 304 Not Modified when the page matches the client's ETag.
+        """
+        queryset = Notification.objects.filter(recipient=request.user).select_related("sender")
+        paginator = NotificationCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+
+        etag = paginator.get_etag()
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            serializer = NotificationFeedSerializer(page, many=True)
+            response = paginator.get_paginated_response(serializer.data)
+        response["ETag"] = etag
+        # Per user and polled for changes: never served from a shared cache
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
     @action(detail=False, methods=["get"])
     def unread_count(self, request):
         """Get the count of unread notifications."""
-        count = Notification.objects.filter(
-            recipient=request.user, is_read=False
-        ).count()
+        count = NotificationCounterService.get_unread_count(request.user.id)
         return Response({"status": "success", "unread_count": count})
 
 
@@ -3,3 +3,14 @@ from django.apps import AppConfig
 class HomeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'home'
+
+    def ready(self):
+        from home.signals import (
+            connect_image_signals,
+            connect_mention_signals,
+            connect_notification_signals,
+        )
+
+        connect_image_signals()
+        connect_notification_signals()
+        connect_mention_signals()
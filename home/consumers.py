@@ -1,11 +1,12 @@
-import json
 import logging
 import traceback
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
 from .models import Notification
+from .services.notification_outbox_service import NotificationOutboxService
+from .services.notification_counter_service import NotificationCounterService
+from .utils_codec import FrameCodec, FrameDecodeError
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -17,9 +18,10 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """Connect to the WebSocket with optimized caching."""
         try:
+            # JSON text frames unless the client asked for MessagePack
+            self.codec = FrameCodec.negotiate(self.scope)
             self.user_id = self.scope["url_route"]["kwargs"]["user_id"]
             self.notification_group_name = f"notifications_{self.user_id}"
-            self.cache_key_unread = f"notification_unread_{self.user_id}"
 
             logger.info(f"WebSocket connection attempt for user_id: {self.user_id}")
 
@@ -35,18 +37,17 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             await self.channel_layer.group_add(
                 self.notification_group_name, self.channel_name
             )
+            NotificationOutboxService.ensure_scheduler()
 
             logger.info(
                 f"User {self.user_id} joined notification group: {self.notification_group_name}"
             )
-            await self.accept()
+            await self.accept(self.codec.subprotocol)
 
-            # Send initial unread count with caching
-            unread_count = await self.get_unread_notification_count_cached()
-            await self.send(
-                text_data=json.dumps(
-                    {"type": "unread_count", "count": unread_count, "status": "success"}
-                )
+            # Send initial unread count
+            unread_count = await self.get_unread_notification_count()
+            await self.send_frame(
+                {"type": "unread_count", "count": unread_count, "status": "success"}
             )
 
         except Exception as e:
@@ -72,17 +73,17 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             )
             logger.error(traceback.format_exc())
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Receive message from WebSocket."""
         try:
-            # Validate JSON format
+            # Validate the frame format (JSON text or MessagePack binary)
             try:
-                data = json.loads(text_data)
-            except json.JSONDecodeError:
+                data = self.codec.decode(text_data, bytes_data)
+            except FrameDecodeError:
                 logger.warning(
-                    f"Invalid JSON received from user {self.user_id}: {text_data}"
+                    f"Invalid frame received from user {self.user_id}: {text_data or bytes_data!r}"
                 )
-                await self.send_error("Invalid JSON format")
+                await self.send_error("Invalid message format")
                 return
 
             # Validate message structure
@@ -112,15 +113,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 if success:
                     # Send updated unread count
                     unread_count = await self.get_unread_notification_count()
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "unread_count",
-                                "count": unread_count,
-                                "status": "success",
-                                "message": f"Notification {notification_id} marked as read",
-                            }
-                        )
+                    await self.send_frame(
+                        {
+                            "type": "unread_count",
+                            "count": unread_count,
+                            "status": "success",
+                            "message": f"Notification {notification_id} marked as read",
+                        }
                     )
                 else:
                     await self.send_error(
@@ -131,15 +130,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 # Mark all notifications as read
                 count = await self.mark_all_notifications_read()
                 # Send updated unread count (should be 0)
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "unread_count",
-                            "count": 0,
-                            "status": "success",
-                            "message": f"{count} notifications marked as read",
-                        }
-                    )
+                await self.send_frame(
+                    {
+                        "type": "unread_count",
+                        "count": 0,
+                        "status": "success",
+                        "message": f"{count} notifications marked as read",
+                    }
                 )
 
             else:
@@ -154,28 +151,21 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             await self.send_error("Internal server error")
 
     async def notification_message(self, event):
-        """Send notification to WebSocket and update cached unread count."""
+        """Send notification to WebSocket along with the unread count."""
         try:
             # Send the notification data to the WebSocket
-            await self.send(
-                text_data=json.dumps(
-                    {
-                        "type": "notification",
-                        "notification": event["notification"],
-                        "status": "success",
-                    }
-                )
+            await self.send_frame(
+                {
+                    "type": "notification",
+                    "notification": event["notification"],
+                    "status": "success",
+                }
             )
 
-            # Update cached unread count (invalidate cache to force refresh)
-            cache.delete(self.cache_key_unread)
-
             # Send the updated unread count
-            unread_count = await self.get_unread_notification_count_cached()
-            await self.send(
-                text_data=json.dumps(
-                    {"type": "unread_count", "count": unread_count, "status": "success"}
-                )
+            unread_count = await self.get_unread_notification_count()
+            await self.send_frame(
+                {"type": "unread_count", "count": unread_count, "status": "success"}
             )
 
             logger.info(
@@ -187,13 +177,15 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             logger.error(traceback.format_exc())
             await self.send_error("Error delivering notification")
 
+    async def send_frame(self, payload):
+        """Send a payload in the encoding negotiated on connect."""
+        await self.send(**self.codec.encode(payload))
+
     async def send_error(self, message):
         """Send an error message to the client."""
         try:
-            await self.send(
-                text_data=json.dumps(
-                    {"type": "error", "message": message, "status": "error"}
-                )
+            await self.send_frame(
+                {"type": "error", "message": message, "status": "error"}
             )
         except Exception as e:
             logger.error(
@@ -225,15 +217,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     def get_unread_notification_count(self):
         """Get the count of unread notifications for the user."""
         try:
-            user = User.objects.get(id=self.user_id)
-            count = Notification.objects.filter(recipient=user, is_read=False).count()
+            count = NotificationCounterService.get_unread_count(int(self.user_id))
             logger.debug(f"Unread notification count for user {self.user_id}: {count}")
             return count
-        except User.DoesNotExist:
-            logger.warning(
-                f"User with ID {self.user_id} does not exist when getting unread count"
-            )
-            return 0
         except Exception as e:
             logger.error(
                 f"Error getting unread count for user {self.user_id}: {str(e)}"
@@ -241,20 +227,6 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             logger.error(traceback.format_exc())
             return 0
 
-    async def get_unread_notification_count_cached(self):
-        """Get unread notification count with caching for better performance."""
-        # Try to get from cache first
-        cached_count = cache.get(self.cache_key_unread)
-        if cached_count is not None:
-            return cached_count
-
-        # Cache miss - get from database
-        count = await self.get_unread_notification_count()
-
-        # Cache for 30 seconds
-        cache.set(self.cache_key_unread, count, 30)
-        return count
-
     @database_sync_to_async
     def mark_notification_read(self, notification_id):
         """Mark a notification as read."""
@@ -262,11 +234,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             notification = Notification.objects.get(
                 id=notification_id, recipient_id=self.user_id
             )
-            notification.is_read = True
-            notification.save()
-
-            # Invalidate cache
-            cache.delete(self.cache_key_unread)
+            notification.mark_read()
 
             logger.info(
                 f"Notification {notification_id} marked as read for user {self.user_id}"
@@ -288,15 +256,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     def mark_all_notifications_read(self):
         """Mark all notifications as read."""
         try:
-            count = Notification.objects.filter(
-                recipient_id=self.user_id, is_read=False
-            ).count()
-            Notification.objects.filter(
-                recipient_id=self.user_id, is_read=False
-            ).update(is_read=True)
-
-            # Invalidate cache
-            cache.delete(self.cache_key_unread)
+            count = Notification.mark_all_read(self.user_id)
 
             logger.info(
                 f"All {count} notifications marked as read for user {self.user_id}"
@@ -0,0 +1,75 @@
+import os
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from home.utils_storage import hash_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the space duplicate files take in the media directory and, "
+        "unless --report-only is given, store them once via the blob index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--report-only",
+            action="store_true",
+            help="Only report the space deduplication would save",
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, "blob_dir"):
+            self.stdout.write(self.style.ERROR("The default storage does not deduplicate files"))
+            return
+
+        by_digest = defaultdict(list)
+        total_files = total_bytes = 0
+        for name, path in self.media_files():
+            by_digest[hash_file(path)].append(name)
+            total_files += 1
+            total_bytes += os.path.getsize(path)
+
+        # Files already sharing an inode take no extra space
+        savable = 0
+        for names in by_digest.values():
+            inodes = {os.stat(default_storage.path(name)).st_ino for name in names}
+            savable += (len(inodes) - 1) * os.path.getsize(default_storage.path(names[0]))
+
+        self.stdout.write(
+            f"{total_files} files ({total_bytes} bytes), {len(by_digest)} distinct contents"
+        )
+        self.stdout.write(f"Duplicates take {savable} bytes")
+        if options["report_only"]:
+            return
+
+        adopted = saved = 0
+        for digest, names in by_digest.items():
+            for name in names:
+                blob, bytes_saved = default_storage.adopt(name, digest)
+                if blob is not None:
+                    adopted += 1
+                    saved += bytes_saved
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Indexed {adopted} files, saving {saved} bytes")
+        )
+
+    def media_files(self):
+        """(name, path) of every stored file outside the blob directory."""
+        root = default_storage.location
+        blob_root = default_storage.path(default_storage.blob_dir)
+        for directory, subdirectories, files in os.walk(root):
+            if os.path.abspath(directory) == os.path.abspath(blob_root):
+                subdirectories[:] = []
+                continue
+            subdirectories[:] = [
+                subdirectory
+                for subdirectory in subdirectories
+                if os.path.join(directory, subdirectory) != blob_root
+            ]
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                yield os.path.relpath(path, root).replace(os.sep, "/"), path
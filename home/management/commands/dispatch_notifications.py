@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.services.notification_outbox_service import NotificationOutboxService
+
+
+class Command(BaseCommand):
+    help = "Send queued notifications from the outbox to the recipients' sockets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running a pass every NOTIFICATION_OUTBOX_INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            stats = NotificationOutboxService.run_pass()
+            if stats or not options["loop"]:
+                self.stdout.write(
+                    f"Sent {stats['sent']}, retried {stats['retried']}, "
+                    f"failed {stats['failed']}"
+                )
+            if not options["loop"]:
+                return
+            time.sleep(NotificationOutboxService.get_interval())
@@ -0,0 +1,80 @@
+import os
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from home.models import StoredBlob
+
+
+class Command(BaseCommand):
+    help = "Delete deduplicated media blobs that no stored file references any more"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-age-minutes",
+            type=int,
+            default=60,
+            help="Leave blobs and stray files younger than this alone (uploads in flight)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted",
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, "blob_dir"):
+            self.stdout.write(self.style.ERROR("The default storage does not deduplicate files"))
+            return
+
+        dry_run = options["dry_run"]
+        cutoff = timezone.now() - timedelta(minutes=options["min_age_minutes"])
+        deleted = freed = 0
+
+        for blob in StoredBlob.objects.filter(ref_count__lte=0, created_at__lt=cutoff).iterator():
+            path = default_storage.path(blob.path)
+            if dry_run:
+                deleted += 1
+                freed += self.remove(path, dry_run)
+                continue
+            with transaction.atomic():
+                # Conditional, so a blob referenced again meanwhile is kept.
+                # The file goes before the delete commits: storing the same
+                # content again waits for the row, and then writes a new file
+                if not StoredBlob.objects.filter(id=blob.id, ref_count__lte=0).delete()[0]:
+                    continue
+                freed += self.remove(path, dry_run)
+            deleted += 1
+
+        # Files left behind by interrupted uploads or lost index rows
+        known = set(StoredBlob.objects.values_list("path", flat=True))
+        root = default_storage.path(default_storage.blob_dir)
+        oldest = time.time() - options["min_age_minutes"] * 60
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, default_storage.location).replace(os.sep, "/")
+                if name in known or os.path.getmtime(path) > oldest:
+                    continue
+                deleted += 1
+                freed += self.remove(path, dry_run)
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {deleted} unreferenced blobs, freeing {freed} bytes")
+        )
+
+    def remove(self, path, dry_run):
+        """Delete a blob file; returns the bytes freed on disk."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        if not dry_run:
+            os.remove(path)
+        # Space is only freed once no stored name links to the same data
+        return stat.st_size if stat.st_nlink == 1 else 0
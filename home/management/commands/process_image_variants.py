@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from authentication.models import CustomUser
+from chatting.models import Message
+from home.models import ImageSource, Post
+from home.services.image_variant_service import ImageVariantService
+
+
+class Command(BaseCommand):
+    help = "Generate resized variants of pending images (post images, chat images, profile pictures)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="First register every existing image that has no variants yet",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling for pending images",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=10,
+            help="Seconds between polls with --loop",
+        )
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            self.stdout.write(f"Registered {self.backfill()} existing images")
+
+        while True:
+            pending = list(
+                ImageSource.objects.filter(status="pending")
+                .order_by("id")
+                .values_list("name", flat=True)
+            )
+            for name in pending:
+                ImageVariantService.process(name)
+            processed = len(pending)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} images"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def backfill(self):
+        names = set()
+        names.update(Post.objects.exclude(image="").exclude(image__isnull=True).values_list("image", flat=True))
+        names.update(
+            Message.objects.filter(file_type="image")
+            .exclude(file_attachment="")
+            .exclude(file_attachment__isnull=True)
+            .values_list("file_attachment", flat=True)
+        )
+        names.update(
+            CustomUser.objects.exclude(profile_picture="")
+            .exclude(profile_picture__isnull=True)
+            .values_list("profile_picture", flat=True)
+        )
+        known = set(ImageSource.objects.filter(name__in=names).values_list("name", flat=True))
+        ImageSource.objects.bulk_create(
+            [
+                ImageSource(name=name, fingerprint=ImageVariantService.fingerprint(name))
+                for name in names - known
+            ],
+            ignore_conflicts=True,
+        )
+        return len(names - known)
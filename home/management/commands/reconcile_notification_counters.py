@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from home.services.notification_counter_service import NotificationCounterService
+
+
+class Command(BaseCommand):
+    help = "Recount unread notifications and fix counters that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="user_ids",
+            help="Only reconcile this user ID (can be repeated)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Users recounted per query",
+        )
+
+    def handle(self, *args, **options):
+        corrected = NotificationCounterService.reconcile(
+            options["user_ids"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Corrected {corrected} counters"))
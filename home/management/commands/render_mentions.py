@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from home.services.mention_service import MentionService
+
+
+class Command(BaseCommand):
+    help = "Render the stored HTML of posts and comments again (backfill, or after renames)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            action="append",
+            dest="usernames",
+            help="Only content mentioning this username (can be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        changed = MentionService.rerender(options["usernames"])
+        self.stdout.write(self.style.SUCCESS(f"Rendered {changed} posts and comments again"))
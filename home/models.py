@@ -1,7 +1,8 @@
 import logging
-from django.db import models
+from django.db import models, transaction
 from authentication.models import CustomUser
 from django.utils import timezone
+from datetime import timedelta
 import re
 
 # Import profile models
@@ -17,9 +18,33 @@ from .models_profile import (
 logger = logging.getLogger(__name__)
 
 
+def render_content(instance, save_kwargs):
+    """
+    Store the rendering of a post's or comment's content before a save that
+    writes the content, so reads never format it again.
+
+    Returns:
+        The mentioned users, or None if the content is not being saved
+    """
+    from home.utils import render_mentions
+
+    update_fields = save_kwargs.get("update_fields")
+    if update_fields is not None and "content" not in update_fields:
+        return None
+    instance.formatted_content, users = render_mentions(instance.content)
+    instance.mentioned_user_ids = [user.id for user in users]
+    if update_fields is not None:
+        save_kwargs["update_fields"] = {*update_fields, "formatted_content", "mentioned_user_ids"}
+    return users
+
+
 class Post(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="posts")
     content = models.TextField()
+    # Escaped HTML of the content with @mentions linked, and the IDs of the
+    # users linked; rendered on save and again when one of them is renamed
+    formatted_content = models.TextField(blank=True, editable=False)
+    mentioned_user_ids = models.JSONField(default=list, blank=True, editable=False)
     image = models.ImageField(upload_to="posts/images/", null=True, blank=True)
     video = models.FileField(upload_to="posts/videos/", null=True, blank=True)
     document = models.FileField(upload_to="posts/documents/", null=True, blank=True)
@@ -38,32 +63,14 @@ class Post(models.Model):
 
     def save(self, *args, **kwargs):
         is_new = self.pk is None
+        mentioned_users = render_content(self, kwargs)
         super().save(*args, **kwargs)
 
         # Process mentions only if this is a new post
         if is_new and self.content:
-            from home.utils import extract_mentions
-
-            mentioned_users = extract_mentions(self.content)
-
-            logger.debug(
-                f"Post save: Found {len(mentioned_users)} mentioned users in post {self.id}"
-            )
+            from home.services.mention_service import MentionService
 
-            # Create notifications for mentioned users
-            for mentioned_user in mentioned_users:
-                if mentioned_user != self.user:  # Don't notify yourself
-                    logger.debug(
-                        f"Creating mention notification for {mentioned_user.username} from {self.user.username}"
-                    )
-                    notification = Notification.objects.create(
-                        recipient=mentioned_user,
-                        sender=self.user,
-                        post=self,
-                        notification_type="mention",
-                        text=f"{self.user.username} mentioned you in a post",
-                    )
-                    logger.debug(f"Created notification with ID: {notification.id}")
+            MentionService.notify_mentions(self.user, self.content, self, users=mentioned_users)
 
 
 class Like(models.Model):
@@ -88,13 +95,7 @@ class Like(models.Model):
 
         # Create notification for post owner (if not self)
         if is_new and self.post.user != self.user:
-            Notification.objects.create(
-                recipient=self.post.user,
-                sender=self.user,
-                post=self.post,
-                notification_type="like",
-                text=f"{self.user.username} liked your post",
-            )
+            Notification.notify(self.post.user, self.user, "like", self.post, at=self.created_at)
 
 
 class Comment(models.Model):
@@ -103,6 +104,9 @@ class Comment(models.Model):
     )
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     content = models.TextField()
+    # Rendered like Post.formatted_content
+    formatted_content = models.TextField(blank=True, editable=False)
+    mentioned_user_ids = models.JSONField(default=list, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -118,6 +122,7 @@ class Comment(models.Model):
 
     def save(self, *args, **kwargs):
         is_new = self.pk is None
+        mentioned_users = render_content(self, kwargs)
         super().save(*args, **kwargs)
 
         if is_new:
@@ -126,44 +131,19 @@ class Comment(models.Model):
                 logger.debug(
                     f"Creating comment notification for post owner {self.post.user.username}"
                 )
-                notification = Notification.objects.create(
-                    recipient=self.post.user,
-                    sender=self.user,
-                    post=self.post,
-                    comment=self,
-                    notification_type="comment",
-                    text=f"{self.user.username} commented on your post",
+                notification = Notification.notify(
+                    self.post.user, self.user, "comment", self.post, comment=self, at=self.created_at
                 )
-                logger.debug(f"Created comment notification with ID: {notification.id}")
+                logger.debug(f"Recorded comment notification with ID: {notification.id}")
 
             # Process mentions
             if self.content:
-                from home.utils import extract_mentions
-
-                mentioned_users = extract_mentions(self.content)
+                from home.services.mention_service import MentionService
 
-                logger.debug(
-                    f"Comment save: Found {len(mentioned_users)} mentioned users in comment {self.id}"
+                MentionService.notify_mentions(
+                    self.user, self.content, self.post, comment=self, users=mentioned_users
                 )
 
-                # Create notifications for mentioned users
-                for mentioned_user in mentioned_users:
-                    if mentioned_user != self.user:  # Don't notify yourself
-                        logger.debug(
-                            f"Creating mention notification for {mentioned_user.username} from {self.user.username} in comment"
-                        )
-                        notification = Notification.objects.create(
-                            recipient=mentioned_user,
-                            sender=self.user,
-                            post=self.post,
-                            comment=self,
-                            notification_type="mention",
-                            text=f"{self.user.username} mentioned you in a comment",
-                        )
-                        logger.debug(
-                            f"Created mention notification with ID: {notification.id}"
-                        )
-
 
 class Contact(models.Model):
     name = models.CharField(max_length=100)
@@ -262,6 +242,20 @@ class Appointment(models.Model):
         return self.appointment_date < current_date
 
 
+def set_null_if_coalesced(collector, field, sub_objs, using):
+    """
+    ``on_delete`` of the actor fields of Notification: aggregated likes and
+    comments lose the reference and are recounted (see
+    ``Notification.refresh_actors``), other notifications are deleted.
+    """
+    coalesced = [obj for obj in sub_objs if obj.notification_type in Notification.COALESCED_TYPES]
+    others = [obj for obj in sub_objs if obj.notification_type not in Notification.COALESCED_TYPES]
+    if coalesced:
+        collector.add_field_update(field, None, coalesced)
+    if others:
+        models.CASCADE(collector, field, others, using)
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
         ("mention", "Mention"),
@@ -272,28 +266,52 @@ class Notification(models.Model):
     recipient = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name="notifications"
     )
+    # Null only on aggregates whose latest actor or comment was just deleted
     sender = models.ForeignKey(
-        CustomUser, on_delete=models.CASCADE, related_name="sent_notifications"
+        CustomUser,
+        on_delete=set_null_if_coalesced,
+        null=True,
+        blank=True,
+        related_name="sent_notifications",
     )
     post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True)
     comment = models.ForeignKey(
-        Comment, on_delete=models.CASCADE, null=True, blank=True
+        Comment, on_delete=set_null_if_coalesced, null=True, blank=True
     )
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
     text = models.TextField(blank=True)
     is_read = models.BooleanField(default=False)
+    # Time of the latest activity; moves forward as activity is coalesced
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Coalesced likes and comments: ``sender`` is the latest actor, and the
+    # entry keeps absorbing activity until NOTIFICATION_COALESCE_WINDOW after
+    # window_start, the time of its first activity
+    actor_count = models.PositiveIntegerField(default=1)
+    sample_actors = models.JSONField(default=list, blank=True)
+    window_start = models.DateTimeField(null=True, blank=True)
+
+    # Types folded per (recipient, type, post), with the text they read as
+    COALESCED_TYPES = {
+        "like": "liked your post",
+        "comment": "commented on your post",
+    }
+    MAX_SAMPLE_ACTORS = 3
+
     class Meta:
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["recipient", "is_read"]),
-            models.Index(fields=["recipient", "created_at"]),
+            # Feed pages are keyset scans on (created_at, id)
+            models.Index(fields=["recipient", "created_at", "id"]),
             models.Index(fields=["sender"]),
+            # Lookup of the open aggregate a like or comment folds into
+            models.Index(fields=["recipient", "notification_type", "post", "is_read"]),
         ]
 
     def __str__(self):
-        return f"{self.notification_type} notification for {self.recipient.username} from {self.sender.username}"
+        sender = self.sender.username if self.sender else "deleted user"
+        return f"{self.notification_type} notification for {self.recipient.username} from {sender}"
 
     def get_notification_url(self):
         """Get the URL for this notification."""
@@ -303,27 +321,262 @@ class Notification(models.Model):
         elif self.notification_type == "mention" and self.post:
             # Mention in a post
             return f"/home/post/{self.post.id}/"
-        elif self.notification_type == "comment":
+        elif self.notification_type == "comment" and self.comment:
             # Comment on a post
             return f"/home/post/{self.post.id}/#comment-{self.comment.id}"
-        elif self.notification_type == "like":
-            # Like on a post
+        elif self.notification_type in self.COALESCED_TYPES:
+            # Like on a post, or a comment being recounted
             return f"/home/post/{self.post.id}/"
         else:
             # Default
             return "/home/"
 
+    @classmethod
+    def get_coalesce_window(cls):
+        from django.conf import settings
+
+        return timedelta(seconds=getattr(settings, "NOTIFICATION_COALESCE_WINDOW", 3600))
+
+    @classmethod
+    def get_push_interval(cls):
+        """Least time between two socket updates of one aggregated entry."""
+        from django.conf import settings
+
+        return timedelta(seconds=getattr(settings, "NOTIFICATION_PUSH_INTERVAL", 30))
+
+    @classmethod
+    def notify(cls, recipient, sender, notification_type, post, comment=None, at=None):
+        """
+        Record a like or comment on a post, folding it into the recipient's
+        unread entry for the same post and type if its window is still open.
+
+        The first activity is pushed right away; later ones update the entry
+        and share one deferred push per NOTIFICATION_PUSH_INTERVAL.
+
+        Args:
+            at: Time of the like or comment (default: now)
+
+        Returns:
+            The new or updated Notification
+        """
+        now = timezone.now()
+        at = at or now
+        verb = cls.COALESCED_TYPES[notification_type]
+        actor = {"id": sender.id, "username": sender.username}
+
+        with transaction.atomic():
+            entry = (
+                cls.objects.select_for_update()
+                .filter(
+                    recipient=recipient,
+                    notification_type=notification_type,
+                    post=post,
+                    is_read=False,
+                    window_start__gte=at - cls.get_coalesce_window(),
+                )
+                .order_by("-window_start")
+                .first()
+            )
+            if entry is None:
+                return cls.objects.create(
+                    recipient=recipient,
+                    sender=sender,
+                    post=post,
+                    comment=comment,
+                    notification_type=notification_type,
+                    text=f"{sender.username} {verb}",
+                    sample_actors=[actor],
+                    window_start=at,
+                )
+
+            if not entry._has_acted(sender, comment):
+                entry.actor_count += 1
+            entry.sample_actors = [actor] + [
+                sample for sample in entry.sample_actors if sample["id"] != sender.id
+            ][: cls.MAX_SAMPLE_ACTORS - 1]
+            entry.sender = sender
+            entry.comment = comment
+            entry.created_at = now
+            entry.text = entry.render_text(verb)
+            entry.save()
+
+            # One pending push per entry carries the latest state
+            payload = entry.get_payload()
+            pending = NotificationOutbox.objects.filter(notification=entry, status="pending")
+            if not pending.update(payload=payload, version=models.F("version") + 1):
+                NotificationOutbox.objects.create(
+                    notification=entry,
+                    group=f"notifications_{entry.recipient_id}",
+                    payload=payload,
+                    next_attempt_at=now + cls.get_push_interval(),
+                )
+        return entry
+
+    def _has_acted(self, sender, comment):
+        """Whether ``sender`` is already counted among this entry's actors."""
+        if any(sample["id"] == sender.id for sample in self.sample_actors):
+            return True
+        if self.notification_type == "comment":
+            # Earlier comments in the window by the same user
+            return (
+                Comment.objects.filter(
+                    post_id=self.post_id, user=sender, created_at__gte=self.window_start
+                )
+                .exclude(id=comment.id if comment else None)
+                .exists()
+            )
+        # A user likes a post at most once
+        return False
+
+    @classmethod
+    def refresh_covering(cls, post_id, notification_type, at):
+        """
+        Recount the aggregated entries that a deleted like or comment was
+        folded into.
+
+        Args:
+            post_id: ID of the post liked or commented on
+            notification_type: "like" or "comment"
+            at: Time of the deleted like or comment
+        """
+        with transaction.atomic():
+            entries = cls.objects.select_for_update().filter(
+                post_id=post_id,
+                notification_type=notification_type,
+                window_start__lte=at,
+                created_at__gte=at,
+            )
+            for entry in entries:
+                entry.refresh_actors()
+
+    def refresh_actors(self):
+        """
+        Set the actors and text of an aggregated entry from the likes or
+        comments of its window that still exist, deleting the entry if none
+        is left.
+
+        Returns:
+            The entry, or None if it was deleted
+        """
+        source = Like if self.notification_type == "like" else Comment
+        activity = (
+            source.objects.filter(
+                post_id=self.post_id,
+                created_at__gte=self.window_start,
+                created_at__lte=self.created_at,
+            )
+            .exclude(user_id=self.recipient_id)
+            .select_related("user")
+            .order_by("-created_at", "-id")
+        )
+
+        latest = None
+        actors = {}
+        for item in activity:
+            latest = latest or item
+            actors.setdefault(item.user_id, item.user)
+        if latest is None:
+            self.delete()
+            return None
+
+        self.actor_count = len(actors)
+        self.sample_actors = [
+            {"id": user.id, "username": user.username}
+            for user in list(actors.values())[: self.MAX_SAMPLE_ACTORS]
+        ]
+        self.sender = latest.user
+        self.comment = latest if self.notification_type == "comment" else None
+        self.text = self.render_text(self.COALESCED_TYPES[self.notification_type])
+        self.save(update_fields=["actor_count", "sample_actors", "sender", "comment", "text"])
+        return self
+
+    def render_text(self, verb):
+        names = [sample["username"] for sample in self.sample_actors]
+        if self.actor_count == 1:
+            return f"{names[0]} {verb}"
+        if self.actor_count == 2 and len(names) > 1:
+            return f"{names[0]} and {names[1]} {verb}"
+        others = self.actor_count - 1
+        return f"{names[0]} and {others} other{'s' if others > 1 else ''} {verb}"
+
     def save(self, *args, **kwargs):
-        """Override save method to send WebSocket notification."""
+        """Override save method to queue the WebSocket notification."""
         is_new = self.pk is None
-        super().save(*args, **kwargs)
-
-        # Send WebSocket notification if this is a new notification
-        if is_new:
-            self.send_notification()
+        if not is_new:
+            super().save(*args, **kwargs)
+            return
+
+        from home.services.notification_counter_service import NotificationCounterService
+
+        # The outbox row commits (or rolls back) with the notification; the
+        # dispatcher sends it, so saving does no channel layer I/O
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            NotificationOutbox.objects.create(
+                notification=self,
+                group=f"notifications_{self.recipient_id}",
+                payload=self.get_payload(),
+            )
+            if not self.is_read:
+                NotificationCounterService.adjust(self.recipient_id, 1)
+
+    def mark_read(self):
+        """
+        Mark the notification as read, updating the unread counter.
+
+        Returns:
+            True if it was unread
+        """
+        from home.services.notification_counter_service import NotificationCounterService
+
+        with transaction.atomic():
+            # Conditional, so concurrent requests only count it once
+            changed = Notification.objects.filter(id=self.id, is_read=False).update(
+                is_read=True
+            )
+            if changed:
+                NotificationCounterService.adjust(self.recipient_id, -1)
+        self.is_read = True
+        return bool(changed)
+
+    @classmethod
+    def mark_all_read(cls, recipient_id):
+        """
+        Mark all notifications of a user as read, updating the unread counter.
+
+        Returns:
+            Number of notifications that were unread
+        """
+        from home.services.notification_counter_service import NotificationCounterService
+
+        with transaction.atomic():
+            changed = cls.objects.filter(recipient_id=recipient_id, is_read=False).update(
+                is_read=True
+            )
+            NotificationCounterService.adjust(recipient_id, -changed)
+        return changed
+
+    def get_payload(self):
+        """Notification data as sent to the recipient's sockets."""
+        return {
+            "id": self.id,
+            "recipient": self.recipient.username,
+            "recipient_id": self.recipient.id,
+            "sender": self.sender.username if self.sender else None,
+            "sender_id": self.sender_id,
+            "notification_type": self.notification_type,
+            "text": self.text,
+            "is_read": self.is_read,
+            "created_at": self.created_at.isoformat(),
+            "post_id": self.post.id if self.post else None,
+            "comment_id": self.comment.id if self.comment else None,
+            "url": self.get_notification_url(),
+            "actor_count": self.actor_count,
+            "sample_actors": self.sample_actors,
+        }
 
     def send_notification(self):
-        """Send notification via WebSocket."""
+        """Send notification via WebSocket right away, bypassing the outbox."""
         import logging
 
         logger = logging.getLogger(__name__)
@@ -332,7 +585,6 @@ class Notification(models.Model):
             # Import here to avoid circular imports
             from channels.layers import get_channel_layer
             from asgiref.sync import async_to_sync
-            import json
 
             # Get the channel layer
             channel_layer = get_channel_layer()
@@ -340,21 +592,7 @@ class Notification(models.Model):
                 logger.error("Channel layer not available")
                 return
 
-            # Prepare notification data
-            notification_data = {
-                "id": self.id,
-                "recipient": self.recipient.username,
-                "recipient_id": self.recipient.id,
-                "sender": self.sender.username,
-                "sender_id": self.sender.id,
-                "notification_type": self.notification_type,
-                "text": self.text,
-                "is_read": self.is_read,
-                "created_at": self.created_at.isoformat(),
-                "post_id": self.post.id if self.post else None,
-                "comment_id": self.comment.id if self.comment else None,
-                "url": self.get_notification_url(),
-            }
+            notification_data = self.get_payload()
 
             # Send notification to the recipient's group
             group_name = f"notifications_{self.recipient.id}"
@@ -370,12 +608,68 @@ class Notification(models.Model):
             )
 
         except Exception as e:
-            # Log the error but don't prevent the notification from being saved
+            # Log the error; the notification itself is already saved
             logger.error(
                 f"Error sending WebSocket notification: {str(e)}", exc_info=True
             )
 
 
+class NotificationOutbox(models.Model):
+    """
+    A notification waiting to be pushed to its recipient's sockets.
+
+    Written in the same transaction as the notification and deleted by the
+    dispatcher (``NotificationOutboxService``) once sent.
+    """
+
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("failed", "Failed"),
+    )
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="outbox_entries"
+    )
+    group = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # Bumped whenever the payload is rewritten, so a dispatcher only deletes
+    # the row if what it sent is still current
+    version = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The dispatcher claims due pending rows in ID order
+            models.Index(fields=["status", "next_attempt_at", "id"]),
+        ]
+
+    def __str__(self):
+        return f"Outbox entry for notification {self.notification_id} ({self.status})"
+
+
+class NotificationCounter(models.Model):
+    """
+    Number of unread notifications of a user, kept in step with every
+    change by ``NotificationCounterService`` so the badge is not a COUNT(*).
+    """
+
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="notification_counter",
+    )
+    unread = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.unread} unread notifications for user {self.user_id}"
+
+
 class Subject(models.Model):
     """Model representing an academic subject or course."""
 
@@ -482,3 +776,87 @@ class SubjectEnrollment(models.Model):
 
     def __str__(self):
         return f"{self.student.username} enrolled in {self.subject.name}"
+
+
+class StoredBlob(models.Model):
+    """
+    A file content stored once by ``DedupFileSystemStorage``.
+
+    ``ref_count`` is the number of stored file names sharing the content;
+    blobs that drop to zero are removed by ``manage.py gc_media_blobs``.
+    """
+
+    digest = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.IntegerField(default=0, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.size} bytes, {self.ref_count} references)"
+
+
+class StoredFile(models.Model):
+    """A file name handed out by ``DedupFileSystemStorage`` and its content."""
+
+    name = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, related_name="files")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ImageSource(models.Model):
+    """
+    An uploaded image (post image, chat image or profile picture) and the
+    state of its resized variants, keyed by the stored file name.
+    """
+
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    )
+
+    name = models.CharField(max_length=255, unique=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default="pending", db_index=True
+    )
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # Tiny blurred preview as a data URI, shown until the image loads
+    placeholder = models.TextField(blank=True)
+    # Size and modification time of the file the variants were made from,
+    # so a file replaced under the same name is processed again
+    fingerprint = models.CharField(max_length=64, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class ImageVariant(models.Model):
+    """A resized, re-encoded copy of an ``ImageSource``."""
+
+    source = models.ForeignKey(
+        ImageSource, on_delete=models.CASCADE, related_name="variants"
+    )
+    size = models.CharField(max_length=10)
+    format = models.CharField(max_length=10)
+    name = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    file_size = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "size", "format"], name="unique_image_variant"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.source.name} {self.size} {self.format}"
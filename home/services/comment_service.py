@@ -1,7 +1,6 @@
 from django.core.exceptions import PermissionDenied
 from home.models import Comment
 from home.forms import CommentForm
-from home.utils import format_content_with_mentions
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,13 +23,10 @@ class CommentService:
             comment.post = post
             comment.save()
 
-            # Format content with mentions
-            formatted_content = format_content_with_mentions(comment.content)
-
             return {
                 "success": True,
                 "comment": comment,
-                "formatted_content": formatted_content,
+                "formatted_content": comment.formatted_content,
             }
         else:
             return {"success": False, "errors": form.errors}
@@ -61,7 +57,7 @@ class CommentService:
                     "id": comment.id,
                     "user": comment.user.username,
                     "content": comment.content,
-                    "formatted_content": format_content_with_mentions(comment.content),
+                    "formatted_content": comment.formatted_content,
                     "created_at": comment.created_at.strftime("%Y-%m-%d %H:%M"),
                     "profile_picture": (
                         comment.user.profile_picture.url
@@ -0,0 +1,299 @@
+import base64
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from home.models import ImageSource, ImageVariant
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of each variant
+VARIANT_SIZES = {
+    "thumb": 96,
+    "medium": 480,
+    "large": 1280,
+}
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+PLACEHOLDER_SIZE = 16
+ORIENTATION_TAG = 0x0112
+VARIANT_CACHE_TTL = 60 * 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImageVariantService:
+    """
+    Service class for resized variants of uploaded images.
+
+    Saving a post image, a chat image or a profile picture registers an
+    ``ImageSource`` as pending; once the transaction commits, a thread pool
+    (``IMAGE_VARIANT_WORKERS`` threads) decodes the image once and writes a
+    WebP and a JPEG copy per size in ``VARIANT_SIZES``, never upscaling,
+    plus a tiny blurred placeholder. ``manage.py process_image_variants``
+    handles the backlog and anything the pool did not get to.
+
+    Until an image is ready, ``describe`` points every size at the original
+    file, so clients always get a working URL.
+    """
+
+    @staticmethod
+    def is_in_process():
+        """Whether variants are generated by a pool in the web process."""
+        return getattr(settings, "IMAGE_VARIANTS_IN_PROCESS", True)
+
+    @staticmethod
+    def get_workers():
+        return getattr(settings, "IMAGE_VARIANT_WORKERS", 2)
+
+    @staticmethod
+    def get_max_attempts():
+        return getattr(settings, "IMAGE_VARIANT_MAX_ATTEMPTS", 3)
+
+    @staticmethod
+    def _cache_key(name):
+        return f"image_variants:{name}"
+
+    @staticmethod
+    def fingerprint(name):
+        """Size and modification time of a stored file, or "" if unknown."""
+        try:
+            modified = default_storage.get_modified_time(name)
+            return f"{default_storage.size(name)}:{modified.timestamp()}"
+        except (OSError, NotImplementedError):
+            return ""
+
+    @staticmethod
+    def enqueue(name):
+        """
+        Register an image for processing after the current transaction.
+
+        An image already processed is only queued again if its file was
+        replaced under the same name.
+
+        Args:
+            name: The stored file name of the image
+        """
+        if not name:
+            return
+        fingerprint = ImageVariantService.fingerprint(name)
+        source, created = ImageSource.objects.get_or_create(
+            name=name, defaults={"fingerprint": fingerprint}
+        )
+        if not created:
+            if source.status != "pending" and source.fingerprint == fingerprint:
+                return
+            ImageSource.objects.filter(id=source.id).update(
+                status="pending", attempts=0, fingerprint=fingerprint
+            )
+        cache.delete(ImageVariantService._cache_key(name))
+        if ImageVariantService.is_in_process():
+            transaction.on_commit(lambda: ImageVariantService.submit(name))
+
+    @staticmethod
+    def submit(name):
+        """Process an image in the worker pool."""
+        global _executor
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=ImageVariantService.get_workers(),
+                    thread_name_prefix="image-variants",
+                )
+        return _executor.submit(ImageVariantService._run, name)
+
+    @staticmethod
+    def _run(name):
+        close_old_connections()
+        try:
+            ImageVariantService.process(name)
+        except Exception as e:
+            logger.error(f"Error processing image {name}: {str(e)}", exc_info=True)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def process(name):
+        """
+        Generate the variants and placeholder of a pending image.
+
+        Returns:
+            The updated ImageSource, or None if it is not pending (or was
+            replaced meanwhile)
+        """
+        source = ImageSource.objects.filter(name=name, status="pending").first()
+        if source is None:
+            return None
+
+        try:
+            with default_storage.open(name, "rb") as f:
+                image = Image.open(f)
+                width, height = image.size
+                if image.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+                    width, height = height, width
+                # JPEG can decode at a reduced scale, far faster for big photos
+                image.draft("RGB", (max(VARIANT_SIZES.values()),) * 2)
+                image = ImageOps.exif_transpose(image)
+                image.load()
+        except Exception as e:
+            source.attempts += 1
+            if source.attempts >= ImageVariantService.get_max_attempts():
+                source.status = "failed"
+            source.save(update_fields=["attempts", "status", "updated_at"])
+            logger.warning(f"Could not decode image {name}: {str(e)}")
+            return source
+
+        has_alpha = image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        stem = os.path.splitext(name)[0]
+
+        variants = []
+        for size, longest in VARIANT_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((longest, longest), Image.LANCZOS)
+            for extension, (pil_format, options) in FORMATS.items():
+                encoded = resized
+                if pil_format == "JPEG" and has_alpha:
+                    encoded = Image.new("RGB", resized.size, (255, 255, 255))
+                    encoded.paste(resized, mask=resized.getchannel("A"))
+                buffer = io.BytesIO()
+                encoded.save(buffer, pil_format, **options)
+                variant_name = f"image_variants/{stem}_{size}.{extension}"
+                if default_storage.exists(variant_name):
+                    default_storage.delete(variant_name)
+                variant_name = default_storage.save(
+                    variant_name, ContentFile(buffer.getvalue())
+                )
+                variants.append(
+                    ImageVariant(
+                        source=source,
+                        size=size,
+                        format=extension,
+                        name=variant_name,
+                        width=resized.width,
+                        height=resized.height,
+                        file_size=buffer.tell(),
+                    )
+                )
+
+        with transaction.atomic():
+            if not ImageSource.objects.select_for_update().filter(
+                id=source.id, fingerprint=source.fingerprint
+            ).exists():
+                # Replaced while being processed; queued again for the new file
+                return None
+            ImageVariant.objects.filter(source=source).delete()
+            ImageVariant.objects.bulk_create(variants)
+            source.width, source.height = width, height
+            source.placeholder = ImageVariantService.placeholder(image)
+            source.status = "ready"
+            source.save()
+
+        cache.delete(ImageVariantService._cache_key(name))
+        logger.info(f"Generated {len(variants)} variants of {name}")
+        return source
+
+    @staticmethod
+    def placeholder(image):
+        """Blurred preview a few hundred bytes long, as a WebP data URI."""
+        tiny = image.copy()
+        tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+        buffer = io.BytesIO()
+        tiny.save(buffer, "WEBP", quality=30)
+        return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    @staticmethod
+    def describe_many(names):
+        """
+        Variant URLs of several images at once.
+
+        Args:
+            names: Stored file names of images
+
+        Returns:
+            Dict of name -> {"status", "width", "height", "placeholder", and
+            per size {"webp", "jpeg", "width", "height"}}; sizes of images
+            that are not ready point at the original
+        """
+        names = [name for name in set(names) if name]
+        keys = {ImageVariantService._cache_key(name): name for name in names}
+        result = {
+            keys[key]: data for key, data in cache.get_many(list(keys)).items()
+        }
+
+        missing = [name for name in names if name not in result]
+        if missing:
+            sources = {
+                source.name: source
+                for source in ImageSource.objects.filter(name__in=missing).prefetch_related("variants")
+            }
+            ready = {}
+            for name in missing:
+                result[name] = ImageVariantService._describe(name, sources.get(name))
+                if name in sources and sources[name].status == "ready":
+                    ready[ImageVariantService._cache_key(name)] = result[name]
+            # Only finished images are cached; pending ones change soon
+            cache.set_many(ready, VARIANT_CACHE_TTL)
+
+        return result
+
+    @staticmethod
+    def describe(name):
+        return ImageVariantService.describe_many([name]).get(name)
+
+    @staticmethod
+    def _describe(name, source):
+        original = default_storage.url(name)
+        data = {
+            "status": source.status if source else "pending",
+            "width": source.width if source else None,
+            "height": source.height if source else None,
+            "placeholder": source.placeholder if source else "",
+        }
+        for size in VARIANT_SIZES:
+            data[size] = {"webp": original, "jpeg": original, "width": None, "height": None}
+        if source is not None and source.status == "ready":
+            for variant in source.variants.all():
+                entry = data[variant.size]
+                entry[variant.format] = default_storage.url(variant.name)
+                entry["width"], entry["height"] = variant.width, variant.height
+        return data
+
+    @staticmethod
+    def for_serializer(serializer, name, name_of):
+        """
+        ``describe`` for a serializer field, batched over a ``many=True`` list.
+
+        The first call looks up the images of every object in the list at
+        once and keeps them in the serializer context.
+
+        Args:
+            serializer: The (child) serializer rendering the object
+            name: Stored file name of the object's image
+            name_of: Function returning the image name of a listed object
+        """
+        if not name:
+            return None
+        described = serializer.context.setdefault("image_variants", {})
+        if name not in described:
+            names = [name]
+            parent = getattr(serializer, "parent", None)
+            if parent is not None and isinstance(getattr(parent, "instance", None), (list, tuple)):
+                names += [name_of(obj) for obj in parent.instance]
+            described.update(ImageVariantService.describe_many(names))
+        return described.get(name)
+
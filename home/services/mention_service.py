@@ -0,0 +1,172 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from home.models import Comment, Notification, NotificationOutbox, Post
+from home.services.notification_counter_service import NotificationCounterService
+from home.utils import extract_mentions, render_mentions
+
+logger = logging.getLogger(__name__)
+
+RERENDER_BATCH_SIZE = 500
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class MentionService:
+    """
+    Service class for @mentions: their notifications and stored renderings.
+
+    Shared by ``Post.save`` and ``Comment.save``, and so by the views and
+    the DRF serializers creating them. Whatever the number of mentions, it
+    resolves every username in one query, inserts the notifications and
+    their outbox rows with one ``bulk_create`` each and bumps the unread
+    counters in one update. The pushes go out after commit, in the
+    outbox dispatcher's next batch.
+
+    Posts and comments store their content rendered with linked mentions
+    (``formatted_content``) when saved. Renaming or deleting a user makes
+    that stale, so it is rendered again in the background, by a thread in
+    the web process (``MENTION_RERENDER_IN_PROCESS``) or by
+    ``manage.py render_mentions``.
+    """
+
+    @staticmethod
+    def is_in_process():
+        """Whether stale renderings are redone by a thread in the web process."""
+        return getattr(settings, "MENTION_RERENDER_IN_PROCESS", True)
+
+    @staticmethod
+    def notify_mentions(sender, text, post, comment=None, users=None):
+        """
+        Notify the users mentioned in a new post or comment.
+
+        Args:
+            sender: The author of the post or comment
+            text: Its content
+            post: The post, or the post commented on
+            comment: The comment, if the mentions are in one
+            users: The mentioned users, if already resolved
+
+        Returns:
+            List of the created Notification objects
+        """
+        if users is None:
+            users = extract_mentions(text)
+        recipients = [user for user in users if user.id != sender.id]
+        if not recipients:
+            return []
+
+        where = "a comment" if comment is not None else "a post"
+        notifications = [
+            Notification(
+                recipient=recipient,
+                sender=sender,
+                post=post,
+                comment=comment,
+                notification_type="mention",
+                text=f"{sender.username} mentioned you in {where}",
+            )
+            for recipient in recipients
+        ]
+
+        with transaction.atomic():
+            # Bypasses Notification.save, so the outbox rows and counters
+            # it would write are written here, in bulk
+            Notification.objects.bulk_create(notifications)
+            NotificationOutbox.objects.bulk_create(
+                [
+                    NotificationOutbox(
+                        notification=notification,
+                        group=f"notifications_{notification.recipient_id}",
+                        payload=notification.get_payload(),
+                    )
+                    for notification in notifications
+                ]
+            )
+            NotificationCounterService.increment_many(
+                notification.recipient_id for notification in notifications
+            )
+
+        logger.debug(
+            f"Created {len(notifications)} mention notifications from {sender.username} "
+            f"in {where} on post {post.id}"
+        )
+        return notifications
+
+    @staticmethod
+    def schedule_rerender(usernames):
+        """
+        Render again, after the current transaction, the posts and comments
+        that mention any of ``usernames``.
+        """
+        usernames = [username for username in usernames if username]
+        if usernames and MentionService.is_in_process():
+            transaction.on_commit(lambda: MentionService.submit(usernames))
+
+    @staticmethod
+    def submit(usernames):
+        """Render again in the background thread."""
+        global _executor
+        with _executor_lock:
+            if _executor is None:
+                # One thread, so renames are applied in order
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mentions")
+        return _executor.submit(MentionService._run, usernames)
+
+    @staticmethod
+    def _run(usernames):
+        close_old_connections()
+        try:
+            MentionService.rerender(usernames)
+        except Exception as e:
+            logger.error(f"Error rendering mentions of {usernames}: {str(e)}", exc_info=True)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def rerender(usernames=None):
+        """
+        Render the stored content of posts and comments again.
+
+        Args:
+            usernames: Only content mentioning one of these usernames
+                (default: all content)
+
+        Returns:
+            Number of posts and comments whose rendering changed
+        """
+        changed = 0
+        for model in (Post, Comment):
+            queryset = model.objects.order_by("id")
+            if usernames is not None:
+                # A superset (also "@bobby" for "@bob"), narrowed by rendering
+                mentioning = Q()
+                for username in usernames:
+                    mentioning |= Q(content__icontains=f"@{username}")
+                queryset = queryset.filter(mentioning)
+
+            queryset = queryset.only("id", "content", "formatted_content", "mentioned_user_ids")
+
+            stale = []
+            for obj in queryset.iterator(chunk_size=RERENDER_BATCH_SIZE):
+                html, users = render_mentions(obj.content)
+                user_ids = [user.id for user in users]
+                if html != obj.formatted_content or user_ids != obj.mentioned_user_ids:
+                    obj.formatted_content, obj.mentioned_user_ids = html, user_ids
+                    stale.append(obj)
+                if len(stale) >= RERENDER_BATCH_SIZE:
+                    model.objects.bulk_update(stale, ["formatted_content", "mentioned_user_ids"])
+                    changed += len(stale)
+                    stale = []
+            model.objects.bulk_update(stale, ["formatted_content", "mentioned_user_ids"])
+            changed += len(stale)
+
+        if changed:
+            logger.info(f"Rendered {changed} posts and comments again")
+        return changed
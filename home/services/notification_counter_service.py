@@ -0,0 +1,199 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+from authentication.models import CustomUser
+from home.models import Notification, NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationCounterService:
+    """
+    Service class for the denormalized unread notification counters.
+
+    Every change to a notification's read state adjusts its recipient's
+    ``NotificationCounter`` row with an atomic ``F()`` update in the same
+    transaction: creating an unread notification adds one, marking read and
+    deleting unread ones subtract the rows actually changed. Reads go to the
+    cache first (a Redis mirror when Redis is the cache backend), then to
+    the row, and recount only for users without one.
+
+    The cache entry is dropped after each committed change rather than
+    updated, so it never runs ahead of the database; anything that still
+    drifts (raw SQL, bulk deletes) is fixed by ``reconcile``, which
+    ``manage.py reconcile_notification_counters`` runs periodically.
+    """
+
+    @staticmethod
+    def get_cache_ttl():
+        return getattr(settings, "NOTIFICATION_COUNTER_CACHE_TTL", 300)
+
+    @staticmethod
+    def _cache_key(user_id):
+        return f"notification_unread:{user_id}"
+
+    @staticmethod
+    def get_unread_count(user_id):
+        """
+        Number of unread notifications of a user.
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            The unread count, read from the cache when possible
+        """
+        key = NotificationCounterService._cache_key(user_id)
+        count = cache.get(key)
+        if count is not None:
+            return count
+
+        count = (
+            NotificationCounter.objects.filter(user_id=user_id)
+            .values_list("unread", flat=True)
+            .first()
+        )
+        if count is None:
+            count = NotificationCounterService.recount(user_id)
+        cache.set(key, count, NotificationCounterService.get_cache_ttl())
+        return count
+
+    @staticmethod
+    def adjust(user_id, delta):
+        """
+        Add ``delta`` to a user's unread counter.
+
+        Call inside the transaction that changes the notifications, so the
+        counter commits or rolls back with them.
+        """
+        if not delta:
+            return
+        updated = NotificationCounter.objects.filter(user_id=user_id).update(
+            unread=F("unread") + delta
+        )
+        if not updated and delta > 0:
+            # First notification since counters were introduced; the count
+            # already includes this transaction's changes
+            NotificationCounterService.recount(user_id)
+        transaction.on_commit(
+            lambda: cache.delete(NotificationCounterService._cache_key(user_id))
+        )
+
+    @staticmethod
+    def increment_many(user_ids):
+        """
+        Add one to the unread counters of several users in a single update,
+        as ``adjust(user_id, 1)`` would for each.
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        existing = set(
+            NotificationCounter.objects.filter(user_id__in=user_ids).values_list(
+                "user_id", flat=True
+            )
+        )
+        NotificationCounter.objects.filter(user_id__in=existing).update(unread=F("unread") + 1)
+
+        missing = user_ids - existing
+        if missing:
+            # Counted like recount(), for all of them at once; a row created
+            # concurrently wins and any difference is left to reconcile()
+            counts = dict(
+                Notification.objects.filter(recipient_id__in=missing, is_read=False)
+                .values("recipient_id")
+                .annotate(unread=Count("id"))
+                .values_list("recipient_id", "unread")
+            )
+            NotificationCounter.objects.bulk_create(
+                [
+                    NotificationCounter(user_id=user_id, unread=counts.get(user_id, 0))
+                    for user_id in missing
+                ],
+                ignore_conflicts=True,
+            )
+        transaction.on_commit(
+            lambda: cache.delete_many(
+                [NotificationCounterService._cache_key(user_id) for user_id in user_ids]
+            )
+        )
+
+    @staticmethod
+    def recount(user_id):
+        """
+        Set a user's counter from the notifications themselves.
+
+        Returns:
+            The unread count
+        """
+        count = Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+        NotificationCounter.objects.update_or_create(user_id=user_id, defaults={"unread": count})
+        return count
+
+    @staticmethod
+    def reconcile(user_ids=None, batch_size=1000):
+        """
+        Recount the counters of the given users (default: all) and fix those
+        that drifted.
+
+        A counter that changes while it is being checked is left for the
+        next run instead of being overwritten with a stale count.
+
+        Returns:
+            Number of counters corrected
+        """
+        users = CustomUser.objects.order_by("id").values_list("id", flat=True)
+        if user_ids is not None:
+            users = users.filter(id__in=user_ids)
+
+        corrected = 0
+        batch = []
+        for user_id in users.iterator(chunk_size=batch_size):
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                corrected += NotificationCounterService._reconcile_batch(batch)
+                batch = []
+        if batch:
+            corrected += NotificationCounterService._reconcile_batch(batch)
+
+        if corrected:
+            logger.warning(f"Corrected {corrected} unread notification counters")
+        return corrected
+
+    @staticmethod
+    def _reconcile_batch(user_ids):
+        # Stored values first: a write committed after this read makes the
+        # conditional update below miss, whether or not the count saw it
+        stored = dict(
+            NotificationCounter.objects.filter(user_id__in=user_ids).values_list(
+                "user_id", "unread"
+            )
+        )
+        actual = dict(
+            Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+            .values("recipient_id")
+            .annotate(unread=Count("id"))
+            .values_list("recipient_id", "unread")
+        )
+
+        corrected = []
+        for user_id in user_ids:
+            count = actual.get(user_id, 0)
+            if user_id not in stored:
+                # Users without notifications get their row on first read
+                if count and NotificationCounter.objects.get_or_create(
+                    user_id=user_id, defaults={"unread": count}
+                )[1]:
+                    corrected.append(user_id)
+            elif stored[user_id] != count:
+                if NotificationCounter.objects.filter(
+                    user_id=user_id, unread=stored[user_id]
+                ).update(unread=count):
+                    corrected.append(user_id)
+
+        cache.delete_many([NotificationCounterService._cache_key(user_id) for user_id in corrected])
+        return len(corrected)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import weakref
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from home.models import Notification, NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+# One in-process dispatcher task per event loop
+_schedulers = weakref.WeakKeyDictionary()
+
+
+class NotificationOutboxService:
+    """
+    Service class draining the notification outbox.
+
+    Saving a notification writes an outbox row in the same transaction, so
+    likes, comments and mentions commit without touching the channel layer.
+    A pass claims due rows in batches of NOTIFICATION_OUTBOX_BATCH_SIZE (at
+    most NOTIFICATION_OUTBOX_MAX_BATCHES per pass), sends the whole batch
+    concurrently and deletes the rows that went out. Failed sends are
+    retried after NOTIFICATION_OUTBOX_RETRY_BASE seconds, doubling after
+    every attempt, and marked failed after NOTIFICATION_OUTBOX_MAX_ATTEMPTS.
+
+    Delivery is at least once: a dispatcher that dies after sending but
+    before deleting leaves rows that are sent again once their claim lapses.
+    A row whose payload was rewritten while it was being sent is kept, and
+    sends its newer payload after NOTIFICATION_PUSH_INTERVAL.
+    """
+
+    @staticmethod
+    def get_batch_size():
+        return getattr(settings, "NOTIFICATION_OUTBOX_BATCH_SIZE", 200)
+
+    @staticmethod
+    def get_max_batches():
+        return getattr(settings, "NOTIFICATION_OUTBOX_MAX_BATCHES", 10)
+
+    @staticmethod
+    def get_max_attempts():
+        return getattr(settings, "NOTIFICATION_OUTBOX_MAX_ATTEMPTS", 8)
+
+    @staticmethod
+    def get_interval():
+        """Seconds between passes of the dispatcher."""
+        return getattr(settings, "NOTIFICATION_OUTBOX_INTERVAL", 1)
+
+    @staticmethod
+    def get_claim_timeout():
+        """How long claimed rows are left to their dispatcher."""
+        return timedelta(seconds=getattr(settings, "NOTIFICATION_OUTBOX_CLAIM_TIMEOUT", 60))
+
+    @staticmethod
+    def get_backoff(attempts):
+        """Delay before the next attempt after ``attempts`` failed attempts."""
+        base = getattr(settings, "NOTIFICATION_OUTBOX_RETRY_BASE", 5)
+        return timedelta(seconds=base * 2 ** (attempts - 1))
+
+    @staticmethod
+    def run_pass(now=None):
+        """
+        Send the due notifications in the outbox, a bounded number of batches.
+
+        Returns:
+            Counter of entries 'sent', 'retried' and 'failed'
+        """
+        stats = Counter()
+        for _ in range(NotificationOutboxService.get_max_batches()):
+            batch = NotificationOutboxService.claim_batch(now or timezone.now())
+            if batch:
+                stats += NotificationOutboxService.send_batch(batch, now or timezone.now())
+            if len(batch) < NotificationOutboxService.get_batch_size():
+                break
+
+        if stats:
+            logger.info(f"Notification outbox pass: {dict(stats)}")
+        return stats
+
+    @staticmethod
+    def claim_batch(now):
+        """
+        Claim the next due entries by pushing their next attempt past the
+        claim timeout, so concurrent dispatchers skip them.
+
+        Returns:
+            List of (id, group, payload, attempts, version) tuples
+        """
+        with transaction.atomic():
+            due = NotificationOutbox.objects.filter(
+                status="pending", next_attempt_at__lte=now
+            ).order_by("id")
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            batch = list(
+                due.values_list("id", "group", "payload", "attempts", "version")[
+                    : NotificationOutboxService.get_batch_size()
+                ]
+            )
+            if batch:
+                NotificationOutbox.objects.filter(
+                    id__in=[entry[0] for entry in batch]
+                ).update(next_attempt_at=now + NotificationOutboxService.get_claim_timeout())
+        return batch
+
+    @staticmethod
+    def send_batch(batch, now):
+        """
+        Send claimed entries and record the outcome.
+
+        Returns:
+            Counter of entries 'sent', 'retried' and 'failed'
+        """
+        results = async_to_sync(NotificationOutboxService._send_all)(batch)
+
+        sent = []
+        stats = Counter()
+        for (entry_id, group, _payload, attempts, version), error in zip(batch, results):
+            if error is None:
+                sent.append((entry_id, version))
+                continue
+
+            attempts += 1
+            update = {"attempts": attempts, "last_error": str(error)[:1000]}
+            if attempts >= NotificationOutboxService.get_max_attempts():
+                update["status"] = "failed"
+                stats["failed"] += 1
+                logger.error(f"Giving up on outbox entry {entry_id} for {group}: {error}")
+            else:
+                update["next_attempt_at"] = now + NotificationOutboxService.get_backoff(attempts)
+                stats["retried"] += 1
+            NotificationOutbox.objects.filter(id=entry_id).update(**update)
+
+        if sent:
+            unchanged = Q()
+            for entry_id, version in sent:
+                unchanged |= Q(id=entry_id, version=version)
+            NotificationOutbox.objects.filter(unchanged).delete()
+            # Rows left were rewritten since the claim: send their newer
+            # payload once the push interval is over
+            NotificationOutbox.objects.filter(id__in=[entry_id for entry_id, _ in sent]).update(
+                next_attempt_at=now + Notification.get_push_interval()
+            )
+        stats["sent"] += len(sent)
+        return stats
+
+    @staticmethod
+    async def _send_all(batch):
+        """
+        Send a batch concurrently, so the channel layer round trips overlap.
+
+        Returns:
+            List with None or the exception raised, per entry
+        """
+        channel_layer = get_channel_layer()
+        results = await asyncio.gather(
+            *(
+                channel_layer.group_send(
+                    group, {"type": "notification_message", "notification": payload}
+                )
+                for _entry_id, group, payload, _attempts, _version in batch
+            ),
+            return_exceptions=True,
+        )
+        return [result if isinstance(result, BaseException) else None for result in results]
+
+    @staticmethod
+    def ensure_scheduler():
+        """
+        Start the in-process dispatcher on the running event loop.
+
+        Only used in single-node mode (NOTIFICATION_OUTBOX_IN_PROCESS); with
+        several server processes run the ``dispatch_notifications`` command
+        instead.
+        """
+        if not getattr(settings, "NOTIFICATION_OUTBOX_IN_PROCESS", True):
+            return
+        loop = asyncio.get_running_loop()
+        task = _schedulers.get(loop)
+        if task is None or task.done():
+            _schedulers[loop] = loop.create_task(NotificationOutboxService._run_forever())
+
+    @staticmethod
+    async def _run_forever():
+        while True:
+            await asyncio.sleep(NotificationOutboxService.get_interval())
+            try:
+                await database_sync_to_async(NotificationOutboxService.run_pass)()
+            except Exception as e:
+                logger.error(f"Error in notification outbox pass: {str(e)}", exc_info=True)
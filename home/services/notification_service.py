@@ -1,4 +1,5 @@
 from home.models import Notification
+from home.services.notification_counter_service import NotificationCounterService
 from home.utils import get_time_ago
 import logging
 
@@ -20,6 +21,8 @@ class NotificationService:
                 "text",
                 "is_read",
                 "created_at",
+                "actor_count",
+                "sample_actors",
                 "sender__username",
                 "sender__first_name",
                 "sender__last_name",
@@ -41,7 +44,11 @@ class NotificationService:
                     "username": notification.sender.username,
                     "first_name": notification.sender.first_name,
                     "last_name": notification.sender.last_name,
-                },
+                }
+                if notification.sender
+                else None,
+                "actor_count": notification.actor_count,
+                "sample_actors": notification.sample_actors,
                 "is_read": notification.is_read,
                 "created_at": notification.created_at.strftime("%Y-%m-%d %H:%M"),
                 "time_ago": get_time_ago(notification.created_at),
@@ -76,11 +83,7 @@ class NotificationService:
     @staticmethod
     def get_unread_count(user):
         """Get count of unread notifications for a user."""
-        return (
-            Notification.objects.filter(recipient=user, is_read=False)
-            .values("id")
-            .count()
-        )
+        return NotificationCounterService.get_unread_count(user.id)
 
     @staticmethod
     def mark_notification_read(user, notification_id=None):
@@ -88,14 +91,11 @@ class NotificationService:
         if notification_id:
             # Mark a specific notification as read
             notification = Notification.objects.get(id=notification_id, recipient=user)
-            notification.is_read = True
-            notification.save()
+            notification.mark_read()
             message = "Notification marked as read"
         else:
             # Mark all notifications as read
-            Notification.objects.filter(recipient=user, is_read=False).update(
-                is_read=True
-            )
+            Notification.mark_all_read(user.id)
             message = "All notifications marked as read"
 
         unread_count = NotificationService.get_unread_count(user)
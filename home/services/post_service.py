@@ -1,7 +1,6 @@
 from django.db import transaction
 from django.core.exceptions import PermissionDenied
 from home.models import Post, Like
-from home.utils import format_content_with_mentions
 from home.forms import PostForm
 import logging
 
@@ -24,13 +23,10 @@ class PostService:
                 post.save()
                 form.save_m2m()
 
-                # Format content with mentions
-                formatted_content = format_content_with_mentions(post.content)
-
                 return {
                     "success": True,
                     "post": post,
-                    "formatted_content": formatted_content,
+                    "formatted_content": post.formatted_content,
                 }
             else:
                 return {"success": False, "errors": form.errors}
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from authentication.models import CustomUser
+from home.models import Notification
+from home.services.image_variant_service import ImageVariantService
+from home.services.mention_service import MentionService
+from home.services.notification_counter_service import NotificationCounterService
+
+
+def post_image_saved(sender, instance, **kwargs):
+    if instance.image:
+        ImageVariantService.enqueue(instance.image.name)
+
+
+def message_image_saved(sender, instance, **kwargs):
+    if instance.file_attachment and instance.file_type == "image":
+        ImageVariantService.enqueue(instance.file_attachment.name)
+
+
+def profile_picture_saved(sender, instance, update_fields=None, **kwargs):
+    # Saves of other fields (e.g. last_login on every login) leave it alone
+    if update_fields is not None and "profile_picture" not in update_fields:
+        return
+    if instance.profile_picture:
+        ImageVariantService.enqueue(instance.profile_picture.name)
+
+
+def connect_image_signals():
+    """Generate variants of every image field that is shown in several sizes."""
+    post_save.connect(post_image_saved, sender="home.Post")
+    post_save.connect(message_image_saved, sender="chatting.Message")
+    post_save.connect(profile_picture_saved, sender="authentication.CustomUser")
+
+
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        NotificationCounterService.adjust(instance.recipient_id, -1)
+
+
+def activity_deleted(sender, instance, **kwargs):
+    # After commit, so entries going with a deleted post are not recounted
+    transaction.on_commit(
+        lambda: Notification.refresh_covering(
+            instance.post_id, sender._meta.model_name, instance.created_at
+        )
+    )
+
+
+def connect_notification_signals():
+    """
+    Keep unread counters right when notifications go with their post or
+    comment, and recount aggregates when a like or comment in them goes.
+    """
+    post_delete.connect(notification_deleted, sender="home.Notification")
+    post_delete.connect(activity_deleted, sender="home.Like")
+    post_delete.connect(activity_deleted, sender="home.Comment")
+
+
+def user_renaming(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and "username" not in update_fields):
+        return
+    old = CustomUser.objects.filter(pk=instance.pk).values_list("username", flat=True).first()
+    if old is not None and old != instance.username:
+        instance._renamed_from = old
+
+
+def user_renamed(sender, instance, **kwargs):
+    old = instance.__dict__.pop("_renamed_from", None)
+    if old is not None:
+        MentionService.schedule_rerender([old, instance.username])
+
+
+def user_deleted(sender, instance, **kwargs):
+    MentionService.schedule_rerender([instance.username])
+
+
+def connect_mention_signals():
+    """Render mentions of renamed or deleted users again."""
+    pre_save.connect(user_renaming, sender="authentication.CustomUser")
+    post_save.connect(user_renamed, sender="authentication.CustomUser")
+    post_delete.connect(user_deleted, sender="authentication.CustomUser")
@@ -355,5 +355,31 @@ function getAuthToken() {
     return '';
 }
 
+/**
+ * Merge notifications from the feed into the panel, newest on top, replacing
+ * entries that were updated since they were shown
+ * @param {Array} notifications - Feed entries, newest first
+ */
+function mergeNotifications(notifications) {
+    const panelBody = document.getElementById('notification-panel-body');
+
+    if (!panelBody) {
+        return;
+    }
+
+    panelBody.querySelector('.no-notifications')?.remove();
+    notifications.slice().reverse().forEach(notification => {
+        panelBody.querySelector(`.notification-item[data-id="${notification.id}"]`)?.remove();
+        panelBody.prepend(createNotificationItem(notification));
+    });
+
+    // Keep the panel as short as a fresh load
+    const items = panelBody.querySelectorAll('.notification-item');
+    for (let i = 5; i < items.length; i++) {
+        items[i].remove();
+    }
+}
+
 // Make loadNotifications available globally
 window.loadNotifications = loadNotifications;
+window.mergeNotifications = mergeNotifications;
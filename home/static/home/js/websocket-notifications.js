@@ -48,6 +48,14 @@ class WebSocketManager {
         this.pollingActive = false;
         this.pollingInterval = null;
 
+        // Position in the notification feed, to backfill what was missed
+        // while disconnected
+        this.feedUrl = '/api/notifications/feed/';
+        this.feedPageSize = 20;
+        this.feedPosition = null;
+        this.feedEtag = null;
+        this.feedFetched = false;
+
         // Heartbeat mechanism to detect connection issues
         this.heartbeatInterval = null;
         this.heartbeatMissed = 0;
@@ -234,6 +242,56 @@ class WebSocketManager {
         if (typeof window.showToast === 'function' && wasReconnecting) {
             window.showToast('Notification connection restored', 'success');
         }
+
+        // Fetch only what arrived while disconnected (or just note where the
+        // feed stands on the first connection)
+        this.backfillNotifications();
+    }
+
+    /**
+     * Fetch the notifications newer than the last known feed position and
+     * merge them into the panel, following the feed until it is caught up
+     */
+    backfillNotifications() {
+        const url = this.feedPosition || `${this.feedUrl}?page_size=${this.feedPageSize}`;
+        const headers = { 'X-Requested-With': 'XMLHttpRequest' };
+        if (this.feedPosition && this.feedEtag) {
+            headers['If-None-Match'] = this.feedEtag;
+        }
+
+        fetch(url, { headers: headers, credentials: 'same-origin', cache: 'no-store' })
+            .then(response => {
+                if (response.status === 304) {
+                    return null;
+                }
+                if (!response.ok) {
+                    throw new Error(`Server returned ${response.status}`);
+                }
+                this.feedEtag = response.headers.get('ETag');
+                return response.json();
+            })
+            .then(data => {
+                if (!data) {
+                    return;
+                }
+                const firstFetch = !this.feedFetched;
+                this.feedFetched = true;
+                this.feedPosition = data.previous || this.feedPosition;
+
+                if (firstFetch || data.results.length === 0) {
+                    return;
+                }
+                if (typeof window.mergeNotifications === 'function') {
+                    window.mergeNotifications(data.results);
+                }
+                // A full page means there may be more to catch up on
+                if (data.results.length >= this.feedPageSize) {
+                    this.backfillNotifications();
+                }
+            })
+            .catch(error => {
+                console.error('Error backfilling notifications:', error);
+            });
     }
 
     /**
@@ -619,9 +677,10 @@ function handleNewNotification(notification) {
         }
     } else {
         // If panel is not open, update the badge count
-        // This is a fallback in case the separate unread_count message doesn't arrive
+        // This is a fallback in case the separate unread_count message doesn't arrive.
+        // Updates of a coalesced entry (actor_count > 1) are not new notifications
         const currentCount = getNotificationCount();
-        if (currentCount !== null) {
+        if (currentCount !== null && !(notification.actor_count > 1)) {
             updateNotificationCount(currentCount + 1);
         }
     }
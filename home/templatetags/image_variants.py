@@ -0,0 +1,26 @@
+from django import template
+
+from home.services.image_variant_service import ImageVariantService
+
+register = template.Library()
+
+
+@register.filter
+def variant_url(image, size="thumb"):
+    """
+    URL of a resized variant of an image field, e.g.
+    ``{{ user.profile_picture|variant_url:"thumb" }}``; the original until
+    the variant is ready.
+    """
+    if not image:
+        return ""
+    described = ImageVariantService.describe(image.name)
+    return described[size]["webp"] if size in described else image.url
+
+
+@register.filter
+def image_placeholder(image):
+    """Data URI of the blurred preview of an image field, or an empty string."""
+    if not image:
+        return ""
+    return ImageVariantService.describe(image.name)["placeholder"]
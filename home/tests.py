@@ -1,7 +1,36 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from PIL import Image
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
 
-from .models import Post, Like, Comment
+from .models import (
+    Post, Like, Comment, ImageSource, Notification, NotificationCounter, NotificationOutbox,
+    StoredBlob, StoredFile
+)
+from .services.image_variant_service import ImageVariantService
+from .services.mention_service import MentionService
+from .services.notification_counter_service import NotificationCounterService
+from .services.notification_outbox_service import NotificationOutboxService
 
 
 class PostModelTest(TestCase):
@@ -110,3 +139,596 @@ class LikeModelTest(TestCase):
 
         # Check that the post has 2 likes
         self.assertEqual(self.post.likes.count(), 2)
+
+
+class DedupStorageTest(TestCase):
+    """Test the deduplicating media storage."""
+
+    def setUp(self):
+        """Point the default storage at an empty media directory."""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_same_content_is_stored_once(self):
+        """Two uploads of one file share a blob but keep their own names."""
+        first = default_storage.save('posts/documents/lecture.pdf', ContentFile(b'%PDF lecture'))
+        second = default_storage.save('chat_files/conversation_1/lecture.pdf', ContentFile(b'%PDF lecture'))
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(StoredFile.objects.count(), 2)
+        self.assertTrue(os.path.samefile(default_storage.path(first), default_storage.path(second)))
+        with default_storage.open(second) as f:
+            self.assertEqual(f.read(), b'%PDF lecture')
+
+        # Deleting one name leaves the other intact
+        default_storage.delete(first)
+        self.assertFalse(default_storage.exists(first))
+        self.assertTrue(default_storage.exists(second))
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+
+    def test_profile_picture_can_be_replaced(self):
+        """Uploading a second profile picture reuses the name and releases the first."""
+        user = get_user_model().objects.create_user(username='pictured', password='testpassword123')
+        self.client.login(username='pictured', password='testpassword123')
+        url = reverse('api-profile-picture-upload')
+        for color in ('red', 'blue'):
+            image = io.BytesIO()
+            Image.new('RGB', (20, 20), color).save(image, format='PNG')
+            upload = SimpleUploadedFile('me.png', image.getvalue(), content_type='image/png')
+            response = self.client.post(url, {'profile_picture': upload})
+            self.assertEqual(response.status_code, 200)
+
+        user.refresh_from_db()
+        self.assertEqual(StoredFile.objects.get().name, user.profile_picture.name)
+        self.assertEqual(
+            sorted(StoredBlob.objects.values_list('ref_count', flat=True)), [0, 1]
+        )
+
+    def test_leftover_row_does_not_block_the_name(self):
+        """A name removed behind the storage's back can be saved again."""
+        name = default_storage.save('profile_pictures/a.png', ContentFile(b'old'))
+        os.remove(default_storage.path(name))
+
+        self.assertEqual(default_storage.save(name, ContentFile(b'new')), name)
+        self.assertEqual(StoredFile.objects.get().blob.size, 3)
+        self.assertEqual(StoredBlob.objects.get(ref_count=0).files.count(), 0)
+
+    def test_garbage_collection_removes_unreferenced_blobs(self):
+        """Blobs are only deleted once no name refers to them."""
+        kept = default_storage.save('profile_pictures/a.png', ContentFile(b'kept'))
+        dropped = default_storage.save('profile_pictures/b.png', ContentFile(b'dropped'))
+        default_storage.delete(dropped)
+
+        out = StringIO()
+        call_command('gc_media_blobs', '--min-age-minutes', '-1', stdout=out)
+        self.assertIn('Deleted 1 unreferenced blobs, freeing 7 bytes', out.getvalue())
+        self.assertEqual(list(StoredBlob.objects.values_list('size', flat=True)), [4])
+        with default_storage.open(kept) as f:
+            self.assertEqual(f.read(), b'kept')
+
+    def test_existing_media_is_deduplicated(self):
+        """Files written before the storage was used are reported and linked."""
+        for name in ('subject_materials/a.pdf', 'posts/documents/b.pdf', 'posts/images/c.png'):
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'same' * 100 if name.endswith('.pdf') else b'other')
+
+        out = StringIO()
+        call_command('dedupe_media', '--report-only', stdout=out)
+        self.assertIn('3 files (805 bytes), 2 distinct contents', out.getvalue())
+        self.assertIn('Duplicates take 400 bytes', out.getvalue())
+        self.assertFalse(StoredFile.objects.exists())
+
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('Indexed 3 files, saving 400 bytes', out.getvalue())
+        self.assertTrue(os.path.samefile(
+            default_storage.path('subject_materials/a.pdf'), default_storage.path('posts/documents/b.pdf')
+        ))
+
+
+class ImageVariantTest(TestCase):
+    """Test the image variant pipeline."""
+
+    def setUp(self):
+        """Create a post with a 2000x1000 photo in an empty media directory."""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), (200, 30, 30)).save(buffer, 'JPEG')
+        self.user = get_user_model().objects.create_user(username='photographer', password='testpassword123')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.post = Post.objects.create(
+                user=self.user, content='Sunset', image=ContentFile(buffer.getvalue(), name='sunset.jpg')
+            )
+        self.callbacks = callbacks
+
+    def test_original_is_served_while_pending(self):
+        """Saving an image queues it and every size falls back to the original."""
+        self.assertEqual(len(self.callbacks), 1)
+        described = ImageVariantService.describe(self.post.image.name)
+        self.assertEqual(described['status'], 'pending')
+        self.assertEqual(described['thumb']['webp'], self.post.image.url)
+
+    def test_variants_are_generated(self):
+        """Each size is stored as WebP and JPEG without upscaling, plus a placeholder."""
+        source = ImageVariantService.process(self.post.image.name)
+        self.assertEqual(source.status, 'ready')
+        self.assertEqual((source.width, source.height), (2000, 1000))
+        self.assertTrue(source.placeholder.startswith('data:image/webp;base64,'))
+
+        variants = {(v.size, v.format): v for v in source.variants.all()}
+        self.assertEqual(len(variants), 6)
+        self.assertEqual((variants['thumb', 'webp'].width, variants['thumb', 'webp'].height), (96, 48))
+        self.assertEqual(variants['large', 'jpeg'].width, 1280)
+        with default_storage.open(variants['medium', 'webp'].name) as f:
+            self.assertEqual(Image.open(f).size, (480, 240))
+
+        described = ImageVariantService.describe(self.post.image.name)
+        self.assertEqual(described['thumb']['webp'], default_storage.url(variants['thumb', 'webp'].name))
+        self.assertEqual(ImageSource.objects.get().status, 'ready')
+
+    def test_replaced_image_is_processed_again(self):
+        """A new file under the same name gets new variants."""
+        name = self.post.image.name
+        ImageVariantService.process(name)
+        self.assertEqual(ImageVariantService.describe(name)['width'], 2000)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 600), (30, 30, 200)).save(buffer, 'JPEG')
+        default_storage.delete(name)
+        self.assertEqual(default_storage.save(name, ContentFile(buffer.getvalue())), name)
+        ImageVariantService.enqueue(name)
+        self.assertEqual(ImageVariantService.describe(name)['status'], 'pending')
+
+        ImageVariantService.process(name)
+        described = ImageVariantService.describe(name)
+        self.assertEqual((described['width'], described['height']), (300, 600))
+
+    def test_unchanged_images_are_not_queued_again(self):
+        """Saving a user's other fields leaves the profile picture alone."""
+        ImageVariantService.process(self.post.image.name)
+        self.user.profile_picture = self.post.image.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.save()
+        self.assertEqual(len(callbacks), 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.save(update_fields=['last_login'])
+            ImageVariantService.enqueue(self.post.image.name)
+        self.assertEqual(len(callbacks), 0)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationOutboxTest(TestCase):
+    """Test the notification outbox and its dispatcher."""
+
+    def setUp(self):
+        """Create a post and a socket listening for its author's notifications."""
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='testpassword123')
+        self.fan = User.objects.create_user(username='fan', password='testpassword123')
+        self.post = Post.objects.create(user=self.author, content='My first post')
+        self.layer = get_channel_layer()
+        async_to_sync(self.layer.group_add)(f'notifications_{self.author.id}', 'test.socket')
+
+    def receive(self):
+        async def receive_or_none():
+            try:
+                return await asyncio.wait_for(self.layer.receive('test.socket'), 0.05)
+            except asyncio.TimeoutError:
+                return None
+        return async_to_sync(receive_or_none)()
+
+    def test_like_is_queued_and_dispatched(self):
+        """Liking does no channel layer I/O; the dispatcher sends it later."""
+        Like.objects.create(user=self.fan, post=self.post)
+        notification = Notification.objects.get()
+        self.assertEqual(NotificationOutbox.objects.get().notification, notification)
+        self.assertIsNone(self.receive())
+
+        stats = NotificationOutboxService.run_pass()
+        self.assertEqual(stats['sent'], 1)
+        event = self.receive()
+        self.assertEqual(event['type'], 'notification_message')
+        self.assertEqual(event['notification']['id'], notification.id)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    @override_settings(NOTIFICATION_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_sends_are_retried_then_given_up(self):
+        """A send that keeps failing backs off and is eventually marked failed."""
+        Like.objects.create(user=self.fan, post=self.post)
+        # Invalid group names make the channel layer raise
+        NotificationOutbox.objects.update(group='not a valid group!')
+
+        self.assertEqual(NotificationOutboxService.run_pass()['retried'], 1)
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+        self.assertEqual(NotificationOutboxService.run_pass(), {})
+
+        later = entry.next_attempt_at + timedelta(seconds=1)
+        self.assertEqual(NotificationOutboxService.run_pass(now=later)['failed'], 1)
+        self.assertEqual(NotificationOutbox.objects.get().status, 'failed')
+
+    def test_payload_rewritten_while_sending_is_kept(self):
+        """An entry updated after it was claimed is not deleted with the old payload."""
+        User = get_user_model()
+        Like.objects.create(user=self.fan, post=self.post)
+        NotificationOutboxService.run_pass()
+        Like.objects.create(
+            user=User.objects.create_user(username='fan2', password='testpassword123'),
+            post=self.post,
+        )
+
+        now = timezone.now() + timedelta(minutes=1)
+        batch = NotificationOutboxService.claim_batch(now)
+        self.assertEqual(len(batch), 1)
+        Like.objects.create(
+            user=User.objects.create_user(username='fan3', password='testpassword123'),
+            post=self.post,
+        )
+        self.assertEqual(NotificationOutboxService.send_batch(batch, now)['sent'], 1)
+
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual(entry.payload['actor_count'], 3)
+        self.assertGreater(entry.next_attempt_at, now)
+
+
+class NotificationCoalescingTest(TestCase):
+    """Test folding likes and comments on a post into one notification."""
+
+    def setUp(self):
+        """Create a post and a few users to react to it."""
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='testpassword123')
+        self.fans = [
+            User.objects.create_user(username=f'fan{i}', password='testpassword123')
+            for i in range(5)
+        ]
+        self.post = Post.objects.create(user=self.author, content='My first post')
+
+    def test_likes_fold_into_one_entry(self):
+        """Likes on a post make one entry counting every actor."""
+        Like.objects.create(user=self.fans[0], post=self.post)
+        NotificationOutboxService.run_pass()
+        for fan in self.fans[1:]:
+            Like.objects.create(user=fan, post=self.post)
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 5)
+        self.assertEqual(notification.text, 'fan4 and 4 others liked your post')
+        self.assertEqual(
+            [actor['username'] for actor in notification.sample_actors],
+            ['fan4', 'fan3', 'fan2'],
+        )
+        # The first like went out at once, the rest share one deferred push
+        deferred = NotificationOutbox.objects.get()
+        self.assertEqual(deferred.payload['actor_count'], 5)
+        self.assertGreater(deferred.next_attempt_at, timezone.now())
+
+    def test_repeat_commenter_is_counted_once(self):
+        """Several comments by one user count as one actor."""
+        Comment.objects.create(user=self.fans[0], post=self.post, content='Nice')
+        Comment.objects.create(user=self.fans[1], post=self.post, content='Great')
+        latest = Comment.objects.create(user=self.fans[0], post=self.post, content='Again')
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.text, 'fan0 and fan1 commented on your post')
+        self.assertEqual(notification.comment, latest)
+
+    def test_read_or_expired_entries_are_not_reused(self):
+        """A new entry starts once the old one is read or its window closed."""
+        Like.objects.create(user=self.fans[0], post=self.post)
+        Notification.objects.update(is_read=True)
+        Like.objects.create(user=self.fans[1], post=self.post)
+        Notification.objects.filter(is_read=False).update(
+            window_start=timezone.now() - timedelta(hours=2)
+        )
+        Like.objects.create(user=self.fans[2], post=self.post)
+
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('actor_count', flat=True)), [1, 1, 1]
+        )
+
+    def test_deleting_latest_comment_or_actor_recounts_entry(self):
+        """Deleting the latest comment or actor keeps the entry, recounted."""
+        for fan, content in zip(self.fans[:3], ('Nice', 'Great', 'Wow')):
+            Comment.objects.create(user=fan, post=self.post, content=content)
+        self.assertEqual(Notification.objects.get().actor_count, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.get(content='Wow').delete()
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.text, 'fan1 and fan0 commented on your post')
+        self.assertEqual(notification.comment.content, 'Great')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fans[1].delete()
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 1)
+        self.assertEqual(notification.text, 'fan0 commented on your post')
+        self.assertEqual(notification.sender, self.fans[0])
+        self.assertEqual(notification.comment.content, 'Nice')
+        self.assertFalse(notification.is_read)
+
+
+class NotificationCounterTest(TestCase):
+    """Test the denormalized unread notification counters."""
+
+    def setUp(self):
+        """Create a post with a few likes and comments on it."""
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='testpassword123')
+        self.fan = User.objects.create_user(username='fan', password='testpassword123')
+        self.posts = [
+            Post.objects.create(user=self.author, content=f'Post {i}') for i in range(3)
+        ]
+        for post in self.posts:
+            Like.objects.create(user=self.fan, post=post)
+        cache.clear()
+
+    def unread(self):
+        return NotificationCounterService.get_unread_count(self.author.id)
+
+    def test_counter_follows_read_state(self):
+        """Creating, reading and deleting notifications adjust the counter."""
+        self.assertEqual(self.unread(), 3)
+        self.assertEqual(NotificationCounter.objects.get(user=self.author).unread, 3)
+
+        notification = Notification.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(notification.mark_read())
+            self.assertFalse(notification.mark_read())
+        self.assertEqual(self.unread(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.filter(is_read=False).first().post.delete()
+        self.assertEqual(self.unread(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Notification.mark_all_read(self.author.id), 1)
+        self.assertEqual(self.unread(), 0)
+
+    def test_count_endpoint_reads_counter(self):
+        """The badge endpoint answers from the counter without counting rows."""
+        self.client.login(username='author', password='testpassword123')
+        self.unread()
+        with self.assertNumQueries(2):  # session and user lookups
+            response = self.client.get(reverse('home:notification_count'))
+        self.assertEqual(response.json()['unread_count'], 3)
+
+    def test_reconcile_fixes_drift(self):
+        """Reconciliation corrects counters changed behind the service's back."""
+        Notification.objects.filter(recipient=self.author).update(is_read=True)
+        call_command('reconcile_notification_counters', stdout=StringIO())
+        self.assertEqual(NotificationCounter.objects.get(user=self.author).unread, 0)
+        self.assertEqual(self.unread(), 0)
+        self.assertEqual(NotificationCounterService.reconcile(), 0)
+
+
+class NotificationCounterConcurrencyTest(TransactionTestCase):
+    """Test the unread counters under concurrent writers."""
+
+    def test_concurrent_writers_keep_counter_exact(self):
+        """Threads liking and marking read at once leave the exact count."""
+        User = get_user_model()
+        author = User.objects.create_user(username='author', password='testpassword123')
+        fans = [
+            User.objects.create_user(username=f'fan{i}', password='testpassword123')
+            for i in range(4)
+        ]
+        posts = [Post.objects.create(user=author, content=f'Post {i}') for i in range(40)]
+        NotificationCounterService.recount(author.id)
+
+        def run(operation):
+            # SQLite's in-memory test database locks whole tables; retry the
+            # transaction the way a busy database would be waited on
+            while True:
+                try:
+                    with transaction.atomic():
+                        return operation()
+                except OperationalError:
+                    time.sleep(0.001)
+
+        def like_all(fan):
+            try:
+                for post in posts:
+                    run(lambda: Like.objects.create(user=fan, post=post))
+            finally:
+                connection.close()
+
+        def mark_read():
+            try:
+                for _ in range(20):
+                    run(lambda: Notification.mark_all_read(author.id))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=like_all, args=(fan,)) for fan in fans]
+        threads.append(threading.Thread(target=mark_read))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Like.objects.count(), len(fans) * len(posts))
+        actual = Notification.objects.filter(recipient=author, is_read=False).count()
+        self.assertEqual(NotificationCounter.objects.get(user=author).unread, actual)
+        self.assertEqual(NotificationCounterService.reconcile(), 0)
+
+
+class NotificationFeedTest(TestCase):
+    """Test the keyset-paginated notification feed."""
+
+    def setUp(self):
+        """Create notifications on several posts and log in their recipient."""
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='testpassword123')
+        self.fan = User.objects.create_user(username='fan', password='testpassword123')
+        self.posts = [
+            Post.objects.create(user=self.author, content=f'Post {i}') for i in range(5)
+        ]
+        for post in self.posts:
+            Like.objects.create(user=self.fan, post=post)
+        self.ids = list(
+            Notification.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.client.login(username='author', password='testpassword123')
+        self.url = reverse('api-notification-feed')
+
+    def test_until_pages_back_without_counting(self):
+        """Following next links walks the whole feed, newest first."""
+        seen = []
+        url = f'{self.url}?page_size=2'
+        while url:
+            with self.assertNumQueries(3):  # session, user, page
+                data = self.client.get(url).json()
+            seen += [entry['id'] for entry in data['results']]
+            url = data['next']
+        self.assertEqual(seen, self.ids)
+
+        data = self.client.get(self.url, {'until_id': self.ids[2]}).json()
+        self.assertEqual([entry['id'] for entry in data['results']], self.ids[3:])
+
+    def test_since_returns_newer_and_coalesced_entries(self):
+        """Polling from a position returns new entries and updated aggregates."""
+        data = self.client.get(self.url, {'since_id': self.ids[1]}).json()
+        self.assertEqual([entry['id'] for entry in data['results']], self.ids[:1])
+        previous = data['previous']
+
+        self.assertEqual(self.client.get(previous).json()['results'], [])
+        other = get_user_model().objects.create_user(username='other', password='testpassword123')
+        Like.objects.create(user=other, post=self.posts[0])
+
+        results = self.client.get(previous).json()['results']
+        self.assertEqual([entry['id'] for entry in results], [self.ids[-1]])
+        self.assertEqual(results[0]['actor_count'], 2)
+
+    def test_unchanged_page_is_not_modified(self):
+        """A matching If-None-Match gets 304 until the page changes."""
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+
+        Notification.objects.get(id=self.ids[0]).mark_read()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['results'][0]['is_read'])
+
+
+class MentionNotificationTest(TestCase):
+    """Test batched processing of @mentions."""
+
+    def setUp(self):
+        """Create an author and a study group to mention."""
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='testpassword123')
+        self.group = User.objects.bulk_create(
+            [User(username=f'Student{i}', email=f'student{i}@example.com') for i in range(40)]
+        )
+        self.content = ' '.join(f'@student{i}' for i in range(40)) + ' @student0 @author @nobody'
+
+    def test_mentions_cost_constant_queries(self):
+        """A post mentioning 40 users notifies each once, in a fixed number of queries."""
+        with self.assertNumQueries(9):
+            post = Post.objects.create(user=self.author, content=self.content)
+
+        notifications = Notification.objects.filter(notification_type='mention', post=post)
+        self.assertEqual(
+            sorted(notifications.values_list('recipient__username', flat=True)),
+            sorted(user.username for user in self.group),
+        )
+        self.assertEqual(NotificationOutbox.objects.count(), 40)
+        self.assertEqual(
+            NotificationOutbox.objects.first().payload['text'], 'author mentioned you in a post'
+        )
+        self.assertEqual(NotificationCounterService.get_unread_count(self.group[0].id), 1)
+
+    def test_comment_mentions(self):
+        """Mentions in comments link to the comment and count as unread."""
+        post = Post.objects.create(user=self.author, content='Study session tonight')
+        NotificationCounterService.recount(self.group[1].id)
+        comment = Comment.objects.create(user=self.group[0], post=post, content='@Student1 join us')
+
+        notification = Notification.objects.get(notification_type='mention')
+        self.assertEqual(notification.recipient, self.group[1])
+        self.assertEqual(notification.comment, comment)
+        self.assertEqual(NotificationCounter.objects.get(user=self.group[1]).unread, 1)
+
+
+class MentionRenderingTest(TestCase):
+    """Test the stored rendering of content with mentions."""
+
+    def setUp(self):
+        """Create an author and a user to mention."""
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='testpassword123')
+        self.friend = User.objects.create_user(username='Friend', password='testpassword123')
+
+    def test_content_is_rendered_on_save(self):
+        """Saving stores escaped HTML with linked mentions and their user IDs."""
+        post = Post.objects.create(user=self.author, content='<b>Hi</b> @friend and @nobody')
+        self.assertEqual(
+            post.formatted_content,
+            '&lt;b&gt;Hi&lt;/b&gt; <a href="#" class="mention" data-username="Friend">@Friend</a>'
+            ' and @nobody',
+        )
+        self.assertEqual(post.mentioned_user_ids, [self.friend.id])
+
+        post.content = 'Bye @author'
+        post.save(update_fields=['content'])
+        post.refresh_from_db()
+        self.assertIn('data-username="author"', post.formatted_content)
+        self.assertEqual(post.mentioned_user_ids, [self.author.id])
+
+    def test_api_reads_stored_rendering(self):
+        """Listing posts does no user lookups for their mentions."""
+        for i in range(5):
+            post = Post.objects.create(user=self.author, content=f'Post {i} with @Friend')
+            Comment.objects.create(user=self.friend, post=post, content='Thanks @author')
+        self.client.login(username='author', password='testpassword123')
+        cache.clear()
+
+        response = self.client.get(reverse('api-post-detail', args=[post.id]))
+        self.assertIn('class="mention"', response.json()['formatted_content'])
+        self.assertIn('class="mention"', response.json()['comments'][0]['formatted_content'])
+
+        Post.objects.update(formatted_content='stored')
+        cache.clear()
+        response = self.client.get(reverse('api-post-detail', args=[post.id]))
+        self.assertEqual(response.json()['formatted_content'], 'stored')
+
+    def test_rename_renders_mentions_again(self):
+        """Renaming a user schedules and performs a new rendering."""
+        post = Post.objects.create(user=self.author, content='Ask @Friend or @pal')
+        comment = Comment.objects.create(user=self.author, post=post, content='cc @friend')
+
+        self.friend.username = 'pal'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.friend.save()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(MentionService.rerender(['Friend', 'pal']), 2)
+
+        post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(
+            post.formatted_content,
+            'Ask @Friend or <a href="#" class="mention" data-username="pal">@pal</a>',
+        )
+        self.assertEqual(comment.formatted_content, 'cc @friend')
+        self.assertEqual(comment.mentioned_user_ids, [])
+        self.assertEqual(MentionService.rerender(), 0)
@@ -2,6 +2,8 @@ import logging
 import re
 import random
 from datetime import datetime, timezone
+from django.db.models.functions import Lower
+from django.utils.html import escape
 from authentication.models import CustomUser
 
 logger = logging.getLogger(__name__)
@@ -55,67 +57,74 @@ def get_time_ago(timestamp):
 def extract_mentions(text):
     """
     Extract @username mentions from text and return a list of valid user objects
+
+    All usernames are resolved in one query; each user is returned once, in
+    the order of their first mention.
     """
     if not text:
         return []
 
     # Find all @username patterns - match word characters after @
     pattern = r"@([a-zA-Z0-9_]+)"
-    usernames = re.findall(pattern, text)
+    usernames = list(dict.fromkeys(name.lower() for name in re.findall(pattern, text)))
 
     # Debug information
     logger.debug(f"Found usernames in text: {usernames}")
 
-    # Get valid users from the database
-    if usernames:
-        users = []
-        for username in usernames:
-            try:
-                # Try to find each user individually with case-insensitive matching
-                user = CustomUser.objects.get(username__iexact=username)
-                users.append(user)
-                logger.debug(f"Found user: {user.username}")
-            except CustomUser.DoesNotExist:
-                logger.debug(f"User not found: {username}")
-            except CustomUser.MultipleObjectsReturned:
-                # In case multiple users match (shouldn't happen with iexact)
-                logger.debug(f"Multiple users found for: {username}")
-                matching_users = CustomUser.objects.filter(username__iexact=username)
-                users.extend(list(matching_users))
-
-        # Return list of user objects
-        return users
-
-    return []
+    if not usernames:
+        return []
 
+    # Case-insensitive matching of every username at once
+    users_by_name = {}
+    for user in CustomUser.objects.annotate(username_lower=Lower("username")).filter(
+        username_lower__in=usernames
+    ):
+        users_by_name.setdefault(user.username_lower, []).append(user)
 
-def format_content_with_mentions(content):
+    missing = [name for name in usernames if name not in users_by_name]
+    if missing:
+        logger.debug(f"Users not found: {missing}")
+    return [user for name in usernames for user in users_by_name.get(name, [])]
+
+
+def render_mentions(content):
     """
-    Format content by converting @username mentions to HTML links
+    Render content as HTML, escaped, with @username mentions linked.
+
+    All mentioned users are looked up in one query.
+
+    Returns:
+        (html, users) where users are the mentioned users, as from
+        extract_mentions
     """
     if not content:
-        return content
+        return "", []
 
-    # Replace @username with HTML link - match word characters after @
-    pattern = r"@([a-zA-Z0-9_]+)"
+    users = extract_mentions(content)
+    users_by_name = {user.username.lower(): user for user in users}
 
     def replace_mention(match):
-        username = match.group(1)
-        # Check if user exists
-        try:
-            # Debug information
-            logger.debug(f"Formatting mention for username: {username}")
-            user = CustomUser.objects.get(username__iexact=username)
-            logger.debug(f"Found user for formatting: {user.username}")
-            return f'<a href="#" class="mention" data-username="{user.username}">@{user.username}</a>'
-        except CustomUser.DoesNotExist:
-            logger.debug(f"User not found for formatting: {username}")
-            return f"@{username}"
-        except Exception as e:
-            logger.error(f"Error formatting mention for {username}: {str(e)}")
-            return f"@{username}"
-
-    return re.sub(pattern, replace_mention, content)
+        user = users_by_name.get(match.group(1).lower())
+        if user is None:
+            return match.group(0)
+        username = escape(user.username)
+        return f'<a href="#" class="mention" data-username="{username}">@{username}</a>'
+
+    # Mentions are plain word characters, which escaping leaves alone
+    pattern = r"@([a-zA-Z0-9_]+)"
+    return re.sub(pattern, replace_mention, escape(content)), users
+
+
+def format_content_with_mentions(content):
+    """
+    Format content by converting @username mentions to HTML links
+
+    Posts and comments store this rendering in ``formatted_content`` when
+    saved; use that instead of formatting them again.
+    """
+    if not content:
+        return content
+    return render_mentions(content)[0]
 
 
 def search_users(query, exclude_user=None, limit=10):
@@ -211,7 +211,10 @@ class QuerySetCacheMixin:
 
 def rate_limit(key_pattern, limit=10, period=60, raise_exception=True):
     """
-    Rate limiting decorator that uses Redis cache.
+    Rate limiting decorator backed by the shared token-bucket ``RateLimiter``.
+
+    Uses an atomic Redis script when django-redis is the default cache and an
+    in-process bucket otherwise, so it also works with the locmem cache.
     
     Args:
         key_pattern: Pattern for the rate limit key (e.g., 'rate_limit:{user_id}:{action}')
@@ -224,32 +227,27 @@ def rate_limit(key_pattern, limit=10, period=60, raise_exception=True):
         def send_message(request):
             # Function logic here
     """
+    from home.utils_ratelimit import RateLimiter
+
     def decorator(view_func):
+        limiter = RateLimiter(view_func.__name__, limit, period)
+
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
             # Format the key with request attributes
             key = key_pattern.format(request=request, **kwargs)
             
-            # Check if rate is limited
-            current = cache.get(key, 0)
-            
-            if current >= limit:
+            # Consume a token atomically
+            if not limiter.hit(key):
                 if raise_exception:
                     from django.core.exceptions import PermissionDenied
                     raise PermissionDenied("Rate limit exceeded")
                 return False
             
-            # Increment the counter
-            pipe = cache.client.pipeline()
-            pipe.incr(key)
-            # If this is the first request, set an expiration
-            if current == 0:
-                pipe.expire(key, period)
-            pipe.execute()
-            
             # Call the view function
             return view_func(request, *args, **kwargs)
         
+        _wrapped_view.limiter = limiter
         return _wrapped_view
     
     return decorator
@@ -0,0 +1,78 @@
+import json
+from urllib.parse import parse_qs
+
+import msgpack
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Sec-WebSocket-Protocol value a client offers to get MessagePack frames
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+class FrameDecodeError(ValueError):
+    """An incoming frame is neither valid JSON nor valid MessagePack."""
+
+
+class FrameCodec:
+    """
+    Encoding of the frames of one WebSocket connection.
+
+    JSON text frames are the default. A client gets binary MessagePack
+    frames by offering the ``msgpack`` subprotocol (``Sec-WebSocket-Protocol``)
+    or by connecting with ``?encoding=msgpack``. Incoming frames are decoded
+    by their frame type, so a MessagePack client may still send JSON text.
+    """
+
+    def __init__(self, encoding=JSON, subprotocol=None):
+        self.encoding = encoding
+        # Subprotocol to echo back when accepting the connection, if any
+        self.subprotocol = subprotocol
+
+    @classmethod
+    def negotiate(cls, scope):
+        """
+        Pick the encoding requested in a WebSocket connection scope.
+
+        Args:
+            scope: The ASGI connection scope
+
+        Returns:
+            A FrameCodec for the connection
+        """
+        if MSGPACK_SUBPROTOCOL in scope.get("subprotocols", ()):
+            return cls(MSGPACK, subprotocol=MSGPACK_SUBPROTOCOL)
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if query.get("encoding", [JSON])[-1] == MSGPACK:
+            return cls(MSGPACK)
+        return cls()
+
+    @property
+    def is_binary(self):
+        return self.encoding == MSGPACK
+
+    def encode(self, payload):
+        """
+        Encode a payload as keyword arguments for ``WebsocketConsumer.send``.
+
+        Returns:
+            {"bytes_data": ...} for MessagePack, {"text_data": ...} for JSON
+        """
+        if self.is_binary:
+            return {"bytes_data": msgpack.packb(payload, use_bin_type=True)}
+        return {"text_data": json.dumps(payload)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        """
+        Decode an incoming frame.
+
+        Raises:
+            FrameDecodeError: If the frame is not valid JSON or MessagePack
+        """
+        try:
+            if bytes_data is not None:
+                return msgpack.unpackb(bytes_data, raw=False)
+            return json.loads(text_data)
+        except (ValueError, TypeError) as e:
+            raise FrameDecodeError(str(e)) from e
@@ -0,0 +1,198 @@
+import threading
+import time
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# GCRA (generic cell rate algorithm) evaluated atomically inside Redis.
+# KEYS[1] holds the theoretical arrival time (TAT) of the next request,
+# KEYS[2] is a hash of allowed/denied counters for the limiter.
+# ARGV[1] is the emission interval and ARGV[2] the burst tolerance, in ms.
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + emission
+if new_tat - now > tolerance then
+    redis.call('HINCRBY', KEYS[2], 'denied', 1)
+    return 0
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+redis.call('HINCRBY', KEYS[2], 'allowed', 1)
+return 1
+"""
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter shared by WebSocket consumers and HTTP views.
+
+    Each key may make ``limit`` requests in a burst, refilled evenly over
+    ``period`` seconds. With django-redis as the default cache the check is a
+    single atomic Lua script; otherwise (locmem/SQLite development setup) an
+    in-process, lock-protected implementation of the same algorithm is used.
+
+    ``limit`` and ``period`` may be setting names, which are read on each call
+    so they can be changed with ``override_settings``.
+
+    Example:
+        limiter = RateLimiter("chat_message", limit=10, period=60)
+        if not await limiter.ahit(user.id):
+            ...  # deny
+    """
+
+    _script = None
+
+    def __init__(self, name, limit, period):
+        self.name = name
+        self._limit = limit
+        self._period = period
+        self._lock = threading.Lock()
+        self._local_tats = {}
+        self._local_stats = {"allowed": 0, "denied": 0}
+
+    @property
+    def limit(self):
+        if isinstance(self._limit, str):
+            return getattr(settings, self._limit)
+        return self._limit
+
+    @property
+    def period(self):
+        if isinstance(self._period, str):
+            return getattr(settings, self._period)
+        return self._period
+
+    @staticmethod
+    def get_redis_client():
+        """Return the raw Redis client behind the default cache, if any."""
+        client = getattr(cache, "client", None)
+        if client is None or not hasattr(client, "get_client"):
+            return None
+        return client.get_client(write=True)
+
+    @property
+    def stats_key(self):
+        return f"ratelimit_stats:{self.name}"
+
+    def _bucket_key(self, key):
+        return f"ratelimit:{self.name}:{key}"
+
+    def hit(self, key):
+        """
+        Consume one token for ``key``.
+
+        Returns:
+            True if the request is allowed, False if it should be denied
+        """
+        redis_client = self.get_redis_client()
+        if redis_client is not None:
+            try:
+                return self._hit_redis(redis_client, key)
+            except Exception as e:
+                # Fall back to the local bucket rather than failing open
+                logger.error(f"Redis rate limiter error: {str(e)}", exc_info=True)
+        return self._hit_local(key)
+
+    async def ahit(self, key):
+        """Async version of ``hit`` that never blocks the event loop on Redis."""
+        if self.get_redis_client() is None:
+            # The in-process path does no I/O, so it is safe to call inline
+            return self._hit_local(key)
+        return await sync_to_async(self.hit, thread_sensitive=False)(key)
+
+    def _hit_redis(self, redis_client, key):
+        if RateLimiter._script is None:
+            RateLimiter._script = redis_client.register_script(GCRA_SCRIPT)
+        emission_ms = self.period * 1000 / self.limit
+        tolerance_ms = emission_ms * self.limit
+        allowed = RateLimiter._script(
+            keys=[self._bucket_key(key), self.stats_key],
+            args=[emission_ms, tolerance_ms],
+            client=redis_client,
+        )
+        return bool(allowed)
+
+    def _hit_local(self, key):
+        emission = self.period / self.limit
+        tolerance = emission * self.limit
+        now = time.monotonic()
+
+        with self._lock:
+            tat = max(self._local_tats.get(key, now), now)
+            new_tat = tat + emission
+            if new_tat - now > tolerance:
+                self._local_stats["denied"] += 1
+                return False
+
+            self._local_tats[key] = new_tat
+            self._local_stats["allowed"] += 1
+
+            # Drop buckets that have refilled completely
+            if len(self._local_tats) > 10000:
+                self._local_tats = {
+                    k: v for k, v in self._local_tats.items() if v > now
+                }
+            return True
+
+    def stats(self):
+        """Return the allowed/denied counters for this limiter."""
+        redis_client = self.get_redis_client()
+        if redis_client is not None:
+            try:
+                counters = redis_client.hgetall(self.stats_key)
+                return {
+                    "allowed": int(counters.get(b"allowed", 0)),
+                    "denied": int(counters.get(b"denied", 0)),
+                }
+            except Exception as e:
+                logger.error(f"Error reading rate limiter stats: {str(e)}")
+        with self._lock:
+            return dict(self._local_stats)
+
+    def reset(self):
+        """Forget all local buckets and counters (used by tests)."""
+        with self._lock:
+            self._local_tats.clear()
+            self._local_stats = {"allowed": 0, "denied": 0}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle backed by a ``RateLimiter``, keyed by user (or client IP)."""
+
+    limiter = None
+
+    def allow_request(self, request, view):
+        if request.user and request.user.is_authenticated:
+            key = request.user.id
+        else:
+            key = self.get_ident(request)
+        return self.limiter.hit(key)
+
+    def wait(self):
+        # Time for one token to be refilled
+        return self.limiter.period / self.limiter.limit
+
+
+# Budget shared by chat messages sent over the WebSocket and the REST API
+chat_message_limiter = RateLimiter(
+    "chat_message", limit="CHAT_MESSAGE_RATE_LIMIT", period="CHAT_MESSAGE_RATE_PERIOD"
+)
+
+
+class ChatMessageThrottle(TokenBucketThrottle):
+    limiter = chat_message_limiter
+
+
+# Registry of limiters whose counters are exposed to staff
+RATE_LIMITERS = {chat_message_limiter.name: chat_message_limiter}
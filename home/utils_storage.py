@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupFileSystemStorage(FileSystemStorage):
+    """
+    File system storage that keeps each distinct file content once.
+
+    Uploads are hashed while they are streamed to a temporary file, which
+    becomes the blob ``<MEDIA_BLOB_DIR>/<aa>/<bb>/<digest><ext>`` unless that
+    content is already stored. The name the model field gets (from its
+    ``upload_to``) is a hard link to the blob, so names stay stable, URLs
+    and ``path()`` work as before and the web server serves the media
+    directory unchanged, while duplicates take no extra space.
+
+    ``StoredFile`` maps every name to its ``StoredBlob``, whose ``ref_count``
+    tracks the names sharing it. Deleting a name only unlinks it; blobs no
+    longer referenced are removed by ``manage.py gc_media_blobs``.
+    """
+
+    chunk_size = 1024 * 1024
+
+    @property
+    def blob_dir(self):
+        return getattr(settings, "MEDIA_BLOB_DIR", ".blobs")
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()[:16]
+        return f"{self.blob_dir}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        tmp_dir = self.path(f"{self.blob_dir}/tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+        digest = hashlib.sha256()
+        size = 0
+        with open(tmp_path, "wb") as tmp:
+            for chunk in content.chunks(self.chunk_size):
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                size += len(chunk)
+                tmp.write(chunk)
+        digest = digest.hexdigest()
+
+        blob = self._store_blob(digest, name, tmp_path, size)
+        blob_path = self.path(blob.path)
+        if not os.path.exists(blob_path):
+            # The blob file was collected while its row was unreferenced
+            self._move_into_place(tmp_path, blob_path)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        # get_available_name() picked a free name; a concurrent writer may
+        # still take it first, in which case pick another one
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        while True:
+            try:
+                self._link(blob_path, full_path)
+                break
+            except FileExistsError:
+                name = self.get_available_name(name)
+                full_path = self.path(name)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+        from home.models import StoredBlob, StoredFile
+
+        stored_name = name.replace("\\", "/")
+        try:
+            with transaction.atomic():
+                # A row left by a name that was removed outside this storage:
+                # the name was free on disk, so the row no longer holds its blob
+                stale = StoredFile.objects.select_for_update().filter(name=stored_name).first()
+                if stale is not None:
+                    stale.delete()
+                    StoredBlob.objects.filter(id=stale.blob_id).update(
+                        ref_count=F("ref_count") - 1
+                    )
+                StoredFile.objects.create(name=stored_name, blob=blob)
+        except Exception:
+            # Give back the name and the reference taken above
+            os.remove(full_path)
+            StoredBlob.objects.filter(id=blob.id).update(ref_count=F("ref_count") - 1)
+            raise
+        return str(name).replace("\\", "/")
+
+    def _store_blob(self, digest, name, tmp_path, size):
+        """Find or create the blob of a content and take a reference to it."""
+        from home.models import StoredBlob
+
+        with transaction.atomic():
+            # Locked, so a blob being collected is seen gone once it is
+            blob, created = StoredBlob.objects.select_for_update().get_or_create(
+                digest=digest,
+                defaults={"path": self.blob_name(digest, name), "size": size, "ref_count": 1},
+            )
+            if not created:
+                StoredBlob.objects.filter(id=blob.id).update(ref_count=F("ref_count") + 1)
+        if created:
+            self._move_into_place(tmp_path, self.path(blob.path))
+        return blob
+
+    def _move_into_place(self, tmp_path, blob_path):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(tmp_path, blob_path)
+
+    def _link(self, blob_path, full_path):
+        try:
+            os.link(blob_path, full_path)
+        except FileExistsError:
+            raise
+        except OSError as e:
+            # No hard links here (or too many of them): keep a full copy
+            logger.warning(f"Could not link {full_path} to its blob, copying: {str(e)}")
+            if os.path.exists(full_path):
+                raise FileExistsError(full_path)
+            shutil.copyfile(blob_path, full_path)
+
+    def delete(self, name):
+        from home.models import StoredBlob, StoredFile
+
+        super().delete(name)
+        with transaction.atomic():
+            stored = StoredFile.objects.filter(name=name).first()
+            if stored is not None:
+                stored.delete()
+                StoredBlob.objects.filter(id=stored.blob_id).update(
+                    ref_count=F("ref_count") - 1
+                )
+
+    def adopt(self, name, digest=None):
+        """
+        Index an existing file (saved before this storage was in use) and
+        replace it with a link to the blob of its content.
+
+        Returns:
+            (blob, bytes_saved) where bytes_saved is the file's size if its
+            content was already stored, 0 otherwise
+        """
+        from home.models import StoredBlob, StoredFile
+
+        if StoredFile.objects.filter(name=name).exists():
+            return None, 0
+
+        full_path = self.path(name)
+        digest = digest or hash_file(full_path)
+        size = os.path.getsize(full_path)
+        with transaction.atomic():
+            # Locked, so a blob being collected is seen gone once it is
+            blob, created = StoredBlob.objects.select_for_update().get_or_create(
+                digest=digest,
+                defaults={"path": self.blob_name(digest, name), "size": size, "ref_count": 1},
+            )
+            if not created:
+                StoredBlob.objects.filter(id=blob.id).update(ref_count=F("ref_count") + 1)
+            StoredFile.objects.create(name=name, blob=blob)
+
+        blob_path = self.path(blob.path)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.link(full_path, blob_path)
+            return blob, 0
+        if os.path.samefile(blob_path, full_path):
+            return blob, 0
+
+        # Swap the copy for a link to the blob atomically
+        tmp_path = self.path(f"{self.blob_dir}/tmp/{uuid.uuid4().hex}")
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        os.link(blob_path, tmp_path)
+        os.replace(tmp_path, full_path)
+        return blob, size
@@ -31,14 +31,10 @@ def profile_view(request):
 
     # Get recent posts
     from home.models import Post
-    from home.views import format_content_with_mentions
 
+    # Rendered with mentions when saved (Post.formatted_content)
     recent_posts = Post.objects.filter(user=request.user).order_by('-created_at')[:5]
 
-    # Format post content with mentions
-    for post in recent_posts:
-        post.formatted_content = format_content_with_mentions(post.content)
-
     context = {
         'profile': profile,
         'profile_user': request.user,  # Add profile_user to match the template's expectations
@@ -563,14 +559,10 @@ def public_profile_view(request, username):
 
     # Get recent posts
     from home.models import Post
-    from home.views import format_content_with_mentions
 
+    # Rendered with mentions when saved (Post.formatted_content)
     recent_posts = Post.objects.filter(user=user).order_by('-created_at')[:5]
 
-    # Format post content with mentions
-    for post in recent_posts:
-        post.formatted_content = format_content_with_mentions(post.content)
-
     context['recent_posts'] = recent_posts
 
     # Add visibility flags to context